@@ -1,5 +1,6 @@
-from random import seed, randint
-from .utils import Student, College, Dzone, Route, manhattan_distance, generate_location
+from .utils import Student, College, Dzone, Route, generate_location, generate_free_location, routed_applicant_index, student_location_index, catchment_index, dzone_index
+from .spatial import FreeSpaceSampler
+from .streams import python_rng
 
 
 def initialise(random_seed, grid_size=1000,
@@ -11,9 +12,16 @@ def initialise(random_seed, grid_size=1000,
         verbose=False, randomised=True, restricted=False, shuffle_student_preferences=True,
         enable_routes=True, enable_ties=False, enable_incomplete_lists=False
 ):
-    """Function to initialise all students and colleges randomly with routes and local students."""
-    # Set random seed
-    seed(random_seed)
+    """Function to initialise all students and colleges randomly with routes and local students.
+
+    Every component draws from its own stream derived from `random_seed` (an int or a numpy
+    `SeedSequence`), so the global `random` state is never used and instances can be generated
+    concurrently with reproducible results. With `enable_ties=True` ties in priority are broken
+    by one lottery shared by every college instead of student order.
+    """
+    # Independent random streams per component
+    rng = {component:python_rng(random_seed, component)
+           for component in ("sizes", "colleges", "dzones", "students", "preferences")}
 
     # Set number, size and location of disadvantaged zones
     # n_dzones = randint(min_dzones,max_dzones) if randomised else n_dzones
@@ -24,19 +32,19 @@ def initialise(random_seed, grid_size=1000,
     #     d_zones.append((dzone_coords,dzone_radius))
 
     # Randomly generated number of participants, routes and dzones
-    n_students = randint(
+    n_students = rng["sizes"].randint(
         min_students,max_students
         ) if randomised else n_students
     
-    n_colleges = randint(
+    n_colleges = rng["sizes"].randint(
         min_colleges,max_colleges
         ) if randomised else n_colleges
     
-    n_dzones = randint(
+    n_dzones = rng["sizes"].randint(
         min_dzones,max_dzones
         ) if randomised else n_dzones
     
-    n_routes = randint(
+    n_routes = rng["sizes"].randint(
         int(min_routes*n_colleges*n_dzones),
         int(max_routes*n_colleges*n_dzones)
         ) if randomised else n_colleges*n_dzones
@@ -53,7 +61,7 @@ def initialise(random_seed, grid_size=1000,
           "-"*50, sep="\n") if verbose else None
 
     # Capacities of colleges and routes
-    c_caps = {c:randint(
+    c_caps = {c:rng["sizes"].randint(
         max(
             class_size,
             class_size*int((min_college_capacity*n_students)/(n_colleges*class_size))
@@ -65,7 +73,7 @@ def initialise(random_seed, grid_size=1000,
         ) for c in college_names
     } if randomised else {c:c_cap for c in college_names}
 
-    r_caps = {r:randint(
+    r_caps = {r:rng["sizes"].randint(
         max(30,30*int((min_route_capacity*n_students)/(n_colleges*30))),
         max(30,30*int((max_route_capacity*n_students)/(n_colleges*30)))
         ) for r in route_names
@@ -98,51 +106,53 @@ def initialise(random_seed, grid_size=1000,
     students = {
         s:Student(
             s,
-            generate_location(0,grid_size,0,grid_size)
+            generate_location(rng["students"],0,grid_size,0,grid_size),
+            rng=rng["students"]
         ) for s in student_names
     }
 
     # Assign college location ensuring no co-location
     college_locations = dict()
+    taken = set()
     for c in college_names:
-        location = generate_location(0,grid_size,0,grid_size)
-        while location in college_locations.values():
-            location = generate_location(0,grid_size,0,grid_size)
-        college_locations[c] = location
+        college_locations[c] = generate_free_location(rng["colleges"], grid_size, taken)
+        taken.add(college_locations[c])
         pass
 
     colleges = {
         c:College(
             c,
             college_locations[c],
-            randint(
+            rng["colleges"].randint(
                 int(min_catchment_area*grid_size),
                 int(max_catchment_area*grid_size)
                 ),
             c_caps[c],
-            college_routes[c]
+            college_routes[c],
+            rng=rng["colleges"]
         ) for c in college_names
     }
 
     # Assign dzone location ensuring no co-location or overlap with high quality college catchment areas
+    high_quality = [college for college in colleges.values() if college.quality >= 0.5]
+    free_space = FreeSpaceSampler(
+        grid_size,
+        [college.location[0] for college in high_quality],
+        [college.location[1] for college in high_quality],
+        [college.catchment_area + int(max_dzone_radius*grid_size) for college in high_quality]
+    )
     dzone_locations = dict()
+    taken = set()
     for d in dzone_names:
-        location = generate_location(0,grid_size,0,grid_size)
-        while location in dzone_locations.values() or any(
-            manhattan_distance(location,college.location)
-            <= college.catchment_area + int(max_dzone_radius*grid_size)
-            for college in colleges.values()
-            if college.quality >= 0.5
-        ):
-            location = generate_location(0,grid_size,0,grid_size)
-        dzone_locations[d] = location
+        dzone_locations[d] = generate_free_location(rng["dzones"], grid_size, taken, free_space)
+        taken.add(dzone_locations[d])
         pass
 
     dzones = {
         d:Dzone(
             d,
             dzone_locations[d],
-            randint(
+            rng["dzones"].randint(
                 int(min_dzone_radius*grid_size),
                 int(max_dzone_radius*grid_size)
                 ),
@@ -160,21 +170,32 @@ def initialise(random_seed, grid_size=1000,
     }
 
     for s in student_names:
-        students[s].set_location(grid_size, colleges)
+        students[s].set_location(grid_size, colleges, rng["students"])
         pass
 
+    catchments = catchment_index(colleges)
+    dzone_areas = dzone_index(dzones)
     for s in student_names:
-        students[s].set_locality_and_dzones(colleges, dzones)
+        students[s].set_locality_and_dzones(colleges, dzones, catchment_index=catchments, dzone_index=dzone_areas)
         students[s].set_preferences(
             colleges,
+            rng["preferences"],
             enable_routes=enable_routes,
             enable_ties=enable_ties,
             enable_incomplete_lists=enable_incomplete_lists
             )
         pass
     
+    # Ties in priority are broken by one lottery shared by every college
+    ties = python_rng(random_seed, "ties")
+    lottery = {s:ties.random() for s in student_names} if enable_ties else None
+
+    routed_applicants = routed_applicant_index(students)
+    student_locations = student_location_index(students)
     for c in college_names:
-        colleges[c].set_priorities(students, enable_routes=enable_routes)
+        colleges[c].set_priorities(students, enable_routes=enable_routes,
+                                   routed_applicants=routed_applicants, student_index=student_locations,
+                                   lottery=lottery)
         pass
 
     student_preferences = {s:students[s].preferences[:] for s in student_names}
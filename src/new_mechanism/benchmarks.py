@@ -0,0 +1,165 @@
+"""Scaling benchmarks for instance generation, the mechanisms and their checks.
+
+Run `python -m new_mechanism.benchmarks --output bench.jsonl` to write one JSON record per
+(scenario, size, stage), and `--compare old.jsonl` to print the time ratios against an earlier run.
+Seeds are fixed, so runs of different commits time the same instances.
+"""
+from __future__ import annotations
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tracemalloc
+from pathlib import Path
+from random import Random
+from time import perf_counter
+import numpy as np
+from .__main__ import initialise
+from .generation import generate_instance
+from . import engine, utils
+from .experiments import count_proposals
+
+SEED = 20240601
+SIZES = (50, 500, 5_000, 50_000, 200_000)
+
+# initialise() keyword arguments on top of a fixed number of students
+SCENARIOS = {
+    "baseline": {},
+    "tight": dict(min_college_capacity=0.5, max_college_capacity=0.7, min_route_capacity=0.05, max_route_capacity=0.2),
+    "many_colleges": dict(min_colleges=24, max_colleges=24, min_dzones=8, max_dzones=8, min_catchment_area=0.05, max_catchment_area=0.05),
+    "few_routes": dict(min_routes=0.2, max_routes=0.2, min_dzone_radius=0.2, max_dzone_radius=0.2),
+}
+
+# largest instances the object pipeline and its quadratic stability check are run on
+OBJECT_LIMIT = 20_000
+CHECK_LIMIT = 2_000
+
+
+def measure(stage, memory=True):
+    """Run `stage()` and return its result, wall time and peak traced memory (None if not traced)."""
+    if memory: tracemalloc.start()
+    start = perf_counter()
+    result = stage()
+    seconds = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if memory else None
+    if memory: tracemalloc.stop()
+    return result, seconds, peak
+
+
+def _commit() -> str|None:
+    try:
+        # run from the package directory, so the hash is this checkout's whatever the working directory
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).resolve().parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_scenario(scenario:str, n_students:int, seed=SEED, memory=True, object_limit=OBJECT_LIMIT, check_limit=CHECK_LIMIT):
+    """Yield one record per stage for one scenario and size."""
+    params = {**SCENARIOS[scenario], "min_students": n_students, "max_students": n_students}
+    base = {"scenario": scenario, "n_students": n_students, "seed": seed}
+
+    def record(stage, seconds, peak, **extra):
+        return {**base, "stage": stage, "seconds": seconds, "peak_bytes": peak, **extra}
+
+    # compact pipeline
+    instance, seconds, peak = measure(lambda: generate_instance(seed, **params), memory)
+    yield record("generate_instance", seconds, peak, n_preferences=len(instance.pref_options))
+    _, seconds, peak = measure(lambda: instance.pref_ranks, memory)
+    yield record("priority_ranks", seconds, peak)
+    state, seconds, peak = measure(lambda: engine.deferred_acceptance(instance), memory)
+    yield record("engine.deferred_acceptance", seconds, peak, n_proposals=state.n_proposals)
+    greedy, seconds, peak = measure(lambda: engine.greedy_matching(instance, rng=Random(seed)), memory)
+    yield record("engine.greedy_matching", seconds, peak, n_proposals=greedy.n_proposals)
+    pairs, seconds, peak = measure(lambda: engine.check_stability(instance, state), memory)
+    yield record("engine.check_stability", seconds, peak, n_blocking_pairs=len(pairs))
+    _, seconds, peak = measure(lambda: engine.dissimilarity_index(instance, state.assignment), memory)
+    yield record("engine.dissimilarity_index", seconds, peak)
+    if n_students > object_limit: return
+
+    # object pipeline, regenerated for every mechanism since the object mechanisms consume their instance
+    for mechanism in ("routed_acceptance", "greedy_matching"):
+        (student_names, _, _, student_preferences, college_priorities, students, colleges, dzones, routes), seconds, peak = measure(
+            lambda: initialise(seed, **params), memory)
+        if mechanism == "routed_acceptance":
+            yield record("initialise", seconds, peak)
+            run = lambda: utils.routed_acceptance(student_names, college_priorities, students, colleges, routes)
+        else:
+            run = lambda: utils.greedy_matching(student_names, students, colleges, routes, rng=Random(seed))
+        (_, colleges, routes, matching, unassigned, _), seconds, peak = measure(run, memory)
+        yield record(f"utils.{mechanism}", seconds, peak,
+                     n_proposals=count_proposals(student_preferences, matching, unassigned))
+        if mechanism == "routed_acceptance":
+            _, seconds, peak = measure(lambda: utils.dissimilarity_index(students, colleges), memory)
+            yield record("utils.dissimilarity_index", seconds, peak)
+            if n_students <= check_limit:
+                pairs, seconds, peak = measure(lambda: utils.check_stability(
+                    student_preferences, college_priorities, colleges, routes, matching, unassigned), memory)
+                yield record("utils.check_stability", seconds, peak, n_blocking_pairs=len(pairs))
+
+
+def run_benchmarks(sizes=SIZES, scenarios=tuple(SCENARIOS), seed=SEED, memory=True,
+                   object_limit=OBJECT_LIMIT, check_limit=CHECK_LIMIT, verbose=False):
+    """Yield a record per (scenario, size, stage), each tagged with the commit and environment."""
+    environment = {"commit": _commit(), "python": platform.python_version(), "numpy": np.__version__,
+                   "machine": platform.machine(), "memory_traced": memory}
+    for scenario in scenarios:
+        for n_students in sizes:
+            for record in run_scenario(scenario, n_students, seed, memory, object_limit, check_limit):
+                print(f"{scenario:>14} {n_students:>8} {record['stage']:<28} {record['seconds']:.4f}s",
+                      file=sys.stderr) if verbose else None
+                yield {**environment, **record}
+
+
+def load_results(path) -> list[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(baseline:list[dict], current:list[dict]) -> list[dict]:
+    """Time and memory ratios (current / baseline) of the stages present in both runs."""
+    key = lambda r: (r["scenario"], r["n_students"], r["seed"], r["stage"])
+    old = {key(r):r for r in baseline}
+    ratios = []
+    for r in current:
+        if key(r) not in old: continue
+        o = old[key(r)]
+        ratios.append({
+            "scenario": r["scenario"], "n_students": r["n_students"], "stage": r["stage"],
+            "time_ratio": r["seconds"]/o["seconds"] if o["seconds"] else None,
+            "memory_ratio": r["peak_bytes"]/o["peak_bytes"] if r["peak_bytes"] and o["peak_bytes"] else None,
+        })
+    return ratios
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc, which slows the object pipeline")
+    parser.add_argument("--object-limit", type=int, default=OBJECT_LIMIT)
+    parser.add_argument("--check-limit", type=int, default=CHECK_LIMIT)
+    parser.add_argument("--output", help="JSON lines file to write, stdout if omitted")
+    parser.add_argument("--compare", help="earlier JSON lines output to print time ratios against")
+    args = parser.parse_args(argv)
+
+    records = []
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for record in run_benchmarks(args.sizes, args.scenarios, args.seed, not args.no_memory,
+                                     args.object_limit, args.check_limit, verbose=bool(args.output)):
+            records.append(record)
+            print(json.dumps(record), file=out, flush=True)
+    finally:
+        if args.output: out.close()
+    if args.compare:
+        for r in compare(load_results(args.compare), records):
+            ratio = f"x{r['time_ratio']:.2f}" if r["time_ratio"] is not None else "-"
+            print(f"{r['scenario']:>14} {r['n_students']:>8} {r['stage']:<28} {ratio}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
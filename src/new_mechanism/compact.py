@@ -0,0 +1,427 @@
+from __future__ import annotations
+from functools import cached_property
+from inspect import signature
+import numpy as np
+from .spatial import expand_ranges
+from .utils import Student, College, Dzone, Route, extract_route, extract_college, extract_student
+
+
+def _read_only(value, dtype) -> np.ndarray:
+    """Read-only array of `value`, copied if it is a writable array the caller could still change."""
+    array = np.asarray(value, dtype=dtype)
+    writable_input = array.flags.writeable and isinstance(value, np.ndarray) and np.may_share_memory(array, value)
+    array = array.copy() if writable_input else array.view()
+    array.flags.writeable = False
+    return array
+
+
+def _frozen(array:np.ndarray) -> np.ndarray:
+    """Read-only view of an array the instance keeps writing to."""
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+class LazyPreferences:
+    """Preference lists of which only a prefix is sorted into place, the rest once a run reaches it.
+
+    `options` and `ranks` have the layout of `CompactInstance.pref_options` and `pref_ranks`, but of
+    student `s`'s entries only those from `pref_indptr[s]` up to `ends[s]` are set. `extend` sorts
+    the rest of some students' lists into place with `sort_lists`, which returns their complete
+    lists exactly as a full build sorts them, so a run reading the lists sees the same lists either way.
+
+    Args:
+        pref_indptr (np.ndarray): Offsets of the complete lists.
+        options (np.ndarray): Option buffer of the complete lists with the prefixes set.
+        ends (np.ndarray): End of the sorted prefix of every list.
+        sort_lists (callable): Takes an array of students and returns their complete lists as `(indptr, options)`.
+    """
+
+    def __init__(self, pref_indptr:np.ndarray, options:np.ndarray, ends:np.ndarray, sort_lists):
+        self.pref_indptr = np.asarray(pref_indptr, dtype=np.int64)
+        self.options = np.asarray(options, dtype=np.int32)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.sort_lists = sort_lists
+        self.n_incomplete = int(np.count_nonzero(self.ends < self.pref_indptr[1:]))
+        self.rank_of = None
+        self._ranks = None
+
+    def __repr__(self):
+        return f"LazyPreferences(students={len(self.ends)}, incomplete={self.n_incomplete})"
+
+    def bind(self, rank_of):
+        """Rank the entries with `rank_of(students, options)`, once `ranks` is first read."""
+        if self.rank_of is None: self.rank_of = rank_of
+
+    @property
+    def ranks(self) -> np.ndarray:
+        """Ranks of the set entries, laid out as `options`."""
+        if self._ranks is None:
+            self._ranks = np.full(len(self.options), -1, dtype=np.int64)
+            starts = self.pref_indptr[:-1]
+            entries = expand_ranges(starts, self.ends)
+            students = np.repeat(np.arange(len(self.ends), dtype=np.int64), self.ends - starts)
+            self._ranks[entries] = self.rank_of(students, self.options[entries])
+        return self._ranks
+
+    def extend(self, students):
+        """Sort the rest of the lists of `students` into place."""
+        students = np.unique(np.asarray(students, dtype=np.int64))
+        students = students[self.ends[students] < self.pref_indptr[students + 1]]
+        if not len(students): return
+        ends, stops = self.ends[students], self.pref_indptr[students + 1]
+        indptr, options = self.sort_lists(students)
+        options = options[expand_ranges(indptr[:-1] + ends - self.pref_indptr[students], indptr[1:])]
+        entries = expand_ranges(ends, stops)
+        self.options[entries] = options
+        if self._ranks is not None: self._ranks[entries] = self.rank_of(np.repeat(students, stops - ends), options)
+        self.ends[students] = stops
+        self.n_incomplete -= len(students)
+
+    def materialise(self):
+        """Sort every list into place."""
+        if self.n_incomplete: self.extend(np.flatnonzero(self.ends < self.pref_indptr[1:]))
+
+
+class CompactInstance:
+    """Integer-indexed instance with agents as dense ids and attributes in flat arrays.
+
+    Students, colleges, routes and dzones are numbered in the order of their name lists.
+    A preference is a single option id: `c` for college `c` and `n_colleges + r` for the
+    routed option `(r, route_college[r])`. A priority entry is `s` for student `s` and
+    `(r + 1)*n_students + s` for the routed entry `(r, s)`. Preference and priority lists
+    are stored CSR-style as one flat array per kind plus an `indptr` offset array.
+
+    The instance is immutable (its arrays are read-only), so any number of mechanism runs can
+    share it, each keeping its own `engine.MatchingState`.
+
+    `pref_options` may be a `LazyPreferences` instead, as `generation.generate_instance` builds
+    with `preference_prefix`. The engines then read the lists through `preference_prefix()` and
+    sort a list's rest into place when a run reaches it; anything reading `pref_options` or
+    `pref_ranks` sorts every list first.
+    """
+
+    def __init__(self, student_names:list[str], college_names:list[str], route_names:list[str], dzone_names:list[str],
+                 student_x:np.ndarray, student_y:np.ndarray, student_ses:np.ndarray,
+                 college_x:np.ndarray, college_y:np.ndarray, college_catchment:np.ndarray,
+                 college_capacity:np.ndarray, college_quality:np.ndarray,
+                 route_capacity:np.ndarray, route_college:np.ndarray, route_dzone:np.ndarray,
+                 dzone_x:np.ndarray, dzone_y:np.ndarray, dzone_radius:np.ndarray,
+                 pref_indptr:np.ndarray, pref_options:np.ndarray,
+                 prio_indptr:np.ndarray, prio_entries:np.ndarray):
+        self.student_names = student_names
+        self.college_names = college_names
+        self.route_names = route_names
+        self.dzone_names = dzone_names
+        self.student_x = _read_only(student_x, np.int32)
+        self.student_y = _read_only(student_y, np.int32)
+        self.student_ses = _read_only(student_ses, np.int8)
+        self.college_x = _read_only(college_x, np.int32)
+        self.college_y = _read_only(college_y, np.int32)
+        self.college_catchment = _read_only(college_catchment, np.int32)
+        self.college_capacity = _read_only(college_capacity, np.int32)
+        self.college_quality = _read_only(college_quality, np.float64)
+        self.route_capacity = _read_only(route_capacity, np.int32)
+        self.route_college = _read_only(route_college, np.int32)
+        self.route_dzone = _read_only(route_dzone, np.int32)
+        self.dzone_x = _read_only(dzone_x, np.int32)
+        self.dzone_y = _read_only(dzone_y, np.int32)
+        self.dzone_radius = _read_only(dzone_radius, np.int32)
+        self.pref_indptr = _read_only(pref_indptr, np.int64)
+        if isinstance(pref_options, LazyPreferences):
+            self.lazy, self._pref_options = pref_options, None
+        else:
+            self.lazy, self._pref_options = None, _read_only(pref_options, np.int32)
+        self.prio_indptr = _read_only(prio_indptr, np.int64)
+        self.prio_entries = _read_only(prio_entries, np.int64)
+        if self.lazy is not None: self.lazy.bind(self._rank_lookup)
+
+    def __repr__(self):
+        return (f"CompactInstance(students={self.n_students}, colleges={self.n_colleges}, "
+                f"routes={self.n_routes}, dzones={self.n_dzones})")
+
+    @property
+    def n_students(self):
+        return len(self.student_names)
+
+    @property
+    def n_colleges(self):
+        return len(self.college_names)
+
+    @property
+    def n_routes(self):
+        return len(self.route_names)
+
+    @property
+    def n_dzones(self):
+        return len(self.dzone_names)
+
+    @cached_property
+    def option_college(self) -> np.ndarray:
+        """College id of every option id."""
+        option_college = np.concatenate([np.arange(self.n_colleges, dtype=np.int32), self.route_college])
+        option_college.flags.writeable = False
+        return option_college
+
+    @property
+    def pref_options(self) -> np.ndarray:
+        """Option ids of every preference list, flat; lazy lists are sorted into place first."""
+        if self._pref_options is None:
+            self.lazy.materialise()
+            self._pref_options = _frozen(self.lazy.options)
+        return self._pref_options
+
+    @cached_property
+    def pref_ranks(self) -> np.ndarray:
+        """Cached `priority_ranks()`."""
+        if self.lazy is not None:
+            self.lazy.materialise()
+            return _frozen(self.lazy.ranks)
+        ranks = self.priority_ranks()
+        ranks.flags.writeable = False
+        return ranks
+
+    def preference_prefix(self, ranked=True) -> tuple[np.ndarray, np.ndarray|None, np.ndarray]:
+        """`pref_options`, `pref_ranks` and the end of every list as the engines read them, without sorting lazy lists.
+
+        Of student `s`'s entries those from `pref_indptr[s]` up to `ends[s]` are set; a run that reaches
+        `ends[s]` before the end of the list calls `extend_preferences` to sort the rest into place,
+        which updates the returned arrays. With `ranked=False` the ranks are None and not computed.
+        """
+        if self.lazy is None: return self.pref_options, self.pref_ranks if ranked else None, self.pref_indptr[1:]
+        return _frozen(self.lazy.options), _frozen(self.lazy.ranks) if ranked else None, _frozen(self.lazy.ends)
+
+    def extend_preferences(self, students):
+        """Sort the rest of the lazy preference lists of `students` into place."""
+        if self.lazy is not None: self.lazy.extend(students)
+
+    def replace(self, **changes) -> CompactInstance:
+        """Copy of the instance with some constructor arguments replaced; the other arrays are shared.
+
+        A copy with the same preference and priority lists shares lazy lists instead of sorting them.
+        """
+        names = [name for name in signature(CompactInstance.__init__).parameters if name != "self"]
+        args = {name:getattr(self, name) for name in names if name not in changes and name != "pref_options"}
+        if "pref_options" not in changes:
+            share = self.lazy is not None and not changes.keys() & {"pref_indptr", "prio_indptr", "prio_entries"}
+            args["pref_options"] = self.lazy if share else self.pref_options
+        return CompactInstance(**args, **changes)
+
+    def with_capacities(self, college_capacity=None, route_capacity=None) -> CompactInstance:
+        """Copy of the instance with new college and/or route capacities, sharing the cached rank tables."""
+        instance = self.replace(
+            college_capacity=self.college_capacity if college_capacity is None else college_capacity,
+            route_capacity=self.route_capacity if route_capacity is None else route_capacity
+        )
+        for name in ("pref_ranks", "option_college"):
+            if name in self.__dict__: instance.__dict__[name] = self.__dict__[name]
+        return instance
+
+    def without_students(self, names) -> CompactInstance:
+        """Copy of the instance without the named students, dropped from every priority list."""
+        names = set(names)
+        keep = np.array([name not in names for name in self.student_names], dtype=bool)
+        new_id = np.cumsum(keep) - 1
+        n_students, n_kept = self.n_students, int(keep.sum())
+
+        lengths = np.diff(self.pref_indptr)[keep]
+        pref_indptr = np.zeros(n_kept + 1, dtype=np.int64)
+        np.cumsum(lengths, out=pref_indptr[1:])
+        pref_options = self.pref_options[np.repeat(keep, np.diff(self.pref_indptr))]
+
+        route, student = np.divmod(self.prio_entries, n_students)
+        entry_kept = keep[student]
+        prio_college = np.repeat(np.arange(self.n_colleges), np.diff(self.prio_indptr))[entry_kept]
+        prio_indptr = np.zeros(self.n_colleges + 1, dtype=np.int64)
+        np.cumsum(np.bincount(prio_college, minlength=self.n_colleges), out=prio_indptr[1:])
+        prio_entries = route[entry_kept]*n_kept + new_id[student[entry_kept]]
+
+        return self.replace(
+            student_names=[name for name,k in zip(self.student_names, keep) if k],
+            student_x=self.student_x[keep], student_y=self.student_y[keep], student_ses=self.student_ses[keep],
+            pref_indptr=pref_indptr, pref_options=pref_options,
+            prio_indptr=prio_indptr, prio_entries=prio_entries
+        )
+
+    def preferences(self, s:int) -> np.ndarray:
+        """Option ids on student `s`'s preference list, best first."""
+        return self.pref_options[self.pref_indptr[s]:self.pref_indptr[s+1]]
+
+    def priorities(self, c:int) -> np.ndarray:
+        """Priority entries on college `c`'s priority list, highest first."""
+        return self.prio_entries[self.prio_indptr[c]:self.prio_indptr[c+1]]
+
+    def priority_ranks(self, last=True) -> np.ndarray:
+        """Rank of every preference entry in its college's priority list, aligned with `pref_options`.
+
+        When an entry is listed more than once the last position counts, matching the
+        `{priority:rank ...}` tables built in `college_oversubscription`, or the first one
+        with `last=False`, matching the `.index` lookups of `check_stability`. Entries missing
+        from the college's list get rank -1.
+        """
+        pref_student = np.repeat(np.arange(self.n_students, dtype=np.int64), np.diff(self.pref_indptr))
+        return self._rank_lookup(pref_student, self.pref_options, self._rank_table(last))
+
+    def _rank_table(self, last=True) -> tuple[np.ndarray, np.ndarray]:
+        """Sorted (college, entry) keys of the priority lists and the rank of each."""
+        if last and "_last_rank_table" in self.__dict__: return self.__dict__["_last_rank_table"]
+        stride = (self.n_routes + 1)*self.n_students
+        prio_college = np.repeat(np.arange(self.n_colleges, dtype=np.int64), np.diff(self.prio_indptr))
+        prio_keys = prio_college*stride + self.prio_entries
+        prio_rank = np.arange(len(prio_keys), dtype=np.int64) - self.prio_indptr[prio_college]
+        # np.unique keeps the first occurrence, so search the reversed lists to keep the last
+        if last: prio_keys, prio_rank = prio_keys[::-1], prio_rank[::-1]
+        keys, first = np.unique(prio_keys, return_index=True)
+        table = (keys, prio_rank[first])
+        if last: self.__dict__["_last_rank_table"] = table
+        return table
+
+    def _rank_lookup(self, students:np.ndarray, options:np.ndarray, table=None) -> np.ndarray:
+        """Rank of the entry of each student for each option in the option's college's priority list, -1 if missing."""
+        keys, ranks = self._rank_table() if table is None else table
+        n_students, n_colleges = self.n_students, self.n_colleges
+        options = np.asarray(options, dtype=np.int64)
+        pref_route = np.where(options >= n_colleges, options - n_colleges + 1, 0)
+        pref_keys = (self.option_college[options].astype(np.int64)*(self.n_routes + 1) + pref_route)*n_students + students
+        pos = np.minimum(np.searchsorted(keys, pref_keys), max(len(keys) - 1, 0))
+        found = keys[pos] == pref_keys if len(keys) else np.zeros(len(pref_keys), dtype=bool)
+        return np.where(found, ranks[pos] if len(keys) else -1, -1)
+
+    def encode_option(self, preference, route_index:dict[str,int]|None=None, college_index:dict[str,int]|None=None) -> int:
+        """Convert a preference (`college` or `(route, college)`) to its option id."""
+        r = extract_route(preference)
+        if r: return self.n_colleges + (route_index[r] if route_index is not None else self.route_names.index(r))
+        c = extract_college(preference)
+        return college_index[c] if college_index is not None else self.college_names.index(c)
+
+    def decode_option(self, o:int):
+        """Convert an option id back to a preference (`college` or `(route, college)`)."""
+        if o < self.n_colleges: return self.college_names[o]
+        r = o - self.n_colleges
+        return (self.route_names[r], self.college_names[self.route_college[r]])
+
+    def decode_entry(self, e:int):
+        """Convert a priority entry back to a priority (`student` or `(route, student)`)."""
+        r, s = divmod(int(e), self.n_students)
+        if r: return (self.route_names[r-1], self.student_names[s])
+        return self.student_names[s]
+
+    def decode_matching(self, assignment) -> dict:
+        """Convert an array of option ids per student (-1 for unassigned) to a matching dict."""
+        return {self.student_names[s]:self.decode_option(o) for s,o in enumerate(assignment) if o >= 0}
+
+    @classmethod
+    def from_objects(cls, students:dict[str,Student], colleges:dict[str,College],
+                     dzones:dict[str,Dzone], routes:dict[str,Route]) -> CompactInstance:
+        """Build a compact instance from the `students`, `colleges`, `dzones` and `routes` dicts of `initialise()`.
+
+        Capacities, preferences and priorities are read as they currently are, so convert before running
+        a mechanism that consumes them.
+        """
+        student_names, college_names = list(students), list(colleges)
+        route_names, dzone_names = list(routes), list(dzones)
+        student_index = {s:i for i,s in enumerate(student_names)}
+        college_index = {c:i for i,c in enumerate(college_names)}
+        route_index = {r:i for i,r in enumerate(route_names)}
+        dzone_index = {d:i for i,d in enumerate(dzone_names)}
+        n_students, n_colleges = len(student_names), len(college_names)
+
+        route_college = np.full(len(route_names), -1, dtype=np.int32)
+        route_dzone = np.full(len(route_names), -1, dtype=np.int32)
+        for r,route in routes.items():
+            if len(route.college) > 1 or len(route.dzone) > 1:
+                raise ValueError(f"Route {r} serves more than one college or dzone.")
+            if route.college: route_college[route_index[r]] = college_index[route.college[0]]
+            if route.dzone: route_dzone[route_index[r]] = dzone_index[route.dzone[0]]
+
+        pref_indptr = np.zeros(n_students + 1, dtype=np.int64)
+        pref_options = []
+        for i,s in enumerate(students.values()):
+            for p in s.preferences:
+                o = n_colleges + route_index[r] if (r:=extract_route(p)) else college_index[p]
+                if r and route_college[o - n_colleges] != college_index[extract_college(p)]:
+                    raise ValueError(f"Preference {p} of {s} uses a route that does not serve its college.")
+                pref_options.append(o)
+            pref_indptr[i+1] = len(pref_options)
+
+        prio_indptr = np.zeros(n_colleges + 1, dtype=np.int64)
+        prio_entries = []
+        for i,c in enumerate(colleges.values()):
+            for p in c.priorities:
+                r = extract_route(p)
+                prio_entries.append((route_index[r] + 1 if r else 0)*n_students + student_index[extract_student(p)])
+            prio_indptr[i+1] = len(prio_entries)
+
+        return cls(
+            student_names, college_names, route_names, dzone_names,
+            [s.location[0] for s in students.values()],
+            [s.location[1] for s in students.values()],
+            [s.SES for s in students.values()],
+            [c.location[0] for c in colleges.values()],
+            [c.location[1] for c in colleges.values()],
+            [c.catchment_area for c in colleges.values()],
+            [c.capacity for c in colleges.values()],
+            [c.quality for c in colleges.values()],
+            [routes[r].capacity for r in route_names],
+            route_college, route_dzone,
+            [d.location[0] for d in dzones.values()],
+            [d.location[1] for d in dzones.values()],
+            [d.radius for d in dzones.values()],
+            pref_indptr, pref_options,
+            prio_indptr, prio_entries
+        )
+
+    def to_objects(self):
+        """Rebuild the objects of this instance, returned in the same order as `initialise()`."""
+        route_names, college_names, dzone_names = self.route_names, self.college_names, self.dzone_names
+        route_college, route_dzone = self.route_college.tolist(), self.route_dzone.tolist()
+
+        colleges = {
+            c:College(
+                c,
+                (int(self.college_x[i]), int(self.college_y[i])),
+                int(self.college_catchment[i]),
+                int(self.college_capacity[i]),
+                [r for r,rc in zip(route_names, route_college) if rc == i],
+                quality=float(self.college_quality[i])
+            ) for i,c in enumerate(college_names)
+        }
+        dzones = {
+            d:Dzone(
+                d,
+                (int(self.dzone_x[i]), int(self.dzone_y[i])),
+                int(self.dzone_radius[i]),
+                [r for r,rd in zip(route_names, route_dzone) if rd == i]
+            ) for i,d in enumerate(dzone_names)
+        }
+        routes = {
+            r:Route(
+                r,
+                int(self.route_capacity[i]),
+                [college_names[route_college[i]]] if route_college[i] >= 0 else [],
+                [dzone_names[route_dzone[i]]] if route_dzone[i] >= 0 else []
+            ) for i,r in enumerate(route_names)
+        }
+        students = {
+            s:Student(
+                s,
+                (int(self.student_x[i]), int(self.student_y[i])),
+                SES=int(self.student_ses[i])
+            ) for i,s in enumerate(self.student_names)
+        }
+
+        pref_indptr, pref_options = self.pref_indptr.tolist(), self.pref_options.tolist()
+        options = [self.decode_option(o) for o in range(self.n_colleges + self.n_routes)]
+        for i,s in enumerate(students.values()):
+            s.set_locality_and_dzones(colleges, dzones)
+            s.preferences = [options[o] for o in pref_options[pref_indptr[i]:pref_indptr[i+1]]]
+
+        prio_indptr, prio_entries = self.prio_indptr.tolist(), self.prio_entries.tolist()
+        for i,c in enumerate(colleges.values()):
+            c.priorities = [self.decode_entry(e) for e in prio_entries[prio_indptr[i]:prio_indptr[i+1]]]
+
+        student_preferences = {s:students[s].preferences[:] for s in self.student_names}
+        college_priorities = {c:colleges[c].priorities[:] for c in college_names}
+
+        return (self.student_names[:], college_names[:], route_names[:], student_preferences, college_priorities,
+                students, colleges, dzones, routes)
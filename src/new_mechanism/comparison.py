@@ -0,0 +1,107 @@
+from __future__ import annotations
+import numpy as np
+from .compact import CompactInstance
+
+
+def _assignment_matrix(instance:CompactInstance, matchings) -> np.ndarray:
+    """Students x K array of option ids (-1 for unassigned) from `MatchingState`s or assignment arrays."""
+    columns = [np.asarray(getattr(m, "assignment", m), dtype=np.int64) for m in matchings]
+    if any(len(a) != instance.n_students for a in columns): raise ValueError("Matchings must contain the same agents.")
+    return np.stack(columns, axis=1) if columns else np.empty((instance.n_students, 0), dtype=np.int64)
+
+
+def rank_matrix(instance:CompactInstance, matchings) -> np.ndarray:
+    """Position of each student's match on their preference list, one column per matching.
+
+    Matches are looked up as options, so a routed match is ranked where its route appears on the
+    list. Unassigned students get the length of their list, below every option they listed, so
+    they tie with each other and lose to any match.
+
+    Args:
+        instance (CompactInstance): The instance the matchings were made on.
+        matchings (list): `MatchingState`s or arrays of option ids per student (-1 for unassigned).
+
+    Returns:
+        ranks (np.ndarray): students x K int32 array.
+    """
+    assignment = _assignment_matrix(instance, matchings)
+    n_options = instance.n_colleges + instance.n_routes
+    lengths = np.diff(instance.pref_indptr)
+    students = np.repeat(np.arange(instance.n_students, dtype=np.int64), lengths)
+    # first position of every (student, option) pair, as `list.index` would find it
+    keys, first = np.unique(students*n_options + instance.pref_options, return_index=True)
+    positions = first - instance.pref_indptr[students[first]]
+
+    ranks = np.broadcast_to(lengths[:,None], assignment.shape).astype(np.int32)
+    s, k = np.nonzero(assignment >= 0)
+    wanted = s*n_options + assignment[s,k]
+    pos = np.minimum(np.searchsorted(keys, wanted), max(len(keys) - 1, 0))
+    if len(wanted) and not (keys[pos] == wanted).all(): raise ValueError("A student is matched to an option they did not list.")
+    ranks[s,k] = positions[pos]
+    return ranks
+
+
+def quality_matrix(instance:CompactInstance, matchings) -> np.ndarray:
+    """Quality of each student's college, one column per matching, -inf for unassigned students."""
+    assignment = _assignment_matrix(instance, matchings)
+    quality = np.full(assignment.shape, -np.inf)
+    matched = assignment >= 0
+    quality[matched] = instance.college_quality[instance.option_college[assignment[matched]]]
+    return quality
+
+
+def _pairwise(values:np.ndarray, block_size:int):
+    """Yield the students x K x K blocks `values[:,i,None]` against `values[:,None,:]`."""
+    n, K = values.shape
+    step = max(1, block_size//max(K*K, 1))
+    for start in range(0, n, step):
+        block = values[start:start + step]
+        yield block[:,:,None], block[:,None,:]
+
+
+def pareto_dominance(ranks:np.ndarray, block_size=2**24) -> np.ndarray:
+    """Pairwise Pareto dominance between the matchings of a rank matrix.
+
+    `dominance[i, j]` is True when every student does at least as well in matching i as in
+    matching j and one does strictly better, i.e. `compare_Pareto_performance(m_j, m_i)`.
+    Students are processed in blocks of about `block_size` comparisons.
+    """
+    K = ranks.shape[1]
+    weakly_better = np.ones((K, K), dtype=bool)
+    strictly_better = np.zeros((K, K), dtype=bool)
+    for a,b in _pairwise(ranks, block_size):
+        weakly_better &= (a <= b).all(axis=0)
+        strictly_better |= (a < b).any(axis=0)
+    return weakly_better & strictly_better
+
+
+def improvement_shares(values:np.ndarray, block_size=2**24) -> np.ndarray:
+    """Share of students with a strictly higher value in matching i than in matching j, for every pair (i, j).
+
+    With `quality_matrix` values this is the share `compare_college_quality` reports per pair; with
+    negated `rank_matrix` values it is the share of students preferring their match in i.
+    """
+    n, K = values.shape
+    counts = np.zeros((K, K), dtype=np.int64)
+    for a,b in _pairwise(values, block_size):
+        counts += (a > b).sum(axis=0)
+    return counts/n if n else counts.astype(float)
+
+
+def compare_matchings(instance:CompactInstance, matchings, block_size=2**24) -> dict[str,np.ndarray]:
+    """Every pairwise comparison of K matchings of one instance.
+
+    Returns:
+        dict with the students x K `ranks` and `quality` matrices, the K x K `pareto_dominance`
+        relation and the K x K shares of students whose match is preferred (`preference_improvement`)
+        or at a strictly better college (`quality_improvement`) in matching i than in matching j.
+    """
+    ranks = rank_matrix(instance, matchings)
+    quality = quality_matrix(instance, matchings)
+    return {
+        "ranks": ranks,
+        "quality": quality,
+        "pareto_dominance": pareto_dominance(ranks, block_size),
+        "preference_improvement": improvement_shares(-ranks, block_size),
+        "quality_improvement": improvement_shares(quality, block_size),
+    }
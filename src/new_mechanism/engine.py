@@ -0,0 +1,1036 @@
+from __future__ import annotations
+from random import Random
+from collections import deque
+from heapq import heappush, heappop
+from time import perf_counter
+import numpy as np
+from .compact import CompactInstance
+from .spatial import expand_ranges
+from .events import Listener, PhaseTimer
+from .utils import extract_college, match_to_priority
+
+
+def dissimilarity_index(instance:CompactInstance, assignment) -> float:
+    """Calculates the dissimilarity index of an assignment of option ids (-1 for unassigned)."""
+    assignment = np.asarray(assignment)
+    ses = instance.student_ses
+    L = int(np.count_nonzero(ses == 0))
+    H = instance.n_students - L
+    if not (L and H): return 0.0
+    matched = assignment >= 0
+    c = instance.option_college[assignment[matched]]
+    h = np.bincount(c[ses[matched] == 1], minlength=instance.n_colleges)
+    l = np.bincount(c[ses[matched] == 0], minlength=instance.n_colleges)
+    return 0.5*float(np.abs(h/H - l/L).sum())
+
+
+class MatchingState:
+    """Mutable state of one mechanism run on a shared `CompactInstance`.
+
+    Holds everything a run changes (remaining capacities, each student's position on their
+    preference list, the option they hold and the applicants held by every college and route),
+    so any number of runs can share one instance without regenerating or copying it.
+
+    The number of high and low SES students held by each college is updated on every hold and
+    rejection, together with the sum of the colleges' |h*L - l*H| terms, so `di` is O(1) at
+    any point of a run. Engines run with `trace=True` append it to `trace` after every proposal.
+
+    Args:
+        instance (CompactInstance): The instance to run on. It is never modified.
+        college_capacity (array-like, optional): Starting college capacities. Defaults to the instance's.
+        route_capacity (array-like, optional): Starting route capacities. Defaults to the instance's.
+        order (iterable, optional): Order in which students first propose. Defaults to id order.
+    """
+
+    def __init__(self, instance:CompactInstance, college_capacity=None, route_capacity=None, order=None):
+        self.instance = instance
+        self.college_capacity = list(map(int, instance.college_capacity if college_capacity is None else college_capacity))
+        self.route_capacity = list(map(int, instance.route_capacity if route_capacity is None else route_capacity))
+        self.indptr = instance.pref_indptr.tolist()
+        self.cursor = self.indptr[:-1]
+        self.assignment = [-1]*instance.n_students
+        self.held_rank = [-1]*instance.n_students
+        self.held = [[] for _ in range(instance.n_colleges)]
+        self.route_held = [[] for _ in range(instance.n_routes)]
+        self.free = deque(range(instance.n_students) if order is None else order)
+        self.unassigned = []
+        self.n_proposals = 0
+        self.ses = instance.student_ses.tolist()
+        self.L = self.ses.count(0)
+        self.H = instance.n_students - self.L
+        self.high = [0]*instance.n_colleges
+        self.low = [0]*instance.n_colleges
+        self.spread = 0
+        self.trace = None
+
+    def __repr__(self):
+        return (f"MatchingState(matched={self.n_students - self.assignment.count(-1)}, "
+                f"free={len(self.free)}, unassigned={len(self.unassigned)}, proposals={self.n_proposals})")
+
+    @property
+    def n_students(self):
+        return len(self.assignment)
+
+    @property
+    def di(self) -> float:
+        """Dissimilarity index of the current matching."""
+        return 0.5*self.spread/(self.H*self.L) if self.H and self.L else 0.0
+
+    def tally(self, s:int, c:int, step:int):
+        """Add (`step=1`) or remove (`step=-1`) student `s` from the SES counts of college `c`."""
+        high, low = self.high, self.low
+        self.spread -= abs(high[c]*self.L - low[c]*self.H)
+        if self.ses[s]: high[c] += step
+        else: low[c] += step
+        self.spread += abs(high[c]*self.L - low[c]*self.H)
+
+    def diversity(self) -> list[float]:
+        """Share of high SES students held by each college, as `College.show_diversity`."""
+        return [h/(h + l) if h + l else 0 for h,l in zip(self.high, self.low)]
+
+    def position(self, s:int) -> int:
+        """Position on student `s`'s preference list of the option they hold or propose to next."""
+        return self.cursor[s] - self.indptr[s]
+
+    def matching(self) -> dict:
+        """The current matching as a `{student:preference}` dict."""
+        return self.instance.decode_matching(self.assignment)
+
+    def unassigned_names(self) -> list[str]:
+        return [self.instance.student_names[s] for s in self.unassigned]
+
+    def to_objects(self):
+        """Objects of the instance after this run, returned like `routed_acceptance()` followed by its inputs.
+
+        Capacities are the remaining ones and every college's `assigned_students` lists the priorities
+        of the applicants it holds, so the objects can be passed to `utils.check_stability`. Matched
+        preferences are the same objects as in `student_preferences`.
+
+        Returns:
+            (student_names, college_names, route_names, student_preferences, college_priorities,
+            students, colleges, dzones, routes, matching, unassigned)
+        """
+        objects = self.instance.to_objects()
+        student_names, college_names, route_names, student_preferences, _, students, colleges, _, routes = objects
+        matching = {}
+        for s,o in enumerate(self.assignment):
+            if o < 0: continue
+            name = student_names[s]
+            p = student_preferences[name][self.position(s)]
+            matching[name] = p
+            c = extract_college(p)
+            students[name].assign_college(c)
+            colleges[c].assign_student(match_to_priority(name, p))
+        for c,capacity in zip(college_names, self.college_capacity): colleges[c].capacity = capacity
+        for r,capacity in zip(route_names, self.route_capacity): routes[r].capacity = capacity
+        return (*objects, matching, self.unassigned_names())
+
+
+def deferred_acceptance(instance:CompactInstance, state:MatchingState|None=None, verbose=False, trace=False,
+                        listener:Listener|None=None, exact_routes=False) -> MatchingState:
+    """Modified Deferred Acceptance on a compact instance.
+
+    Gives the same matching as `utils.routed_acceptance`, including its route capacity
+    bookkeeping, but each college's rank table is precomputed once and the applicants held
+    by every college and every route are kept in worst-first heaps, so college and route
+    rejections cost O(log capacity) regardless of the number of students.
+    The instance is not modified; the run only changes `state`.
+
+    Args:
+        instance (CompactInstance): The instance to match.
+        state (MatchingState, optional): State to run from. Defaults to a fresh one.
+        trace (bool, optional): Whether to record the dissimilarity index after every proposal in `state.trace`.
+        listener (Listener, optional): Receives every proposal, hold, rejection and exhaustion, and
+            the time spent in the "setup" and "matching" phases.
+        exact_routes (bool, optional): Count every seat a route holds against its capacity and give
+            seats back on rejection, instead of `routed_acceptance`'s bookkeeping. The matching is then
+            the one `batched_deferred_acceptance` gives. Defaults to False.
+
+    Returns:
+        state (MatchingState): the final state, with the matching in `state.assignment`
+        (option id held by each student, -1 if unassigned) and the unassigned students
+        in `state.unassigned` in the order they dropped out.
+    """
+    if state is None: state = MatchingState(instance)
+    if trace and state.trace is None: state.trace = []
+    _propose(instance, state, trace, listener, exact_routes)
+    print(f"final number of proposals: {state.n_proposals}",
+          f"maximum number of proposals: {instance.n_students*instance.n_colleges}",
+          f"ratio: {100*state.n_proposals/(instance.n_students*instance.n_colleges)}",
+          sep="\n") if verbose else None
+
+    return state
+
+
+def _propose(instance:CompactInstance, state:MatchingState, trace=False, listener:Listener|None=None,
+             exact_routes=False, reopen=None):
+    """Run the proposals of `deferred_acceptance` on `state` until no student is free.
+
+    `reopen`, if given, is called whenever no student is left; it may send students back to
+    `state.free`, and returns whether it did.
+    """
+    timer = PhaseTimer(listener)
+    listen = listener is not None
+    tally = state.tally
+    n_colleges = instance.n_colleges
+    # read in place: a resumed run only touches the entries of the students it moves,
+    # and lazy lists are sorted into place as a student reaches the end of their prefix
+    options, ranks, ends = map(memoryview, instance.preference_prefix())
+    option_college = instance.option_college.tolist()
+    c_cap, r_cap = state.college_capacity, state.route_capacity
+    indptr, cursor, free, unassigned = state.indptr, state.cursor, state.free, state.unassigned
+    assignment, held_rank, held, route_held = state.assignment, state.held_rank, state.held, state.route_held
+    n_proposals = 0
+
+    def reject(s):
+        o = assignment[s]
+        tally(s, option_college[o], -1)
+        if exact_routes:
+            c_cap[option_college[o]] += 1
+            if o >= n_colleges: r_cap[o - n_colleges] += 1
+        assignment[s] = -1
+        held_rank[s] = -1
+        cursor[s] += 1
+        if cursor[s] < indptr[s+1]: free.append(s)
+        else:
+            unassigned.append(s)
+            if listen: listener.on_exhaustion(s)
+
+    def college_worst(c):
+        # entries of students evicted by their route are left in the heap and skipped here
+        heap = held[c]
+        while True:
+            rank, s = heappop(heap)
+            if held_rank[s] == -rank and assignment[s] >= 0 and option_college[assignment[s]] == c: return s
+
+    def route_worst(r):
+        # entries of students evicted by their college are left in the heap and skipped here
+        heap = route_held[r]
+        while True:
+            rank, s = heappop(heap)
+            if held_rank[s] == -rank and assignment[s] == n_colleges + r: return s
+
+    if exact_routes:
+        # a state resumed after a capacity cut first sheds the holders over its new quotas
+        for r in range(len(r_cap)):
+            while r_cap[r] < 0:
+                w = route_worst(r)
+                if listen: listener.on_route_rejection(w, r)
+                reject(w)
+        for c in range(n_colleges):
+            while c_cap[c] < 0:
+                w = college_worst(c)
+                if listen: listener.on_college_rejection(w, c)
+                reject(w)
+    timer.lap("setup")
+    while free or (reopen is not None and reopen()):
+        s = free.popleft()
+        k = cursor[s]
+        if k == indptr[s+1]:
+            unassigned.append(s)
+            if listen: listener.on_exhaustion(s)
+            continue
+        if k == ends[s]: instance.extend_preferences([s])
+
+        n_proposals += 1
+        o = options[k]
+        c = option_college[o]
+        if listen: listener.on_proposal(s, o)
+        if ranks[k] < 0: raise KeyError(f"{instance.decode_option(o)} is not on {instance.college_names[c]}'s priority list.")
+
+        # tentative matching
+        assignment[s] = o
+        held_rank[s] = ranks[k]
+        heappush(held[c], (-ranks[k], s))
+        tally(s, c, 1)
+        if listen: listener.on_hold(s, o)
+
+        # handle oversubscription
+        if exact_routes:
+            r = o - n_colleges
+            c_cap[c] -= 1
+            if r >= 0:
+                heappush(route_held[r], (-ranks[k], s))
+                r_cap[r] -= 1
+            if r >= 0 and r_cap[r] < 0:
+                w = route_worst(r)
+                if listen: listener.on_route_rejection(w, r)
+                reject(w)
+            elif c_cap[c] < 0:
+                w = college_worst(c)
+                if listen: listener.on_college_rejection(w, c)
+                reject(w)
+        elif o >= n_colleges:
+            r = o - n_colleges
+            heappush(route_held[r], (-ranks[k], s))
+            if r_cap[r] and c_cap[c]:
+                r_cap[r] -= 1; c_cap[c] -= 1
+            elif r_cap[r]:
+                w = college_worst(c)
+                if listen: listener.on_college_rejection(w, c)
+                reject(w)
+            else:
+                w = route_worst(r)
+                if listen: listener.on_route_rejection(w, r)
+                reject(w)
+        elif c_cap[c]:
+            c_cap[c] -= 1
+        else:
+            w = college_worst(c)
+            if listen: listener.on_college_rejection(w, c)
+            reject(w)
+
+        if trace: state.trace.append(state.di)
+    timer.lap("matching")
+    state.n_proposals += n_proposals
+
+
+def greedy_matching(instance:CompactInstance, rng:Random, verbose=False, trace=False,
+                    listener:Listener|None=None) -> MatchingState:
+    """Greedy matching on a compact instance, in a random student order drawn from `rng`.
+
+    Gives the same matching as `utils.greedy_matching` with an `rng` in the same state:
+    a student is accepted by the first option with room on the college (and the route),
+    and nobody is ever evicted. The instance is not modified. With `trace=True` the dissimilarity
+    index after every proposal is recorded in `state.trace`, and a `listener` receives the same
+    events and phases as in `deferred_acceptance`.
+    """
+    timer = PhaseTimer(listener)
+    listen = listener is not None
+    order = list(range(instance.n_students))
+    rng.shuffle(order)
+    state = MatchingState(instance, order=order)
+    if trace: state.trace = []
+    n_colleges = instance.n_colleges
+    options, _, ends = instance.preference_prefix(ranked=False)
+    options, ends = memoryview(options), memoryview(ends)
+    option_college = instance.option_college.tolist()
+    c_cap, r_cap = state.college_capacity, state.route_capacity
+    indptr, cursor, free, unassigned, assignment = state.indptr, state.cursor, state.free, state.unassigned, state.assignment
+
+    timer.lap("setup")
+    while free:
+        s = free.popleft()
+        k = cursor[s]
+        if k == indptr[s+1]:
+            unassigned.append(s)
+            if listen: listener.on_exhaustion(s)
+            continue
+        if k == ends[s]: instance.extend_preferences([s])
+
+        state.n_proposals += 1
+        o = options[k]
+        c = option_college[o]
+        r = o - n_colleges
+        if listen: listener.on_proposal(s, o)
+        if c_cap[c] and (r < 0 or r_cap[r]):
+            assignment[s] = o
+            c_cap[c] -= 1
+            if r >= 0: r_cap[r] -= 1
+            state.tally(s, c, 1)
+            if listen: listener.on_hold(s, o)
+        else:
+            if listen:
+                if r >= 0 and not r_cap[r]: listener.on_route_rejection(s, r)
+                else: listener.on_college_rejection(s, c)
+            cursor[s] += 1
+            free.append(s)
+
+        if trace: state.trace.append(state.di)
+    timer.lap("matching")
+
+    print(state.di) if verbose else None
+
+    return state
+
+
+def _within_capacity(groups:np.ndarray, ranks:np.ndarray, capacity:np.ndarray) -> np.ndarray:
+    """Mask of the candidates among the best `capacity[g]` of their group `g`, by rank.
+
+    Ranks are positions on one college's priority list, so they are distinct within every group
+    whose capacity can bind and an unstable sort keeps the same candidates.
+    """
+    order = np.argsort(groups*(int(ranks.max(initial=0)) + 1) + ranks)
+    sorted_groups = groups[order]
+    sizes = np.bincount(groups, minlength=len(capacity))
+    starts = np.cumsum(sizes) - sizes
+    keep = np.empty(len(groups), dtype=bool)
+    keep[order] = np.arange(len(groups)) - starts[sorted_groups] < capacity[sorted_groups]
+    return keep
+
+
+def batched_deferred_acceptance(instance:CompactInstance, verbose=False, trace=False,
+                                listener:Listener|None=None) -> MatchingState:
+    """Round-synchronous Deferred Acceptance with route quotas, vectorised over the encoded preferences.
+
+    In every round all free students propose to their next option at once. Each college that
+    received proposals then re-selects among the students it holds and its new applicants in one
+    bulk step: every route keeps its best `route_capacity` routed applicants, and the college keeps
+    its best `college_capacity` of those left. This choice function is substitutable, so the result
+    is the student-optimal stable matching whatever the proposal order, reached in a few vectorised
+    rounds instead of one Python iteration per proposal.
+
+    Every seat a route keeps is counted against it, so the matching is the same as `deferred_acceptance`
+    whenever the latter's route bookkeeping stays exact (e.g. routes disabled or never full). The
+    sequential engine does not give back a route seat when the college evicts its holder, nor take one
+    when a routed student displaces the college's worst applicant, so with tight routes its remaining
+    route capacities drift from the quotas and its matching can differ.
+
+    Returns a `MatchingState` like `deferred_acceptance`, with `trace` holding the dissimilarity index
+    after every round. A `listener` receives every event of a round once its selection is made.
+    """
+    timer = PhaseTimer(listener)
+    state = MatchingState(instance)
+    if trace: state.trace = []
+    cursor = instance.pref_indptr[:-1].copy()
+    assignment = np.full(instance.n_students, -1, dtype=np.int64)
+    free = np.arange(instance.n_students, dtype=np.int64)
+    timer.lap("setup")
+    n_rounds = _run_rounds(instance, [state], instance.preference_prefix()[1][None], cursor, assignment, free, listener)
+    timer.lap("matching")
+    _fill_state(instance, state, cursor, assignment)
+
+    print(f"rounds: {n_rounds}", f"final number of proposals: {state.n_proposals}", sep="\n") if verbose else None
+
+    return state
+
+
+def batched_lanes(instances:list[CompactInstance], verbose=False) -> tuple[np.ndarray, list[list[int]], np.ndarray]:
+    """`batched_deferred_acceptance` on instances that differ only in their priorities and capacities, run as lanes of one run.
+
+    Lane `l` holds the copy `l*n_students + s` of every student and its colleges and routes are
+    separate quota groups, so every round selects for all the lanes in the same bulk steps, e.g. for
+    the tie-breaking lotteries of `lotteries.run_lotteries`. Only the matchings are returned, without
+    building each lane's `MatchingState` heaps.
+
+    Returns:
+        assignment (np.ndarray): lanes x students option ids, -1 for unassigned.
+        unassigned (list[list[int]]): unassigned students of every lane, in the order they dropped out.
+        n_proposals (np.ndarray): proposals made in every lane.
+    """
+    if not instances: return np.empty((0, 0), dtype=np.int64), [], np.empty(0, dtype=np.int64)
+    instance = instances[0]
+    for other in instances[1:]:
+        if not (np.array_equal(other.pref_indptr, instance.pref_indptr) and np.array_equal(other.pref_options, instance.pref_options)):
+            raise ValueError("Lanes must share the students' preference lists.")
+    n_students, n_lanes = instance.n_students, len(instances)
+    states = [MatchingState(lane) for lane in instances]
+    cursor = np.tile(instance.pref_indptr[:-1], n_lanes)
+    assignment = np.full(n_lanes*n_students, -1, dtype=np.int64)
+    free = np.arange(n_lanes*n_students, dtype=np.int64)
+    n_rounds = _run_rounds(instance, states, np.stack([lane.pref_ranks for lane in instances]), cursor, assignment, free)
+
+    print(f"lanes: {n_lanes}", f"rounds: {n_rounds}", sep="\n") if verbose else None
+
+    return (assignment.reshape(n_lanes, n_students), [state.unassigned for state in states],
+            np.array([state.n_proposals for state in states], dtype=np.int64))
+
+
+def _select(instance:CompactInstance, ranks:np.ndarray, candidates:np.ndarray, assignment:np.ndarray, cursor:np.ndarray,
+            c_cap:np.ndarray, r_cap:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Masks of the (sorted) candidates each college keeps and of those its routes keep, for route and college quotas.
+
+    Candidates are lane copies `lane*n_students + s`; every lane has its own colleges and routes,
+    with `c_cap` and `r_cap` holding one block of capacities per lane and `ranks` one row.
+    """
+    n_colleges, n_routes = instance.n_colleges, instance.n_routes
+    lane = candidates//instance.n_students
+    o = assignment[candidates]
+    c = lane*n_colleges + instance.option_college[o]
+    rank = ranks[lane, cursor[candidates]]
+    route = lane*(n_routes + 1) + np.where(o >= n_colleges, o - n_colleges, n_routes) # plain options use an extra route
+    route_kept = _within_capacity(route, rank, r_cap)
+    kept = route_kept.copy()
+    kept[route_kept] = _within_capacity(c[route_kept], rank[route_kept], c_cap)
+    return kept, route_kept
+
+
+def _reject(instance:CompactInstance, candidates, kept, route_kept, assignment, cursor,
+            listener:Listener|None=None, new:np.ndarray|None=None) -> np.ndarray:
+    """Unassign the candidates that were not kept and move their cursors on; returns them sorted."""
+    rejected = candidates[~kept]
+    if listener is not None:
+        o = assignment[candidates]
+        c = instance.option_college[o]
+        held = kept & new[candidates] if new is not None else np.zeros(len(candidates), dtype=bool)
+        for s,oo in zip(candidates[held].tolist(), o[held].tolist()): listener.on_hold(s, oo)
+        for s,cc,oo,by_route in zip(rejected.tolist(), c[~kept].tolist(), o[~kept].tolist(), (~route_kept)[~kept].tolist()):
+            if by_route: listener.on_route_rejection(s, oo - instance.n_colleges)
+            else: listener.on_college_rejection(s, cc)
+    assignment[rejected] = -1
+    cursor[rejected] += 1
+    return np.sort(rejected)
+
+
+def _run_rounds(instance:CompactInstance, states:list[MatchingState], ranks:np.ndarray, cursor:np.ndarray,
+                assignment:np.ndarray, free:np.ndarray, listener:Listener|None=None) -> int:
+    """Run proposal rounds until no student is free, updating the arrays and the states' `unassigned`,
+    `n_proposals` and `trace` in place; returns the number of rounds.
+
+    Runs one lane per state, with `ranks` holding each lane's `pref_ranks` and the arrays the lane
+    copies `lane*n_students + s` of the students (see `batched_lanes`). A `listener` is only passed
+    for a single lane. With lazy preference lists `ranks` is the instance's `preference_prefix()`
+    ranks, which the lists sorted into place as students reach the end of their prefix update.
+    """
+    n_students, n_colleges, n_lanes = instance.n_students, instance.n_colleges, len(states)
+    indptr, option_college = instance.pref_indptr, instance.option_college
+    options, _, ends = instance.preference_prefix(ranked=False)
+    c_cap = np.concatenate([np.asarray(state.college_capacity, dtype=np.int64) for state in states])
+    r_cap = np.concatenate([np.append(np.asarray(state.route_capacity, dtype=np.int64), n_students) for state in states])
+    n_rounds = 0
+
+    while len(free):
+        exhausted = cursor[free] == indptr[free % n_students + 1]
+        if exhausted.any():
+            for v in free[exhausted].tolist(): states[v//n_students].unassigned.append(v % n_students)
+            if listener is not None:
+                for s in free[exhausted].tolist(): listener.on_exhaustion(s)
+            free = free[~exhausted]
+            if not len(free): break
+
+        n_rounds += 1
+        lane = free//n_students
+        for state,n in zip(states, np.bincount(lane, minlength=n_lanes).tolist()): state.n_proposals += n
+        k = cursor[free]
+        behind = k == ends[free % n_students]
+        if behind.any(): instance.extend_preferences(free[behind] % n_students)
+        rank = ranks[lane, k]
+        if (rank < 0).any():
+            o = int(options[k[rank < 0][0]])
+            raise KeyError(f"{instance.decode_option(o)} is not on {instance.college_names[option_college[o]]}'s priority list.")
+        assignment[free] = options[k]
+        if listener is not None:
+            for s,o in zip(free.tolist(), options[k].tolist()): listener.on_proposal(s, o)
+
+        # candidates: new applicants and the students held by the colleges they applied to, in their lane
+        touched = np.zeros(n_lanes*n_colleges, dtype=bool)
+        touched[lane*n_colleges + option_college[options[k]]] = True
+        matched = np.flatnonzero(assignment >= 0)
+        candidates = matched[touched[matched//n_students*n_colleges + option_college[assignment[matched]]]]
+        kept, route_kept = _select(instance, ranks, candidates, assignment, cursor, c_cap, r_cap)
+        new = None
+        if listener is not None:
+            new = np.zeros(n_students, dtype=bool)
+            new[free] = True
+        free = _reject(instance, candidates, kept, route_kept, assignment, cursor, listener, new)
+        for l,state in enumerate(states):
+            if state.trace is not None:
+                state.trace.append(dissimilarity_index(instance, assignment[l*n_students:(l + 1)*n_students]))
+
+    return n_rounds
+
+
+def _heaps(groups:np.ndarray, ranks:np.ndarray, students:np.ndarray, n_groups:int) -> list[list]:
+    """Worst-first heaps of (-rank, student) per group; a sorted list is already a heap."""
+    order = np.lexsort((students, -ranks, groups))
+    bounds = np.searchsorted(groups[order], np.arange(n_groups + 1))
+    entries = list(zip((-ranks[order]).tolist(), students[order].tolist()))
+    return [entries[bounds[g]:bounds[g+1]] for g in range(n_groups)]
+
+
+def _fill_state(instance:CompactInstance, state:MatchingState, cursor:np.ndarray, assignment:np.ndarray):
+    """Fill a fresh `state` from the arrays of a run as the sequential engine leaves it, so it can be checked or resumed."""
+    n_colleges, n_routes = instance.n_colleges, instance.n_routes
+    matched = np.flatnonzero(assignment >= 0)
+    o = assignment[matched]
+    c = instance.option_college[o].astype(np.int64)
+    routed = o >= n_colleges
+    held_rank = instance.preference_prefix()[1][cursor[matched]]
+    state.college_capacity = (np.asarray(state.college_capacity) - np.bincount(c, minlength=n_colleges)).tolist()
+    state.route_capacity = (np.asarray(state.route_capacity, dtype=np.int64)
+                            - np.bincount(o[routed] - n_colleges, minlength=n_routes)).tolist()
+    state.cursor = cursor.tolist()
+    state.assignment = assignment.tolist()
+    state.free.clear()
+    rank = np.full(instance.n_students, -1, dtype=np.int64)
+    rank[matched] = held_rank
+    state.held_rank = rank.tolist()
+    state.held = _heaps(c, held_rank, matched, n_colleges)
+    state.route_held = _heaps(o[routed] - n_colleges, held_rank[routed], matched[routed], n_routes)
+    high = instance.student_ses[matched] == 1
+    state.high = np.bincount(c[high], minlength=n_colleges).tolist()
+    state.low = np.bincount(c[~high], minlength=n_colleges).tolist()
+    state.spread = sum(abs(h*state.L - l*state.H) for h,l in zip(state.high, state.low))
+
+
+class _Vacancies(Listener):
+    """Past rejections of a resumed run, reopened once their college or route no longer justifies them.
+
+    A rejection from an option stands while its college holds `college_capacity` students of higher
+    priority, or the option is routed and its route holds `route_capacity` of them. Rejections are
+    kept per option sorted by rank, and a college or route is only checked again once it gave a seat
+    back (a holder left, was evicted by the other quota or its capacity was raised). A college with
+    spare seats reopens its best rejections up to that number, and every rejection of a student it
+    holds through another option, since that student takes no extra seat.
+
+    Reopening rejections is a vacancy chain: colleges offer their seats down their priorities, which
+    keeps a matching stable but can leave it below the student-optimal one. Once no rejection is
+    left to reopen, cycles of students who would each take the seat another one leaves (rotations)
+    are applied until none is left, which gives the student-optimal matching. Forwards every event
+    but the phases to `listener`.
+    """
+
+    def __init__(self, instance:CompactInstance, state:MatchingState, listener:Listener|None=None):
+        self.instance = instance
+        self.state = state
+        self.listener = listener
+        self.n_colleges = instance.n_colleges
+        self.option_college = instance.option_college.tolist()
+        self.college_routes = [[] for _ in range(instance.n_colleges)]
+        for r,c in enumerate(instance.route_college.tolist()): self.college_routes[c].append(r)
+        self.dirty_colleges = set()
+        self.dirty_routes = set()
+
+        # rejections made before the run: every entry ahead of a student's position, by option then rank
+        indptr, cursor = instance.pref_indptr, np.asarray(state.cursor, dtype=np.int64)
+        entries = expand_ranges(indptr[:-1], cursor)
+        students = np.repeat(np.arange(instance.n_students, dtype=np.int64), cursor - indptr[:-1])
+        o = instance.pref_options[entries]
+        rank = instance.pref_ranks[entries]
+        order = np.lexsort((rank, o))
+        bounds = np.searchsorted(o[order], np.arange(instance.n_colleges + instance.n_routes + 1))
+        self.rejections = tuple(memoryview(np.ascontiguousarray(a[order])) for a in (rank, entries, students))
+        self.next = bounds[:-1].tolist()
+        self.end = bounds[1:].tolist()
+        self.pending = [[] for _ in range(instance.n_colleges + instance.n_routes)]
+
+        # students held by a college they were rejected by through another option
+        held = np.asarray(state.assignment, dtype=np.int64)[students]
+        college = instance.option_college[np.maximum(held, 0)]
+        returning = (held >= 0) & (instance.option_college[o] == college)
+        self.returning = [set() for _ in range(instance.n_colleges)]
+        for c,s in zip(college[returning].tolist(), students[returning].tolist()): self.returning[c].add(s)
+
+    def release(self, o:int):
+        """Mark the college and route of option `o` as having given a seat back."""
+        self.dirty_colleges.add(self.option_college[o])
+        if o >= self.n_colleges: self.dirty_routes.add(o - self.n_colleges)
+
+    def record(self, s:int):
+        state = self.state
+        o = state.assignment[s]
+        heappush(self.pending[o], (state.held_rank[s], state.cursor[s], s))
+        self.release(o)
+
+    def on_proposal(self, student, option):
+        if self.listener is not None: self.listener.on_proposal(student, option)
+
+    def on_hold(self, student, option):
+        c = self.option_college[option]
+        passed = self.instance.pref_options[self.state.indptr[student]:self.state.cursor[student]]
+        if (self.instance.option_college[passed] == c).any(): self.returning[c].add(student)
+        if self.listener is not None: self.listener.on_hold(student, option)
+
+    def on_college_rejection(self, student, college):
+        self.record(student)
+        if self.listener is not None: self.listener.on_college_rejection(student, college)
+
+    def on_route_rejection(self, student, route):
+        self.record(student)
+        if self.listener is not None: self.listener.on_route_rejection(student, route)
+
+    def on_exhaustion(self, student):
+        if self.listener is not None: self.listener.on_exhaustion(student)
+
+    def college_worst(self, c:int) -> int:
+        """Rank of the worst student college `c` holds, -1 if none."""
+        state, option_college = self.state, self.option_college
+        heap = state.held[c]
+        while heap:
+            rank, s = heap[0]
+            o = state.assignment[s]
+            if state.held_rank[s] == -rank and o >= 0 and option_college[o] == c: return -rank
+            heappop(heap)
+        return -1
+
+    def route_worst(self, r:int) -> int:
+        """Rank of the worst student route `r` holds, -1 if none."""
+        state = self.state
+        heap = state.route_held[r]
+        while heap:
+            rank, s = heap[0]
+            if state.held_rank[s] == -rank and state.assignment[s] == self.n_colleges + r: return -rank
+            heappop(heap)
+        return -1
+
+    def bound(self, o:int) -> tuple[float,float]:
+        """Rank below which rejections from option `o` no longer stand, and how many of them its spare seats take."""
+        state, n_colleges = self.state, self.n_colleges
+        c = self.option_college[o]
+        threshold, room = (float("inf"), state.college_capacity[c]) if state.college_capacity[c] > 0 else (self.college_worst(c), float("inf"))
+        if o >= n_colleges:
+            r = o - n_colleges
+            route_threshold, route_room = (float("inf"), state.route_capacity[r]) if state.route_capacity[r] > 0 else (self.route_worst(r), float("inf"))
+            threshold, room = min(threshold, route_threshold), min(room, route_room)
+        return threshold, room
+
+    def head(self, o:int) -> tuple|None:
+        """Best standing rejection (rank, entry, student) from option `o`, None if there is none."""
+        (rank, entry, student), pending, cursor = self.rejections, self.pending[o], self.state.cursor
+        i, end = self.next[o], self.end[o]
+        while i < end and entry[i] >= cursor[student[i]]: i += 1
+        self.next[o] = i
+        while pending and pending[0][1] >= cursor[pending[0][2]]: heappop(pending)
+        if i < end and (not pending or (rank[i], entry[i], student[i]) < pending[0]): return rank[i], entry[i], student[i]
+        return pending[0] if pending else None
+
+    def reopen(self) -> bool:
+        """Send back the students of the rejections that no longer stand, applying rotations once none
+        are left; returns whether any student was sent back."""
+        while not self.reclaim():
+            if not self.rotate(): return False
+        return True
+
+    def reclaim(self) -> bool:
+        state, n_colleges = self.state, self.n_colleges
+        assignment, held_rank, cursor, indptr = state.assignment, state.held_rank, state.cursor, state.indptr
+        option_college = self.option_college
+        groups = self.dirty_colleges | {n_colleges + r for r in self.dirty_routes}
+        groups |= {n_colleges + r for c in self.dirty_colleges for r in self.college_routes[c]}
+        groups |= {option_college[n_colleges + r] for r in self.dirty_routes}
+        self.dirty_colleges, self.dirty_routes = set(), set()
+
+        # a college or route takes its spare seats and then outranks its holders from the worst up, so
+        # only the rejections that would win a seat that way are reopened; the rest wait for a recheck
+        worst, popped = {}, []
+        def limit(unit, i):
+            if unit < n_colleges: capacity, heap = state.college_capacity[unit], state.held[unit]
+            else: capacity, heap = state.route_capacity[unit - n_colleges], state.route_held[unit - n_colleges]
+            if i < capacity: return float("inf")
+            ranks = worst.setdefault(unit, [])
+            while len(ranks) <= i - capacity and heap:
+                rank, s = heappop(heap)
+                popped.append((heap, (rank, s)))
+                o = assignment[s]
+                if held_rank[s] == -rank and o >= 0 and (o == unit if unit >= n_colleges else option_college[o] == unit):
+                    ranks.append(-rank)
+            return ranks[i - capacity] if i - capacity < len(ranks) else -1
+
+        back = {}
+        for o in groups:
+            units = (option_college[o], o) if o >= n_colleges else (option_college[o],)
+            taken = 0
+            while (entry := self.head(o)) is not None:
+                if any(entry[0] >= limit(u, taken) for u in units):
+                    if taken and all(entry[0] < limit(u, 0) for u in units): self.release(o)
+                    break
+                rank, k, s = entry
+                if self.next[o] < self.end[o] and self.rejections[1][self.next[o]] == k: self.next[o] += 1
+                else: heappop(self.pending[o])
+                if back.get(s) != k:
+                    back[s] = min(back.get(s, k), k)
+                    taken += 1
+        for heap, item in popped: heappush(heap, item)
+
+        # students a college with spare seats holds through a later option go back to the earlier one
+        options, ranks = self.instance.pref_options, self.instance.pref_ranks
+        for c in {option_college[o] for o in groups}:
+            if state.college_capacity[c] <= 0: continue
+            for s in list(self.returning[c]):
+                o = assignment[s]
+                if o < 0 or option_college[o] != c:
+                    self.returning[c].discard(s)
+                    continue
+                for k in range(indptr[s], cursor[s]):
+                    oo = int(options[k])
+                    if option_college[oo] == c and ranks[k] < self.bound(oo)[0]:
+                        back[s] = min(back.get(s, k), k)
+                        break
+
+        for s,k in back.items():
+            self.vacate(s)
+            cursor[s] = k
+            state.free.append(s)
+        return bool(back)
+
+    def vacate(self, s:int):
+        """Take student `s` off the option they hold, giving its seats back."""
+        state = self.state
+        o = state.assignment[s]
+        if o < 0: return
+        c = self.option_college[o]
+        state.tally(s, c, -1)
+        state.college_capacity[c] += 1
+        if o >= self.n_colleges: state.route_capacity[o - self.n_colleges] += 1
+        state.assignment[s] = -1
+        state.held_rank[s] = -1
+        self.release(o)
+
+    def entrant(self, o:int) -> tuple|None:
+        """Best standing rejection that the seats a holder of option `o` leaves would admit."""
+        state, n_colleges = self.state, self.n_colleges
+        c = self.option_college[o]
+        full = state.college_capacity[c] <= 0
+        candidates = [self.head(c)] if full else []
+        for r in self.college_routes[c]:
+            if not full and o != n_colleges + r: continue
+            entry = self.head(n_colleges + r)
+            if entry is not None and (o == n_colleges + r or state.route_capacity[r] > 0 or entry[0] < self.route_worst(r)):
+                candidates.append(entry)
+        return min((entry for entry in candidates if entry is not None), default=None)
+
+    def rotate(self) -> bool:
+        """Apply a cycle of students who each take the seats the next one leaves; returns whether one was found."""
+        state, n_colleges = self.state, self.n_colleges
+        assignment, options, ranks = state.assignment, self.instance.pref_options, self.instance.pref_ranks
+        # every held option points to the option held by the student its seats would admit
+        instance = self.instance
+        held = [r + n_colleges for r in range(instance.n_routes) if state.route_capacity[r] < instance.route_capacity[r]]
+        routed = np.bincount(instance.route_college, weights=instance.route_capacity - state.route_capacity, minlength=n_colleges)
+        held += [c for c in range(n_colleges) if state.college_capacity[c] + routed[c] < instance.college_capacity[c]]
+        entrants = {o:self.entrant(o) for o in held}
+        successor = {o:assignment[entry[2]] for o,entry in entrants.items() if entry is not None and assignment[entry[2]] >= 0}
+        visited = set()
+        for start in successor:
+            path, o = [], start
+            while o in successor and o not in visited:
+                visited.add(o)
+                path.append(o)
+                o = successor[o]
+            if o not in path: continue
+            cycle = [entrants[oo] for oo in path[path.index(o):]]
+            for rank, k, s in cycle: self.vacate(s)
+            for rank, k, s in cycle:
+                o = int(options[k])
+                c = self.option_college[o]
+                state.cursor[s] = k
+                assignment[s] = o
+                state.held_rank[s] = int(ranks[k])
+                heappush(state.held[c], (-state.held_rank[s], s))
+                state.college_capacity[c] -= 1
+                if o >= n_colleges:
+                    heappush(state.route_held[o - n_colleges], (-state.held_rank[s], s))
+                    state.route_capacity[o - n_colleges] -= 1
+                state.tally(s, c, 1)
+                self.on_hold(s, o)
+            state.n_proposals += len(cycle)
+            return True
+        return False
+
+
+def rematch(state:MatchingState, instance:CompactInstance, listener:Listener|None=None) -> tuple[MatchingState, set[str]]:
+    """Warm-start re-matching of `state` after its instance changed into `instance`.
+
+    `instance` may change capacities (`with_capacities`), drop students (`without_students`) or add
+    students, matched to the old ones by name; colleges and routes must be the same. Students keep
+    their place on their (unchanged) preference lists; colleges and routes over their new capacities
+    reject their worst holders; and the proposals of `deferred_acceptance(exact_routes=True)` run
+    from there. Whenever a college or route gives a seat back (a holder left, was removed or was
+    evicted by the other quota, or its capacity was raised), only its past rejections that would
+    now win a seat are reopened, best first, and their students go back to the rejected option.
+    Once none is left, cycles of students who each take the seat the next one leaves are applied,
+    which a chain of reopened seats alone can miss. Past the O(S) copy of the state, the work is
+    that of the proposal and rejection chains the change starts. Starting from a
+    `batched_deferred_acceptance` (or exact `deferred_acceptance`) state, the result is the matching
+    they give on `instance`.
+
+    Returns:
+        state (MatchingState): a new state on `instance`; the old one is not modified.
+        changed (set[str]): students of `instance` whose option differs from the one they held, new students included.
+    """
+    old = state.instance
+    if (old.college_names != instance.college_names or old.route_names != instance.route_names
+            or not np.array_equal(old.route_college, instance.route_college)):
+        raise ValueError("Re-matching needs the same colleges and routes.")
+    timer = PhaseTimer(listener)
+    old_index = {name:i for i,name in enumerate(old.student_names)}
+    old_id = np.array([old_index.get(name, -1) for name in instance.student_names], dtype=np.int64)
+    old_position = np.asarray(state.cursor, dtype=np.int64) - old.pref_indptr[:-1]
+    old_assignment = np.asarray(state.assignment, dtype=np.int64)
+
+    # carry over the position and option of every student whose list is unchanged
+    indptr = instance.pref_indptr
+    lengths = np.diff(indptr)
+    i = np.maximum(old_id, 0)
+    same = (old_id >= 0) & (np.diff(old.pref_indptr)[i] == lengths)
+    mismatches = np.bincount(
+        np.repeat(np.arange(instance.n_students), np.where(same, lengths, 0)),
+        weights=old.pref_options[expand_ranges(old.pref_indptr[i][same], old.pref_indptr[i + 1][same])]
+                != instance.pref_options[expand_ranges(indptr[:-1][same], indptr[1:][same])],
+        minlength=instance.n_students
+    )
+    same &= mismatches == 0
+    cursor = indptr[:-1] + np.where(same, old_position[i], 0)
+    assignment = np.where(same, old_assignment[i], -1)
+    previous = np.where(old_id >= 0, old_assignment[np.maximum(old_id, 0)], -1)
+
+    new_state = MatchingState(instance)
+    new_state.unassigned = np.flatnonzero(same & (assignment < 0)).tolist()
+    _fill_state(instance, new_state, cursor, assignment)
+    new_state.free.extend(np.flatnonzero(~same).tolist())
+
+    # seats given back by a raised capacity or a holder that did not carry over
+    vacancies = _Vacancies(instance, new_state, listener)
+    lost = np.ones(old.n_students, dtype=bool)
+    lost[old_id[same]] = False
+    for o in np.unique(old_assignment[lost & (old_assignment >= 0)]).tolist(): vacancies.release(o)
+    vacancies.dirty_colleges.update(np.flatnonzero(instance.college_capacity > old.college_capacity).tolist())
+    vacancies.dirty_routes.update(np.flatnonzero(instance.route_capacity > old.route_capacity).tolist())
+    timer.lap("setup")
+
+    # colleges and routes over their new capacities shed their worst holders as the run starts
+    _propose(instance, new_state, listener=vacancies, exact_routes=True, reopen=vacancies.reopen)
+    timer.lap("matching")
+    new_state.unassigned = list(dict.fromkeys(s for s in new_state.unassigned if new_state.assignment[s] < 0))
+    changed = {instance.student_names[s] for s in np.flatnonzero((np.asarray(new_state.assignment) != previous) | (old_id < 0)).tolist()}
+    return new_state, changed
+
+
+def capacity_sweep(instance:CompactInstance, college_capacities=None, route_capacities=None, exact_routes=False,
+                   assignments=False, listener:Listener|None=None) -> list[dict]:
+    """Match one instance at a sequence of capacity levels.
+
+    With `exact_routes=True` the curve is that of `batched_deferred_acceptance` (exact route quotas),
+    which differs from `routed_acceptance` once routes bind, and every level resumes from the
+    previous one. Students only lose from a capacity cut, so the levels are visited from the most
+    to the least total capacity. The first is matched by `batched_deferred_acceptance`. A level that
+    only cuts college capacities lowers the remaining capacities of the previous state and resumes
+    `deferred_acceptance` with `exact_routes=True`, which evicts the worst holders over the new
+    quotas and makes only the proposals of the rejection chains that follow. Any other level goes
+    through `rematch`: a route cut can free college seats (its evicted students no longer count
+    against the college), so earlier rejections have to be revisited.
+
+    By default the curve is that of `deferred_acceptance`, i.e. of `routed_acceptance`, whose route
+    bookkeeping depends on the order of proposals. A route counter only runs out once the route
+    took more proposals than its capacity though, and until then the run is deferred acceptance
+    over the college capacities alone, which makes the same proposals in any order. Once a level's
+    run never ran a route counter out, that matching is carried to the next levels with warm starts
+    as above, routes left unbounded, and is their result as long as no route was proposed to more
+    times than its capacity; the other levels are matched from scratch. `n_proposals` counts the
+    proposals of the warm start in the first case.
+
+    Args:
+        instance (CompactInstance): The instance to sweep.
+        college_capacities (list, optional): College capacity vector per level; None keeps the instance's.
+        route_capacities (list, optional): Route capacity vector per level; None keeps the instance's.
+            At least one of the two must be given; if both are, they have the same length.
+        exact_routes (bool, optional): Sweep the exact route quota mechanism with warm starts instead of
+            `routed_acceptance`. Defaults to False.
+        assignments (bool, optional): Whether to add each level's `assignment` array to its record. Defaults to False.
+        listener (Listener, optional): Receives the events of every run.
+
+    Returns:
+        records (list[dict]): one record per level, in the given order, with its `level`, the
+        `dissimilarity_index`, `n_unassigned`, the `n_proposals` made at that level and its `seconds`.
+    """
+    if college_capacities is None and route_capacities is None: raise ValueError("Give college or route capacities to sweep.")
+    n_levels = len(college_capacities if college_capacities is not None else route_capacities)
+    if college_capacities is not None and route_capacities is not None and len(route_capacities) != n_levels:
+        raise ValueError("College and route capacities must have one vector per level.")
+    instance.pref_ranks, instance.option_college # computed once here and shared by every level
+    levels = [instance.with_capacities(
+        None if college_capacities is None else np.asarray(college_capacities[k], dtype=instance.college_capacity.dtype),
+        None if route_capacities is None else np.asarray(route_capacities[k], dtype=instance.route_capacity.dtype)
+    ) for k in range(n_levels)]
+    order = sorted(range(n_levels), key=lambda k: -(int(levels[k].college_capacity.sum()) + int(levels[k].route_capacity.sum())))
+
+    records = [None]*n_levels
+    state = plain = None
+    unbounded = np.full(instance.n_routes, instance.n_students, dtype=instance.route_capacity.dtype)
+    for k in order:
+        start = perf_counter()
+        level = levels[k]
+        if exact_routes:
+            state, n_proposals = _resume(state, level, listener)
+        else:
+            if plain is not None:
+                plain, n_proposals = _resume(plain, level.with_capacities(route_capacity=unbounded), listener)
+                if (_route_proposals(plain) > level.route_capacity).any(): plain = None
+            if plain is not None:
+                state = plain
+            else:
+                state = deferred_acceptance(level, listener=listener)
+                n_proposals = state.n_proposals
+                if (_route_proposals(state) <= level.route_capacity).all() and k != order[-1]:
+                    plain, _ = rematch(state, level.with_capacities(route_capacity=unbounded), listener)
+        records[k] = {
+            "level": k,
+            "dissimilarity_index": state.di,
+            "n_unassigned": len(state.unassigned),
+            "n_proposals": n_proposals,
+            "seconds": perf_counter() - start,
+        }
+        if assignments: records[k]["assignment"] = np.asarray(state.assignment, dtype=np.int32)
+    return records
+
+
+def _resume(state:MatchingState|None, level:CompactInstance, listener:Listener|None=None) -> tuple[MatchingState, int]:
+    """Exact route quota state of `level`, resumed from `state` (matched on another level) if there is
+    one, and the number of proposals it took."""
+    if state is None:
+        state = batched_deferred_acceptance(level, listener=listener)
+        return state, state.n_proposals
+    if (level.college_capacity <= state.instance.college_capacity).all() and np.array_equal(level.route_capacity, state.instance.route_capacity):
+        n_proposals = state.n_proposals
+        cut = (state.instance.college_capacity - level.college_capacity).tolist()
+        state.college_capacity = [a - b for a,b in zip(state.college_capacity, cut)]
+        state.instance = level
+        deferred_acceptance(level, state, listener=listener, exact_routes=True)
+        return state, state.n_proposals - n_proposals
+    state, _ = rematch(state, level, listener)
+    return state, state.n_proposals
+
+
+def _route_proposals(state:MatchingState) -> np.ndarray:
+    """Number of proposals every route received in a finished run: the routed entries up to each student's position."""
+    instance = state.instance
+    cursor = np.asarray(state.cursor, dtype=np.int64) + (np.asarray(state.assignment) >= 0)
+    o = instance.pref_options[expand_ranges(instance.pref_indptr[:-1], cursor)]
+    return np.bincount(o[o >= instance.n_colleges] - instance.n_colleges, minlength=instance.n_routes)
+
+
+def check_stability(instance:CompactInstance, state:MatchingState, verbose=False) -> list[tuple[int,int]]:
+    """Blocking pairs of a finished run, as reported by `utils.check_stability` on the same matching.
+
+    Every college's worst admitted rank and the remaining college and route capacities are
+    computed once, so each (student, preferred option) pair is tested in O(1) and the whole
+    check is vectorised over the preference entries. As in `utils.check_stability`, matched
+    students are checked against the options they prefer to their match and unassigned students
+    against every option someone is matched to; a routed option can be reported twice, once for
+    spare college and route capacity and once for outranking an admitted student, and a plain
+    option is only blocking while its college has spare capacity.
+
+    Returns:
+        blocking_pairs (list[tuple[int,int]]): (student id, option id) pairs, matched students first.
+    """
+    if state.instance is not instance: raise ValueError("The state was not produced by a run on this instance.")
+    n_colleges = instance.n_colleges
+    indptr = instance.pref_indptr
+    options = instance.pref_options.astype(np.int64)
+    option_college = instance.option_college
+    ranks = instance.priority_ranks(last=False)
+    assignment = np.asarray(state.assignment, dtype=np.int64)
+    cursor = np.asarray(state.cursor, dtype=np.int64)
+    c_cap = np.asarray(state.college_capacity, dtype=np.int64)
+    r_cap = np.asarray(state.route_capacity + [0], dtype=np.int64) # the extra slot stands in for plain options
+
+    # worst (first-occurrence) rank each college admitted, -1 if it admitted nobody
+    matched = np.flatnonzero(assignment >= 0)
+    worst = np.full(n_colleges, -1, dtype=np.int64)
+    np.maximum.at(worst, option_college[assignment[matched]], ranks[cursor[matched]])
+
+    # entries of matched students before their match
+    entries = expand_ranges(indptr[matched], cursor[matched])
+    students = np.repeat(matched, cursor[matched] - indptr[matched])
+
+    # entries of unassigned students pointing at options someone is matched to
+    unassigned = np.asarray(state.unassigned, dtype=np.int64)
+    held = np.bincount(assignment[matched], minlength=n_colleges + instance.n_routes) > 0
+    unassigned_entries = expand_ranges(indptr[unassigned], indptr[unassigned + 1])
+    unassigned_students = np.repeat(unassigned, indptr[unassigned + 1] - indptr[unassigned])
+    keep = held[options[unassigned_entries]]
+    entries = np.concatenate([entries, unassigned_entries[keep]])
+    students = np.concatenate([students, unassigned_students[keep]])
+
+    o = options[entries]
+    c = option_college[o]
+    routed = o >= n_colleges
+    r = np.where(routed, o - n_colleges, len(r_cap) - 1)
+    room = r_cap[r] > 0
+    outranks = (ranks[entries] >= 0) & (ranks[entries] <= worst[c])
+    count = np.where(routed, (c_cap[c] > 0) & room, c_cap[c] > 0).astype(np.int64) + (routed & room & outranks)
+
+    blocking_pairs = list(zip(np.repeat(students, count).tolist(), np.repeat(o, count).tolist()))
+    print(*[f"blocking pair found: {instance.student_names[s], instance.decode_option(o)}" for s,o in blocking_pairs],
+          sep="\n") if verbose else None
+    return blocking_pairs
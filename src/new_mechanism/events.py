@@ -0,0 +1,80 @@
+from __future__ import annotations
+from collections import Counter
+from time import perf_counter
+
+
+class Listener:
+    """Receiver of matching events; subclass it and override the events you need.
+
+    Mechanisms take an optional `listener` and only test `listener is not None` where an event
+    happens, so a run without one pays nothing but that test. Compact engines report student,
+    option, college and route ids; the object mechanisms in `utils` report names and preferences.
+    """
+
+    def on_phase(self, phase:str, seconds:float):
+        """A phase of the run (e.g. "setup", "matching") finished after `seconds`."""
+
+    def on_proposal(self, student, option):
+        """`student` proposed to `option`."""
+
+    def on_hold(self, student, option):
+        """`option` tentatively holds `student`."""
+
+    def on_college_rejection(self, student, college):
+        """`student` was rejected or evicted by `college` because it was full."""
+
+    def on_route_rejection(self, student, route):
+        """`student` was rejected or evicted by `route` because it was full."""
+
+    def on_exhaustion(self, student):
+        """`student` ran out of options and is unassigned."""
+
+
+class Profiler(Listener):
+    """Listener counting every event and adding up the time spent in each phase.
+
+    Example:
+        profiler = Profiler()
+        engine.deferred_acceptance(instance, listener=profiler)
+        profiler.counts["college_rejection"], profiler.phases["matching"]
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.phases = Counter()
+
+    def __repr__(self):
+        return f"Profiler(counts={dict(self.counts)}, phases={dict(self.phases)})"
+
+    def on_phase(self, phase, seconds):
+        self.phases[phase] += seconds
+
+    def on_proposal(self, student, option):
+        self.counts["proposal"] += 1
+
+    def on_hold(self, student, option):
+        self.counts["hold"] += 1
+
+    def on_college_rejection(self, student, college):
+        self.counts["college_rejection"] += 1
+
+    def on_route_rejection(self, student, route):
+        self.counts["route_rejection"] += 1
+
+    def on_exhaustion(self, student):
+        self.counts["exhaustion"] += 1
+
+
+class PhaseTimer:
+    """Times consecutive phases of a run for a listener; does nothing when there is none."""
+
+    def __init__(self, listener:Listener|None):
+        self.listener = listener
+        self.start = perf_counter() if listener is not None else None
+
+    def lap(self, phase:str):
+        """Report the time since the previous lap (or creation) as `phase`."""
+        if self.listener is None: return
+        now = perf_counter()
+        self.listener.on_phase(phase, now - self.start)
+        self.start = now
@@ -0,0 +1,100 @@
+from __future__ import annotations
+from itertools import product
+from os import cpu_count
+from multiprocessing import Pool
+from time import perf_counter
+from typing import Iterator
+from .__main__ import initialise
+from .compact import CompactInstance
+from . import engine
+from .storage import ResultStore, record_key
+from .streams import python_rng
+
+MECHANISMS = ("routed_acceptance", "greedy_matching")
+
+
+def parameter_grid(**axes) -> list[dict]:
+    """Every combination of the given `initialise()` parameter values.
+
+    Example:
+        parameter_grid(max_students=[100, 1000], enable_routes=[True, False])
+    """
+    names = list(axes)
+    return [dict(zip(names, values)) for values in product(*(axes[n] for n in names))]
+
+
+def count_proposals(student_preferences:dict[str,list], matching:dict, unassigned:list) -> int:
+    """Number of proposals made: every option down to the match, or the whole list if unassigned."""
+    return (sum(student_preferences[s].index(p) + 1 for s,p in matching.items())
+            + sum(len(student_preferences[s]) for s in unassigned))
+
+
+def run_point(params:dict, seed, mechanisms=MECHANISMS, blocking_pairs=True) -> list[dict]:
+    """Run each mechanism on the instance `initialise(seed, **params)` and return one metric record per mechanism.
+
+    The instance is generated once and shared by every mechanism; `seconds` times the run and its checks only.
+    """
+    _, _, _, _, _, students, colleges, dzones, routes = initialise(seed, **params)
+    instance = CompactInstance.from_objects(students, colleges, dzones, routes)
+    records = []
+    for mechanism in mechanisms:
+        start = perf_counter()
+        if mechanism == "routed_acceptance":
+            state = engine.deferred_acceptance(instance)
+        elif mechanism == "greedy_matching":
+            state = engine.greedy_matching(instance, rng=python_rng(seed, "greedy_matching"))
+        else:
+            raise ValueError(f"Unknown mechanism {mechanism}.")
+        records.append({
+            **params,
+            "seed": seed,
+            "mechanism": mechanism,
+            "n_students": instance.n_students,
+            "dissimilarity_index": state.di,
+            "n_unassigned": len(state.unassigned),
+            "n_blocking_pairs": len(engine.check_stability(instance, state)) if blocking_pairs else None,
+            "n_proposals": state.n_proposals,
+            "seconds": perf_counter() - start,
+        })
+    return records
+
+
+def _run_task(task) -> tuple[dict, object, list[dict]]:
+    params, seed = task[:2]
+    return params, seed, run_point(*task)
+
+
+def run_experiments(grid:list[dict], seeds, mechanisms=MECHANISMS, blocking_pairs=True,
+                    processes:int|None=None, chunksize:int|None=None, store:ResultStore|None=None) -> Iterator[dict]:
+    """Run every mechanism for every parameter point and seed across a process pool.
+
+    Runs are scheduled in chunks of `chunksize` (parameter point, seed) tasks, by default about four
+    chunks per worker, and their metric records are yielded as soon as each run finishes, so results
+    arrive out of order. Every run is reproducible from its parameters and seed alone.
+
+    Args:
+        grid (list[dict]): `initialise()` keyword arguments per parameter point, e.g. from `parameter_grid`.
+        seeds (iterable): Seeds to run at every parameter point.
+        mechanisms (tuple, optional): Names of the mechanisms to run. Defaults to both.
+        blocking_pairs (bool, optional): Whether to count blocking pairs with `engine.check_stability`. Defaults to True.
+        processes (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        chunksize (int, optional): Tasks sent to a worker at a time.
+        store (ResultStore, optional): Store that every record is appended to as it arrives. Runs
+            already in the store are skipped, so an interrupted campaign resumes where it stopped.
+    """
+    tasks = []
+    for params in grid:
+        for seed in seeds:
+            todo = tuple(m for m in mechanisms if store is None or record_key(params, seed, m) not in store)
+            if todo: tasks.append((params, seed, todo, blocking_pairs))
+    if not tasks: return
+    try:
+        with Pool(processes) as pool:
+            if chunksize is None:
+                chunksize = max(1, len(tasks)//(4*(processes or cpu_count() or 1)))
+            for params, seed, records in pool.imap_unordered(_run_task, tasks, chunksize=chunksize):
+                for record in records:
+                    if store is not None: store.append(record, record_key(params, seed, record["mechanism"]))
+                    yield record
+    finally:
+        if store is not None: store.flush()
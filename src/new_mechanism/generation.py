@@ -0,0 +1,331 @@
+from __future__ import annotations
+import numpy as np
+from .compact import CompactInstance, LazyPreferences
+from .spatial import FreeSpaceSampler, expand_ranges
+from .streams import numpy_rng
+from .lotteries import break_ties
+
+
+def manhattan_distances(x:np.ndarray, y:np.ndarray, to_x:np.ndarray, to_y:np.ndarray) -> np.ndarray:
+    """Matrix of Manhattan distances from every point (x, y) to every point (to_x, to_y)."""
+    x, y = np.asarray(x, dtype=np.int64), np.asarray(y, dtype=np.int64)
+    return np.abs(x[:,None] - np.asarray(to_x, dtype=np.int64)) + np.abs(y[:,None] - np.asarray(to_y, dtype=np.int64))
+
+
+def generate_instance(random_seed, grid_size=1000,
+        n_students=5, n_colleges=2, n_routes=1, n_dzones=1, c_cap=2, r_cap=1, class_size=30,
+        min_students=10, min_colleges=2, min_dzones=3, min_routes=1.0,
+        max_students=20, max_colleges=8, max_dzones=3, max_routes=1.0,
+        min_college_capacity=0.75, min_route_capacity=0.25, min_route_uptake=0.8, min_dzone_radius=0.1, min_catchment_area=0.2,
+        max_college_capacity=1.25, max_route_capacity=1.00, max_route_uptake=1.0, max_dzone_radius=0.1, max_catchment_area=0.2,
+        verbose=False, randomised=True, restricted=False, shuffle_student_preferences=True,
+        enable_routes=True, enable_ties=False, enable_incomplete_lists=False, preference_prefix=None
+) -> CompactInstance:
+    """Batched version of `initialise()` that draws every agent attribute as a whole array.
+
+    Takes the same parameters as `initialise()` and samples from the same distributions,
+    but draws from numpy generators (one independent stream per component derived from
+    `random_seed`), so the instance drawn for a seed differs from `initialise()`'s.
+    Returns a `CompactInstance`; call `to_objects()` on it for `initialise()`'s return tuple.
+    With `enable_ties=True` ties in priority are broken by one lottery shared by every college
+    (`lotteries.break_ties`) instead of student order.
+    With `preference_prefix=k` only the best `k` options of every preference list are sorted up
+    front and the rest when a run reaches them (`compact.LazyPreferences`); the lists, and so the
+    matchings, are the same as without it.
+    """
+    rng = {component:numpy_rng(random_seed, component)
+           for component in ("sizes", "colleges", "dzones", "students", "preferences")}
+
+    # Randomly generated number of participants, routes and dzones
+    n_students = int(rng["sizes"].integers(min_students, max_students, endpoint=True)) if randomised else n_students
+    n_colleges = int(rng["sizes"].integers(min_colleges, max_colleges, endpoint=True)) if randomised else n_colleges
+    n_dzones = int(rng["sizes"].integers(min_dzones, max_dzones, endpoint=True)) if randomised else n_dzones
+    n_routes = int(rng["sizes"].integers(
+        int(min_routes*n_colleges*n_dzones),
+        int(max_routes*n_colleges*n_dzones),
+        endpoint=True
+        )) if randomised else n_colleges*n_dzones
+
+    student_names = [f"s_{i+1}" for i in range(n_students)]
+    college_names = [f"c_{i+1}" for i in range(n_colleges)]
+    dzone_names = [f"dz_{i+1}" for i in range(n_dzones)]
+    route_names = [f"r_{i+1}" for i in range(n_routes)]
+    print(f"students: {n_students}", f"colleges: {n_colleges}", f"dzones: {n_dzones}", f"routes: {n_routes}",
+          "-"*50, sep="\n") if verbose else None
+
+    # Capacities of colleges and routes
+    college_capacity = rng["sizes"].integers(
+        max(class_size, class_size*int((min_college_capacity*n_students)/(n_colleges*class_size))),
+        max(class_size, class_size*int((max_college_capacity*n_students)/(n_colleges*class_size))),
+        size=n_colleges, endpoint=True
+    ) if randomised else np.full(n_colleges, c_cap)
+    route_capacity = rng["sizes"].integers(
+        max(30, 30*int((min_route_capacity*n_students)/(n_colleges*30))),
+        max(30, 30*int((max_route_capacity*n_students)/(n_colleges*30))),
+        size=n_routes, endpoint=True
+    ) if randomised else np.full(n_routes, r_cap)
+
+    # Route services: college i runs routes i*n_dzones.. (i+1)*n_dzones-1, the j-th of which serves dzone j
+    route_ids = np.arange(n_routes)
+    served = route_ids < n_colleges*n_dzones
+    route_college = np.where(served, route_ids//max(n_dzones, 1), -1)
+    route_dzone = np.where(served, route_ids % max(n_dzones, 1), -1)
+
+    # College locations without co-location
+    college_xy = place_points(rng["colleges"], grid_size, n_colleges, FreeSpaceSampler(grid_size, [], [], []))
+    college_quality = rng["colleges"].random(n_colleges)
+    college_catchment = rng["colleges"].integers(int(min_catchment_area*grid_size), int(max_catchment_area*grid_size),
+                                     size=n_colleges, endpoint=True)
+
+    # Dzone locations without co-location or overlap with high quality college catchment areas
+    high_quality = college_quality >= 0.5
+    dzone_xy = place_points(rng["dzones"], grid_size, n_dzones, FreeSpaceSampler(
+        grid_size,
+        college_xy[high_quality,0], college_xy[high_quality,1],
+        college_catchment[high_quality] + int(max_dzone_radius*grid_size)
+    ))
+    dzone_radius = rng["dzones"].integers(int(min_dzone_radius*grid_size), int(max_dzone_radius*grid_size),
+                                size=n_dzones, endpoint=True)
+
+    # Student SES and locations: high SES students live in the catchment area of a home college
+    # drawn by quality**3, low SES students anywhere outside it
+    student_ses = rng["students"].integers(0, 2, size=n_students)
+    student_xy = rng["students"].integers(0, grid_size, size=(n_students, 2), endpoint=True)
+    home = rng["students"].choice(n_colleges, size=n_students, p=college_quality**3/np.sum(college_quality**3))
+    home_xy, home_catchment = college_xy[home], college_catchment[home]
+
+    high = student_ses == 1
+    dx = rng["students"].integers(-home_catchment[high], home_catchment[high], endpoint=True)
+    dy = rng["students"].integers(-home_catchment[high] - np.abs(dx), home_catchment[high] - np.abs(dx), endpoint=True)
+    student_xy[high] = home_xy[high] + np.stack([dx, dy], axis=1)
+
+    inside = ~high & (np.abs(student_xy - home_xy).sum(axis=1) <= home_catchment)
+    while inside.any():
+        student_xy[inside] = rng["students"].integers(0, grid_size, size=(int(inside.sum()), 2), endpoint=True)
+        inside &= np.abs(student_xy - home_xy).sum(axis=1) <= home_catchment
+
+    # Locality and dzone attendance from the student x college and student x dzone distance matrices
+    student_college_distance = manhattan_distances(student_xy[:,0], student_xy[:,1], college_xy[:,0], college_xy[:,1])
+    student_dzone_distance = manhattan_distances(student_xy[:,0], student_xy[:,1], dzone_xy[:,0], dzone_xy[:,1])
+    local = student_college_distance <= college_catchment
+    attended = student_dzone_distance <= dzone_radius
+
+    # Student preferences and college priorities
+    pref_indptr, pref_options, routed_student, routed_route = build_preferences(
+        rng["preferences"], student_ses, college_quality, student_college_distance, local, attended,
+        route_college[served], route_dzone[served],
+        enable_routes=enable_routes, enable_incomplete_lists=enable_incomplete_lists, prefix=preference_prefix
+    )
+    prio_indptr, prio_entries = build_priorities(
+        student_college_distance, local, routed_student, routed_route, route_college[served]
+    )
+
+    instance = CompactInstance(
+        student_names, college_names, route_names, dzone_names,
+        student_xy[:,0], student_xy[:,1], student_ses,
+        college_xy[:,0], college_xy[:,1], college_catchment,
+        college_capacity, college_quality,
+        route_capacity, route_college, route_dzone,
+        dzone_xy[:,0], dzone_xy[:,1], dzone_radius,
+        pref_indptr, pref_options,
+        prio_indptr, prio_entries
+    )
+    if enable_ties: instance = break_ties(instance, numpy_rng(random_seed, "ties").random(n_students))
+    return instance
+
+
+def build_preferences(rng:np.random.Generator, student_ses:np.ndarray, college_quality:np.ndarray,
+                      distance:np.ndarray, local:np.ndarray, attended:np.ndarray,
+                      route_college:np.ndarray, route_dzone:np.ndarray,
+                      enable_routes=True, enable_incomplete_lists=False, block_size=2**22, prefix=None):
+    """Build every student's preference list from the weights of the options available to them.
+
+    Options are the colleges followed by the routes (route `r` is option `n_colleges + r`).
+    A routed option is available to students attending the route's dzone who are not local to
+    its college. Weights follow `Student.set_preferences`: quality plus noise over distance,
+    doubled for local colleges and multiplied by 5 on routed options for low SES students.
+    Noise is drawn for the whole student x option matrix, so instances do not depend on which
+    options are available, but weights are only computed and sorted for the available ones.
+    Rows are processed in blocks of about `block_size` matrix entries.
+
+    With `prefix`, only the best `prefix` options of every list are picked (`np.argpartition`)
+    and sorted; the returned `LazyPreferences` sorts the rest of a list when a run reaches it,
+    redrawing the student's noise from the same stream, so `rng` must be able to `advance`.
+
+    Returns:
+        pref_indptr, pref_options: CSR preference lists, best option first; `pref_options` is a
+            `LazyPreferences` with `prefix`.
+        routed_student, routed_route: Routed options on the lists, in student and preference order.
+    """
+    n_students, n_colleges = distance.shape
+    n_routes = len(route_college) if enable_routes else 0
+    option_college = np.concatenate([np.arange(n_colleges), route_college[:n_routes]])
+    n_options = len(option_college)
+    block = max(1, block_size//n_options)
+    if prefix is not None and not hasattr(rng.bit_generator, "advance"):
+        raise ValueError(f"Lazy preference lists need a bit generator that can advance, not {type(rng.bit_generator).__name__}.")
+    noise_start = rng.bit_generator.state
+
+    def row_keys(students, noise):
+        """Sort keys (-weight, padded with inf) and options of the available options of `students`."""
+        available = np.ones(noise.shape, dtype=bool)
+        available[:, n_colleges:] = attended[students][:, route_dzone[:n_routes]] & ~local[students][:, route_college[:n_routes]]
+
+        # One entry per available option, in student and option order
+        row, option = np.nonzero(available)
+        student, college = students[row], option_college[option]
+        weights = (0.9*college_quality[college] + 0.1*noise[row, option]) / np.maximum(distance[student, college], 1)
+        weights[local[student, college]] *= 2
+        weights[(student_ses[student] == 0) & (option >= n_colleges)] *= 5
+
+        # Padded to the longest list of the rows rather than to every option
+        counts = available.sum(axis=1)
+        column = np.arange(len(row)) - (np.cumsum(counts) - counts)[row]
+        keys = np.full((len(counts), counts.max(initial=0)), np.inf)
+        keys[row, column] = -weights
+        options = np.full(keys.shape, -1, dtype=np.int64)
+        options[row, column] = option
+        return keys, options, counts
+
+    def sorted_rows(keys, options, counts, k):
+        """First `k` options of each row of `row_keys` sorted by key, ties in option order."""
+        if k < keys.shape[1]:
+            # The k smallest keys, ties at the k-th in column order, as a stable sort takes them
+            kth = np.partition(keys, k - 1, axis=1)[:, k - 1:k]
+            below = keys < kth
+            chosen = below | ((keys == kth) & (np.cumsum(keys == kth, axis=1) <= k - below.sum(axis=1, keepdims=True)))
+            columns = np.nonzero(chosen)[1].reshape(len(keys), k)
+            keys, options = np.take_along_axis(keys, columns, axis=1), np.take_along_axis(options, columns, axis=1)
+        order = np.argsort(keys, axis=1, kind="stable")
+        return np.take_along_axis(options, order, axis=1)[np.arange(order.shape[1]) < counts[:,None]]
+
+    lengths = np.empty(n_students, dtype=np.int64)
+    heads, routed = [], []
+    for start in range(0, n_students, block):
+        students = np.arange(start, min(start + block, n_students))
+        keys, options, counts = row_keys(students, rng.random((len(students), n_options)))
+        k = keys.shape[1] if prefix is None else max(1, min(prefix, keys.shape[1]))
+        heads.append(sorted_rows(keys, options, counts, k))
+        lengths[students] = counts
+
+        if prefix is not None:
+            # Routed options with their key, and their rank in the row to cut incomplete lists
+            row, column = np.nonzero(options >= n_colleges)
+            key = keys[row, column]
+            rank = np.zeros(len(row), dtype=np.int64)
+            for chunk in range(0, len(row) if enable_incomplete_lists else 0, block):
+                part = slice(chunk, chunk + block)
+                rows, at = keys[row[part]], key[part,None]
+                rank[part] = ((rows < at) | ((rows == at) & (np.arange(keys.shape[1]) < column[part,None]))).sum(axis=1)
+            routed.append((students[row], options[row, column] - n_colleges, column, key, rank))
+
+    counts = lengths.copy()
+    if enable_incomplete_lists: lengths = rng.integers(1, lengths, endpoint=True)
+    pref_indptr = np.zeros(n_students + 1, dtype=np.int64)
+    np.cumsum(lengths, out=pref_indptr[1:])
+
+    # Sorted heads of the lists, cut to the drawn lengths
+    head = np.concatenate(heads) if heads else np.empty(0, dtype=np.int64)
+    head_lengths = np.minimum(counts, counts if prefix is None else max(prefix, 1))
+    head_indptr = np.zeros(n_students + 1, dtype=np.int64)
+    np.cumsum(head_lengths, out=head_indptr[1:])
+    ends = pref_indptr[:-1] + np.minimum(head_lengths, lengths)
+    entries = expand_ranges(pref_indptr[:-1], ends)
+    pref_options = np.empty(pref_indptr[-1], dtype=np.int64)
+    pref_options[entries] = head[entries - np.repeat(pref_indptr[:-1] - head_indptr[:-1], ends - pref_indptr[:-1])]
+
+    if prefix is None:
+        is_routed = pref_options >= n_colleges
+        routed_student = np.repeat(np.arange(n_students), lengths)[is_routed]
+        return pref_indptr, pref_options, routed_student, pref_options[is_routed] - n_colleges
+
+    # Routed options in preference order: by key, ties in option order as in the sort
+    routed_student, routed_route, column, key, rank = (np.concatenate(part) for part in zip(*routed)) if routed else [np.empty(0, dtype=np.int64)]*5
+    kept = rank < lengths[routed_student]
+    order = np.lexsort((column[kept], key[kept], routed_student[kept]))
+    routed_student, routed_route = routed_student[kept][order], routed_route[kept][order]
+
+    bit_generator = type(rng.bit_generator)(0)
+    redraw = np.random.Generator(bit_generator)
+
+    def sort_lists(students):
+        """Complete lists of `students`, from their noise redrawn one run of consecutive students at a time."""
+        runs = np.split(students, np.flatnonzero(np.diff(students) != 1) + 1)
+        noise = np.empty((len(students), n_options))
+        at = 0
+        for run in runs:
+            bit_generator.state = noise_start
+            bit_generator.advance(int(run[0])*n_options)
+            noise[at:at + len(run)] = redraw.random((len(run), n_options))
+            at += len(run)
+        keys, options, counts = row_keys(students, noise)
+        lists = sorted_rows(keys, options, np.minimum(counts, lengths[students]), keys.shape[1])
+        indptr = np.zeros(len(students) + 1, dtype=np.int64)
+        np.cumsum(lengths[students], out=indptr[1:])
+        return indptr, lists
+
+    return pref_indptr, LazyPreferences(pref_indptr, pref_options, ends, sort_lists), routed_student, routed_route
+
+
+def build_priorities(distance:np.ndarray, local:np.ndarray,
+                     routed_student:np.ndarray, routed_route:np.ndarray, route_college:np.ndarray):
+    """Build every college's priority list with one sort over college x applicant keys.
+
+    Follows `College.set_priorities`: local students and routed applicants form the high tier
+    and every student the low tier, each ordered by distance with ties kept in student order.
+    `routed_student` and `routed_route` are the routed options on the preference lists in
+    student and preference order, as `build_preferences` returns them.
+
+    Returns:
+        prio_indptr, prio_entries: CSR priority lists, highest priority first.
+    """
+    n_students, n_colleges = distance.shape
+    distance = np.maximum(distance, 1)
+
+    # High tier: local students in student order, then routed applicants in student and preference order
+    local_student, local_college = np.nonzero(local)
+    routed_college = route_college[routed_route]
+    high_student = np.concatenate([local_student, routed_student])
+    high_college = np.concatenate([local_college, routed_college])
+    high_entries = np.concatenate([local_student, (routed_route + 1)*n_students + routed_student])
+    high_order = np.lexsort((np.arange(len(high_student)), distance[high_student, high_college], high_college))
+    high_entries = high_entries[high_order]
+
+    # Low tier: every student, by distance
+    low_entries = np.argsort(distance, axis=0, kind="stable").T
+
+    n_high = np.bincount(high_college, minlength=n_colleges)
+    prio_indptr = np.zeros(n_colleges + 1, dtype=np.int64)
+    np.cumsum(n_high + n_students, out=prio_indptr[1:])
+    is_high = np.arange(prio_indptr[-1]) - np.repeat(prio_indptr[:-1], n_high + n_students) < np.repeat(n_high, n_high + n_students)
+    prio_entries = np.empty(prio_indptr[-1], dtype=np.int64)
+    prio_entries[is_high] = high_entries
+    prio_entries[~is_high] = low_entries.ravel()
+    return prio_indptr, prio_entries
+
+
+def place_points(rng:np.random.Generator, grid_size:int, n:int, free_space:FreeSpaceSampler, max_rounds=20) -> np.ndarray:
+    """Draw `n` distinct uniform grid points outside the balls of `free_space`.
+
+    Uses batched rejection sampling for up to `max_rounds` rounds and then draws the remaining
+    points directly from the free space, so it takes bounded time and raises a ValueError when
+    the free space runs out.
+    """
+    points = np.empty((0, 2), dtype=np.int64)
+    for _ in range(max_rounds):
+        if len(points) >= n: break
+        candidates = rng.integers(0, grid_size, size=(max(4*(n - len(points)), 64), 2), endpoint=True)
+        indptr, _ = free_space.balls.containing_many(candidates[:,0], candidates[:,1])
+        points = np.concatenate([points, candidates[np.diff(indptr) == 0]])
+        points = points[np.sort(np.unique(points, axis=0, return_index=True)[1])]
+    points = points[:n]
+
+    taken = set(map(tuple, points.tolist()))
+    extra = []
+    while len(taken) < n:
+        available = free_space.n_available(taken)
+        if not available: raise ValueError(f"Only {len(taken)} of {n} free locations available on the {grid_size} grid.")
+        point = free_space.point(int(rng.integers(available)), taken)
+        taken.add(point)
+        extra.append(point)
+    return np.concatenate([points, np.array(extra, dtype=np.int64).reshape(-1, 2)])
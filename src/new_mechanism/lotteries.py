@@ -0,0 +1,141 @@
+from __future__ import annotations
+import numpy as np
+from .compact import CompactInstance
+from . import engine
+from .streams import numpy_rng
+
+# student copies matched together by one `engine.batched_lanes` run; beyond this the lane arrays
+# outgrow the cache and lanes are slower than running the lotteries one after another
+LANE_STUDENTS = 2**14
+
+
+def priority_classes(instance:CompactInstance) -> np.ndarray:
+    """Tie class of every priority entry, aligned with `prio_entries`.
+
+    `College.set_priorities` orders a college's applicants by tier (local and routed applicants
+    first, then every student, local ones included) and then by distance, and keeps applicants
+    equal on both in student order. Each run of consecutive entries of one college with the same
+    tier and distance gets one class id; ids increase along `prio_entries`, so sorting by class
+    leaves every list as it is.
+    """
+    n_students = instance.n_students
+    prio_college = np.repeat(np.arange(instance.n_colleges, dtype=np.int64), np.diff(instance.prio_indptr))
+    route, s = np.divmod(instance.prio_entries, n_students)
+    distance = (np.abs(instance.student_x[s].astype(np.int64) - instance.college_x[prio_college])
+                + np.abs(instance.student_y[s].astype(np.int64) - instance.college_y[prio_college]))
+    # a local student is listed in both tiers, in the high one first
+    plain = np.flatnonzero(route == 0)
+    _, first = np.unique(prio_college[plain]*n_students + s[plain], return_index=True)
+    high = route > 0
+    high[plain[first]] = distance[plain[first]] <= instance.college_catchment[prio_college[plain[first]]]
+    distance = np.maximum(distance, 1)
+
+    new_class = np.ones(len(s), dtype=bool)
+    new_class[1:] = (prio_college[1:] != prio_college[:-1]) | (high[1:] != high[:-1]) | (distance[1:] != distance[:-1])
+    return np.cumsum(new_class) - 1
+
+
+def break_ties(instance:CompactInstance, lottery:np.ndarray, classes:np.ndarray|None=None) -> CompactInstance:
+    """Copy of the instance whose priority ties are broken by `lottery` instead of student order.
+
+    Args:
+        instance (CompactInstance): The instance whose ties to break.
+        lottery (np.ndarray): Lottery number per student (single tie-breaking), or colleges x students
+            numbers (multiple tie-breaking); lower numbers win.
+        classes (np.ndarray, optional): `priority_classes(instance)`, pass it when breaking ties repeatedly.
+
+    Returns:
+        instance (CompactInstance): the reordered instance, sharing every array but the priority lists.
+            Its `pref_ranks` are mapped from the instance's rather than recomputed.
+    """
+    if classes is None: classes = priority_classes(instance)
+    n_students = instance.n_students
+    prio_indptr = instance.prio_indptr
+    s = instance.prio_entries % n_students
+    # lottery numbers as ranks 0..n_students-1, so (class, rank) fits one integer key
+    draw = np.argsort(np.argsort(np.asarray(lottery), axis=-1, kind="stable"), axis=-1, kind="stable")
+    if draw.ndim == 1:
+        draw = draw[s]
+    else:
+        draw = draw[np.repeat(np.arange(instance.n_colleges, dtype=np.int64), np.diff(prio_indptr)), s]
+    order = np.argsort(classes*n_students + draw, kind="stable")
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order))
+
+    ranks = instance.pref_ranks
+    college_start = prio_indptr[instance.option_college[instance.pref_options]]
+    pref_ranks = np.where(ranks >= 0, position[college_start + np.maximum(ranks, 0)] - college_start, -1)
+    pref_ranks.flags.writeable = False
+    tie_broken = instance.replace(prio_entries=instance.prio_entries[order])
+    tie_broken.__dict__["pref_ranks"] = pref_ranks
+    tie_broken.__dict__["option_college"] = instance.option_college
+    return tie_broken
+
+
+def run_lotteries(instance:CompactInstance, n_lotteries:int, random_seed, mechanism=engine.deferred_acceptance,
+                  tie_breaking="single", lanes:int|None=None) -> dict[str,np.ndarray]:
+    """Run a mechanism under `n_lotteries` random tie-breaking lotteries on one instance.
+
+    The tie classes and the instance's rank tables are computed once; each lottery only reorders
+    the priority lists within their classes and maps the ranks, so no lottery regenerates or
+    re-sorts the instance. Lotteries are drawn from the "lotteries" stream of `random_seed`.
+    With `engine.batched_deferred_acceptance` up to `lanes` lotteries are matched together as the
+    lanes of one `engine.batched_lanes` run, which pays off on small instances; other mechanisms
+    run one lottery at a time.
+
+    Args:
+        instance (CompactInstance): The instance to match.
+        n_lotteries (int): Number of lotteries K.
+        random_seed: Seed of the lottery draws.
+        mechanism (callable, optional): Engine run on every tie-broken instance, returning a `MatchingState`.
+            Defaults to `engine.deferred_acceptance`, which gives `routed_acceptance`'s matching;
+            `engine.batched_deferred_acceptance` is faster but applies exact route quotas, so its
+            matchings differ once routes bind.
+        tie_breaking (str, optional): "single" for one lottery number per student shared by every college,
+            "multiple" for an independent one per college. Defaults to "single".
+        lanes (int, optional): Lotteries matched together by the batched engine, each lane holding a
+            copy of the preference ranks. Defaults to about `LANE_STUDENTS` students' worth, one lane
+            per run on large instances.
+
+    Returns:
+        dict with the students x K `assignment` matrix (option ids, -1 for unassigned) and the K
+        `dissimilarity_index`, `n_unassigned` and `n_proposals` of the runs.
+    """
+    if tie_breaking not in ("single", "multiple"): raise ValueError(f"Unknown tie-breaking {tie_breaking}.")
+    rng = numpy_rng(random_seed, "lotteries")
+    shape = (instance.n_students,) if tie_breaking == "single" else (instance.n_colleges, instance.n_students)
+    classes = priority_classes(instance)
+    instance.pref_ranks, instance.option_college # computed once here and shared by every lottery
+
+    batched = mechanism is engine.batched_deferred_acceptance
+    if lanes is None: lanes = max(1, LANE_STUDENTS//max(instance.n_students, 1))
+    step = lanes if batched else 1
+    results = []
+    for start in range(0, n_lotteries, step):
+        tie_broken = [break_ties(instance, rng.random(shape), classes) for _ in range(start, min(start + step, n_lotteries))]
+        if batched:
+            assignments, unassigned, n_proposals = engine.batched_lanes(tie_broken)
+            for assignment, lane_unassigned, n in zip(assignments, unassigned, n_proposals.tolist()):
+                results.append((assignment.astype(np.int32), engine.dissimilarity_index(instance, assignment), len(lane_unassigned), n))
+        else:
+            state = mechanism(tie_broken[0])
+            results.append((np.asarray(state.assignment, dtype=np.int32), state.di, len(state.unassigned), state.n_proposals))
+    return {
+        "assignment": np.stack([r[0] for r in results], axis=1) if results else np.empty((instance.n_students, 0), dtype=np.int32),
+        "dissimilarity_index": np.array([r[1] for r in results]),
+        "n_unassigned": np.array([r[2] for r in results]),
+        "n_proposals": np.array([r[3] for r in results]),
+    }
+
+
+def assignment_shares(instance:CompactInstance, assignment:np.ndarray) -> np.ndarray:
+    """Share of the lotteries placing each student at each college, from a students x K assignment matrix.
+
+    Returns:
+        shares (np.ndarray): students x (colleges + 1) array, the last column being the share left unassigned.
+    """
+    n_students, K = assignment.shape
+    college = np.where(assignment >= 0, instance.option_college[np.maximum(assignment, 0)], instance.n_colleges)
+    counts = np.zeros((n_students, instance.n_colleges + 1), dtype=np.int64)
+    np.add.at(counts, (np.repeat(np.arange(n_students), K), college.ravel()), 1)
+    return counts/K if K else counts.astype(float)
@@ -0,0 +1,226 @@
+from __future__ import annotations
+import numpy as np
+
+
+def rotate(x, y) -> tuple[np.ndarray, np.ndarray]:
+    """Rotate coordinates to (x + y, x - y), where Manhattan distance becomes Chebyshev distance
+    and a Manhattan ball becomes an axis-aligned square."""
+    x, y = np.asarray(x, dtype=np.int64), np.asarray(y, dtype=np.int64)
+    return x + y, x - y
+
+
+def expand_ranges(starts:np.ndarray, ends:np.ndarray) -> np.ndarray:
+    """Concatenation of arange(start, end) for every pair of bounds, e.g. the entries of CSR rows."""
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if not total: return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return np.arange(total, dtype=np.int64) + offsets
+
+
+class PointIndex:
+    """Grid-bucket index of points answering "which points are within Manhattan distance r of (x, y)".
+
+    Points are bucketed on a square grid over the rotated coordinates and sorted by bucket, so a
+    query visits one contiguous run of buckets per grid row covering the query square.
+    Results are point ids (positions in the input) in increasing order; `labels`, if given,
+    map ids back to names.
+    """
+
+    def __init__(self, x, y, cell_size:int|None=None, labels:list|None=None):
+        u, v = rotate(x, y)
+        self.labels = labels
+        self.n = len(u)
+        self.u_min = int(u.min()) if self.n else 0
+        self.v_min = int(v.min()) if self.n else 0
+        span = max(int(u.max()) - self.u_min, int(v.max()) - self.v_min, 1) if self.n else 1
+        self.cell_size = cell_size or max(1, -(-span//max(int(np.sqrt(self.n)), 1)))
+        iu = (u - self.u_min)//self.cell_size
+        iv = (v - self.v_min)//self.cell_size
+        self.n_u = int(iu.max()) + 1 if self.n else 0
+        self.n_v = int(iv.max()) + 1 if self.n else 0
+        keys = iu*self.n_v + iv
+        order = np.argsort(keys, kind="stable")
+        self.keys, self.ids = keys[order], order
+        self.u, self.v = u[order], v[order]
+
+    def __len__(self):
+        return self.n
+
+    def query(self, x:int, y:int, radius:int) -> np.ndarray:
+        """Ids of points within Manhattan distance `radius` of (x, y)."""
+        u, v = x + y, x - y
+        iu_lo = max((u - radius - self.u_min)//self.cell_size, 0)
+        iu_hi = min((u + radius - self.u_min)//self.cell_size, self.n_u - 1)
+        iv_lo = max((v - radius - self.v_min)//self.cell_size, 0)
+        iv_hi = min((v + radius - self.v_min)//self.cell_size, self.n_v - 1)
+        if iu_lo > iu_hi or iv_lo > iv_hi: return np.empty(0, dtype=np.int64)
+        rows = np.arange(iu_lo, iu_hi + 1, dtype=np.int64)*self.n_v
+        candidates = expand_ranges(
+            np.searchsorted(self.keys, rows + iv_lo, side="left"),
+            np.searchsorted(self.keys, rows + iv_hi, side="right")
+        )
+        inside = (np.abs(self.u[candidates] - u) <= radius) & (np.abs(self.v[candidates] - v) <= radius)
+        return np.sort(self.ids[candidates[inside]])
+
+
+class BallIndex:
+    """Grid-bucket index of Manhattan balls answering "which balls contain (x, y)".
+
+    Every ball is registered in each grid cell its rotated square overlaps, so a query only
+    tests the balls registered in the point's cell. Results are ball ids in increasing order;
+    `labels`, if given, map ids back to names.
+    """
+
+    def __init__(self, x, y, radius, cell_size:int|None=None, labels:list|None=None):
+        u, v = rotate(x, y)
+        radius = np.asarray(radius, dtype=np.int64)
+        self.labels = labels
+        self.n = len(u)
+        self.u, self.v, self.radius = u, v, radius
+        self.u_min = int((u - radius).min()) if self.n else 0
+        self.v_min = int((v - radius).min()) if self.n else 0
+        self.cell_size = cell_size or max(1, 2*int(np.median(radius)) if self.n else 1)
+        iu_lo = (u - radius - self.u_min)//self.cell_size
+        iu_hi = (u + radius - self.u_min)//self.cell_size
+        iv_lo = (v - radius - self.v_min)//self.cell_size
+        iv_hi = (v + radius - self.v_min)//self.cell_size
+        self.n_u = int(iu_hi.max()) + 1 if self.n else 0
+        self.n_v = int(iv_hi.max()) + 1 if self.n else 0
+
+        # one (cell, ball) entry per overlapped cell, generated in ball order
+        width = iv_hi - iv_lo + 1
+        counts = (iu_hi - iu_lo + 1)*width
+        balls = np.repeat(np.arange(self.n, dtype=np.int64), counts)
+        within = expand_ranges(np.zeros(self.n, dtype=np.int64), counts)
+        cell_u = iu_lo[balls] + within//width[balls]
+        cell_v = iv_lo[balls] + within % width[balls]
+        keys = cell_u*self.n_v + cell_v
+        order = np.argsort(keys, kind="stable")
+        self.keys, self.balls = keys[order], balls[order]
+
+    def __len__(self):
+        return self.n
+
+    def containing(self, x:int, y:int) -> np.ndarray:
+        """Ids of balls containing (x, y)."""
+        u, v = x + y, x - y
+        iu = (u - self.u_min)//self.cell_size
+        iv = (v - self.v_min)//self.cell_size
+        if not (0 <= iu < self.n_u and 0 <= iv < self.n_v): return np.empty(0, dtype=np.int64)
+        key = iu*self.n_v + iv
+        candidates = self.balls[np.searchsorted(self.keys, key, side="left"):np.searchsorted(self.keys, key, side="right")]
+        r = self.radius[candidates]
+        return candidates[(np.abs(self.u[candidates] - u) <= r) & (np.abs(self.v[candidates] - v) <= r)]
+
+    def containing_many(self, x, y) -> tuple[np.ndarray, np.ndarray]:
+        """Balls containing each point, as CSR arrays `(indptr, ids)` over the points."""
+        u, v = rotate(x, y)
+        iu = (u - self.u_min)//self.cell_size
+        iv = (v - self.v_min)//self.cell_size
+        valid = (iu >= 0) & (iu < self.n_u) & (iv >= 0) & (iv < self.n_v)
+        key = np.where(valid, iu*self.n_v + iv, -1)
+        starts = np.where(valid, np.searchsorted(self.keys, key, side="left"), 0)
+        ends = np.where(valid, np.searchsorted(self.keys, key, side="right"), 0)
+        entries = expand_ranges(starts, ends)
+        points = np.repeat(np.arange(len(u), dtype=np.int64), ends - starts)
+        candidates = self.balls[entries]
+        r = self.radius[candidates]
+        inside = (np.abs(self.u[candidates] - u[points]) <= r) & (np.abs(self.v[candidates] - v[points]) <= r)
+        indptr = np.zeros(len(u) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(points[inside], minlength=len(u)), out=indptr[1:])
+        return indptr, candidates[inside]
+
+
+class FreeSpaceSampler:
+    """Uniform sampler of integer points of the [0, grid_size]^2 grid lying outside a set of Manhattan balls.
+
+    The free points are counted row by row from the union of the balls' intervals in that row,
+    so the k-th free point (in row-major order) can be located directly and sampling takes
+    bounded time however little free space is left. The row counts are only built on the first
+    call that needs them; `forbids` only uses a `BallIndex`.
+    """
+
+    def __init__(self, grid_size:int, x, y, radius, block_size=2**22):
+        self.grid_size = grid_size
+        self.x = np.asarray(x, dtype=np.int64)
+        self.y = np.asarray(y, dtype=np.int64)
+        self.radius = np.asarray(radius, dtype=np.int64)
+        self.balls = BallIndex(self.x, self.y, self.radius)
+        self.block_size = block_size
+        self._cumulative = None
+
+    def forbids(self, x:int, y:int) -> bool:
+        """Whether (x, y) lies in one of the balls."""
+        return bool(len(self.balls.containing(x, y)))
+
+    @property
+    def cumulative(self) -> np.ndarray:
+        """Cumulative number of free points up to and including each row."""
+        if self._cumulative is None:
+            n_rows, n_balls = self.grid_size + 1, len(self.x)
+            free = np.full(n_rows, n_rows, dtype=np.int64)
+            block = max(1, self.block_size//max(n_balls, 1))
+            for start in range(0, n_rows if n_balls else 0, block):
+                rows = np.arange(start, min(start + block, n_rows), dtype=np.int64)
+                lo, hi = self._intervals(rows)
+                order = np.argsort(lo, axis=1)
+                lo, hi = np.take_along_axis(lo, order, axis=1), np.take_along_axis(hi, order, axis=1)
+                reach = np.maximum.accumulate(hi, axis=1)
+                before = np.concatenate([np.full((len(rows), 1), -1), reach[:,:-1]], axis=1)
+                free[rows] -= np.clip(hi - np.maximum(lo, before + 1) + 1, 0, None).sum(axis=1)
+            self._cumulative = np.cumsum(free)
+        return self._cumulative
+
+    @property
+    def n_free(self) -> int:
+        return int(self.cumulative[-1])
+
+    def _intervals(self, rows:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Column intervals [lo, hi] covered by each ball in each row; empty ones have lo > hi."""
+        half = self.radius - np.abs(rows[:,None] - self.x)
+        lo = np.maximum(self.y - half, 0)
+        hi = np.minimum(self.y + half, self.grid_size)
+        empty = (half < 0) | (lo > hi)
+        return np.where(empty, self.grid_size + 1, lo), np.where(empty, self.grid_size, hi)
+
+    def _row_intervals(self, row:int) -> list[tuple[int,int]]:
+        """Disjoint, sorted column intervals covered in `row`."""
+        lo, hi = self._intervals(np.array([row], dtype=np.int64))
+        merged = []
+        for l,h in sorted(zip(lo[0].tolist(), hi[0].tolist())):
+            if l > h: continue
+            if merged and l <= merged[-1][1] + 1: merged[-1] = (merged[-1][0], max(merged[-1][1], h))
+            else: merged.append((l, h))
+        return merged
+
+    def rank(self, x:int, y:int) -> int:
+        """Position of the free point (x, y) in row-major order of the free points."""
+        covered = sum(min(h, y - 1) - l + 1 for l,h in self._row_intervals(x) if l < y)
+        return (int(self.cumulative[x-1]) if x else 0) + y - covered
+
+    def locate(self, k:int) -> tuple[int,int]:
+        """The k-th free point in row-major order."""
+        x = int(np.searchsorted(self.cumulative, k, side="right"))
+        y = k - (int(self.cumulative[x-1]) if x else 0)
+        for l,h in self._row_intervals(x):
+            if l > y: break
+            y += h - l + 1
+        return (x, y)
+
+    def _taken_ranks(self, taken) -> list[int]:
+        return sorted(
+            self.rank(x, y) for x,y in set(taken)
+            if 0 <= x <= self.grid_size and 0 <= y <= self.grid_size and not self.forbids(x, y)
+        )
+
+    def n_available(self, taken=()) -> int:
+        """Number of free points that are not in `taken`."""
+        return self.n_free - len(self._taken_ranks(taken))
+
+    def point(self, k:int, taken=()) -> tuple[int,int]:
+        """The k-th free point not in `taken`, for 0 <= k < `n_available(taken)`."""
+        for t in self._taken_ranks(taken):
+            if t > k: break
+            k += 1
+        return self.locate(k)
@@ -0,0 +1,209 @@
+from __future__ import annotations
+import json
+from pathlib import Path
+import numpy as np
+from .compact import CompactInstance
+
+FORMAT_VERSION = 1
+
+# constructor arguments of `CompactInstance` after the name lists, in order
+INSTANCE_ARRAYS = (
+    "student_x", "student_y", "student_ses",
+    "college_x", "college_y", "college_catchment", "college_capacity", "college_quality",
+    "route_capacity", "route_college", "route_dzone",
+    "dzone_x", "dzone_y", "dzone_radius",
+    "pref_indptr", "pref_options", "prio_indptr", "prio_entries",
+)
+INSTANCE_NAMES = ("student_names", "college_names", "route_names", "dzone_names")
+
+
+def _write(path, kind:str, arrays:dict[str,np.ndarray], meta:dict) -> Path:
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    for name,array in arrays.items():
+        np.save(path/f"{name}.npy", np.ascontiguousarray(array), allow_pickle=False)
+    # the metadata is written last, so a directory without it is an interrupted save
+    with open(path/"meta.json", "w") as f:
+        json.dump({"format": FORMAT_VERSION, "kind": kind, "arrays": list(arrays), **meta}, f)
+    return path
+
+
+def _read_meta(path, kind:str) -> dict:
+    path = Path(path)
+    with open(path/"meta.json") as f:
+        meta = json.load(f)
+    if meta.get("kind") != kind: raise ValueError(f"{path} holds a {meta.get('kind')}, not a {kind}.")
+    if meta.get("format") != FORMAT_VERSION: raise ValueError(f"{path} has unsupported format {meta.get('format')}.")
+    return meta
+
+
+def _read(path, kind:str, mmap=True) -> tuple[dict[str,np.ndarray], dict]:
+    meta = _read_meta(path, kind)
+    arrays = {name:np.load(Path(path)/f"{name}.npy", mmap_mode="r" if mmap else None, allow_pickle=False)
+              for name in meta["arrays"]}
+    return arrays, meta
+
+
+def _plain(value):
+    """JSON fallback: numpy scalars and arrays as the equivalent Python values, anything else as its repr."""
+    if isinstance(value, (np.generic, np.ndarray)): return value.tolist()
+    return repr(value)
+
+
+def save_instance(instance:CompactInstance, path) -> Path:
+    """Save an instance as a directory of flat `.npy` arrays plus a `meta.json` holding the agent names.
+
+    Args:
+        instance (CompactInstance): The instance to save.
+        path (str | Path): Directory to write, created if needed.
+    """
+    return _write(path, "instance",
+                  {name:getattr(instance, name) for name in INSTANCE_ARRAYS},
+                  {name:list(map(str, getattr(instance, name))) for name in INSTANCE_NAMES})
+
+
+def load_instance(path, mmap=True) -> CompactInstance:
+    """Load an instance saved by `save_instance`.
+
+    With `mmap=True` the arrays are read-only memory maps, so opening is instant whatever the
+    size and worker processes loading the same directory share the pages of one copy.
+    """
+    arrays, meta = _read(path, "instance", mmap)
+    return CompactInstance(*(meta[name] for name in INSTANCE_NAMES), *(arrays[name] for name in INSTANCE_ARRAYS))
+
+
+def save_matching(matching, path, **metadata) -> Path:
+    """Save the result of a run as flat arrays.
+
+    Args:
+        matching: An `engine.MatchingState` or an array of option ids per student (-1 for unassigned).
+        path (str | Path): Directory to write, created if needed.
+        **metadata: JSON-serialisable values stored alongside, e.g. the mechanism, seed or parameters.
+            The dissimilarity index and number of proposals of a `MatchingState` are added.
+    """
+    assignment = np.asarray(getattr(matching, "assignment", matching), dtype=np.int32)
+    unassigned = np.asarray(getattr(matching, "unassigned", np.flatnonzero(assignment < 0)), dtype=np.int32)
+    if hasattr(matching, "assignment"):
+        metadata = {"dissimilarity_index": matching.di, "n_proposals": matching.n_proposals, **metadata}
+    return _write(path, "matching", {"assignment": assignment, "unassigned": unassigned}, {"metadata": metadata})
+
+
+def load_matching(path, mmap=True) -> tuple[np.ndarray, np.ndarray, dict]:
+    """Load a result saved by `save_matching`.
+
+    Returns:
+        assignment (np.ndarray): option id per student, -1 if unassigned.
+        unassigned (np.ndarray): unassigned students, in the order they dropped out.
+        metadata (dict): the values saved with the matching.
+    """
+    arrays, meta = _read(path, "matching", mmap)
+    return arrays["assignment"], arrays["unassigned"], meta["metadata"]
+
+
+def record_key(params:dict, seed, mechanism:str) -> str:
+    """Key of the run of `mechanism` on `initialise(seed, **params)` in a `ResultStore`.
+
+    Numpy scalars give the same key as the equivalent Python values, so seeds from `np.arange`
+    match runs stored with plain ints.
+    """
+    return json.dumps([params, seed, mechanism], sort_keys=True, default=_plain)
+
+
+class ResultStore:
+    """Append-only, resumable store of experiment records under a directory.
+
+    Records are buffered and written `flush_every` at a time as a new part directory: numeric
+    columns as flat `.npy` arrays, every other column as `other/<name>.json` and the record keys
+    as `keys.json`. The part's `meta.json` only lists the columns, so scanning a numeric column
+    reads nothing but that column's array.
+    A part is written under a temporary name and renamed once complete, so a crash loses at most
+    the unflushed buffer. Reopening the directory reloads the keys of every stored record, so a
+    restarted campaign can skip completed runs (`key in store`).
+
+    Example:
+        with ResultStore("results") as store:
+            for record in run_experiments(grid, seeds, store=store): ...
+        store.column("dissimilarity_index")
+    """
+
+    def __init__(self, path, flush_every=1000):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.flush_every = flush_every
+        self.parts = sorted(p for p in self.path.glob("part-*") if (p/"meta.json").exists())
+        self.keys = set()
+        for part in self.parts:
+            with open(part/"keys.json") as f:
+                self.keys.update(json.load(f))
+        self.buffer = []
+        self.buffer_keys = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key:str):
+        return key in self.keys
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def append(self, record:dict, key:str):
+        """Buffer one record under `key`, flushing once `flush_every` records are waiting."""
+        if key in self.keys: return
+        self.keys.add(key)
+        self.buffer.append(record)
+        self.buffer_keys.append(key)
+        if len(self.buffer) >= self.flush_every: self.flush()
+
+    def flush(self):
+        """Write the buffered records as a new part."""
+        if not self.buffer: return
+        columns = {}
+        for i,record in enumerate(self.buffer):
+            for name,value in record.items():
+                columns.setdefault(name, [None]*len(self.buffer))[i] = value
+        numeric = {name:np.asarray(values) for name,values in columns.items()
+                   if all(isinstance(v, (int, float, np.number)) for v in values)}
+        other = {name:values for name,values in columns.items() if name not in numeric}
+        part = self.path/f"part-{len(self.parts):06d}"
+        tmp = self.path/f".{part.name}.tmp"
+        (tmp/"other").mkdir(parents=True, exist_ok=True)
+        with open(tmp/"keys.json", "w") as f:
+            json.dump(self.buffer_keys, f)
+        for name,values in other.items():
+            with open(tmp/"other"/f"{name}.json", "w") as f:
+                json.dump(values, f, default=_plain)
+        _write(tmp, "results", numeric, {"n_records": len(self.buffer), "columns": list(columns),
+                                         "dtypes": {name:values.dtype.str for name,values in numeric.items()}})
+        tmp.rename(part)
+        self.parts.append(part)
+        self.buffer, self.buffer_keys = [], []
+
+    def column(self, name:str) -> np.ndarray:
+        """One column over every flushed record, read from memory-mapped arrays where it is numeric."""
+        chunks = []
+        for part in self.parts:
+            meta = _read_meta(part, "results")
+            if name in meta["arrays"]:
+                chunks.append(np.load(part/f"{name}.npy", mmap_mode="r", allow_pickle=False))
+            elif name in meta["columns"]:
+                chunks.append(np.fromiter(self._other(part, name), dtype=object, count=meta["n_records"]))
+            else:
+                chunks.append(np.full(meta["n_records"], None, dtype=object))
+        return np.concatenate(chunks) if chunks else np.empty(0)
+
+    def records(self):
+        """Yield every flushed record as a dict."""
+        for part in self.parts:
+            arrays, meta = _read(part, "results")
+            columns = {name:arrays[name].tolist() if name in arrays else self._other(part, name) for name in meta["columns"]}
+            for i in range(meta["n_records"]):
+                yield {name:values[i] for name,values in columns.items()}
+
+    @staticmethod
+    def _other(part:Path, name:str) -> list:
+        with open(part/"other"/f"{name}.json") as f:
+            return json.load(f)
@@ -0,0 +1,28 @@
+from __future__ import annotations
+from random import Random
+from zlib import crc32
+import numpy as np
+
+
+def seed_sequence(random_seed, component:str) -> np.random.SeedSequence:
+    """Seed sequence of the named component's stream, derived from `random_seed`.
+
+    `random_seed` may be an int or a `SeedSequence` (e.g. one of `SeedSequence(seed).spawn(n)`
+    when fanning runs out to workers). Each component gets an independent stream keyed by its
+    name, so drawing more from one component never shifts another's draws.
+    """
+    key = (crc32(component.encode()),)
+    if isinstance(random_seed, np.random.SeedSequence):
+        return np.random.SeedSequence(random_seed.entropy, spawn_key=random_seed.spawn_key + key,
+                                      pool_size=random_seed.pool_size)
+    return np.random.SeedSequence(random_seed, spawn_key=key)
+
+
+def python_rng(random_seed, component:str) -> Random:
+    """Independent `random.Random` stream for the named component."""
+    return Random(int.from_bytes(seed_sequence(random_seed, component).generate_state(4).tobytes(), "little"))
+
+
+def numpy_rng(random_seed, component:str) -> np.random.Generator:
+    """Independent numpy `Generator` stream for the named component."""
+    return np.random.default_rng(seed_sequence(random_seed, component))
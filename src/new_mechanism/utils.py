@@ -1,6 +1,11 @@
 from __future__ import annotations
-from random import random, randint, shuffle, choices
+from random import Random
+from collections import deque
+import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from .spatial import PointIndex, BallIndex, FreeSpaceSampler
+from .events import Listener, PhaseTimer
 
 
 class Route:
@@ -26,37 +31,53 @@ class Dzone:
 
 
 class College:
-    def __init__(self, name:str, location:tuple, catchment_area:int, capacity:int, routes:list):
+    def __init__(self, name:str, location:tuple, catchment_area:int, capacity:int, routes:list, quality:float|None=None,
+                 rng:Random|None=None):
         self.name = name
         self.location = location
         self.catchment_area = catchment_area
         self.capacity = capacity
         self.routes = routes
-        self.quality = random()
+        if quality is None and rng is None: raise ValueError(f"College {name} needs a quality or an rng to draw it from.")
+        self.quality = rng.random() if quality is None else quality
         self.priorities = []
         self.assigned_students:list[Student] = []
 
     def __repr__(self):
         return self.name
     
-    def set_priorities(self, students:dict[str,Student], enable_routes=True):
+    def set_priorities(self, students:dict[str,Student], enable_routes=True,
+                       routed_applicants:dict[str,list[tuple]]|None=None, student_index:PointIndex|None=None,
+                       lottery:dict[str,float]|None=None):
+        """Set the college's priorities: local and routed applicants first, then every student, each by distance.
+
+        Args:
+            students (dict[str,Student]): Dictionary of student objects.
+            enable_routes (bool, optional): Whether routed applicants get priority. Defaults to True.
+            routed_applicants (dict[str,list[tuple]], optional): Index from `routed_applicant_index`,
+                pass it when setting the priorities of every college. Built from `students` if None.
+            student_index (PointIndex, optional): Index from `student_location_index` used to find
+                local students without scanning every student.
+            lottery (dict[str,float], optional): Lottery number per student breaking ties in distance,
+                lower numbers first. Ties are kept in student order if None.
+        """
         local_students = [
+            student_index.labels[i] for i in student_index.query(*self.location, self.catchment_area)
+            ] if student_index is not None else [
             s.name for s in students.values()
             if manhattan_distance(s.location,self.location) <= self.catchment_area
             ]
-        non_local_students = [
-            s.name for s in students.values()
-            if s not in local_students
-            ]
+        if enable_routes and routed_applicants is None:
+            routed_applicants = routed_applicant_index(students)
         routed_students = [
-            (r,s.name) for s in students.values()
-            for p in s.preferences
-            if (r:=extract_route(p)) in self.routes
-            and extract_college(p) == self.name
+            (r,s) for r,s in routed_applicants.get(self.name, [])
+            if r in self.routes
             ] if enable_routes else []
 
         high_priority = local_students + routed_students
-        low_priority = non_local_students
+        # every student, local ones included: the former `s not in local_students` scan compared
+        # Student objects to names and never excluded anyone
+        low_priority = [s.name for s in students.values()]
 
         weights = {}
         for p in high_priority:
@@ -68,7 +89,8 @@ class College:
             else: weights[p] = (
                 1 / max(manhattan_distance(students[s].location,self.location), 1)
             )
-        high_priority.sort(key=lambda p: weights[p], reverse=True)
+        if lottery is None: high_priority.sort(key=lambda p: weights[p], reverse=True)
+        else: high_priority.sort(key=lambda p: (-weights[p], lottery[extract_student(p)]))
 
         weights = {}
         for p in low_priority:
@@ -76,7 +98,8 @@ class College:
             weights[p] = (
                 1 / max(manhattan_distance(students[s].location,self.location), 1)
             )
-        low_priority.sort(key=lambda p: weights[p], reverse=True)
+        if lottery is None: low_priority.sort(key=lambda p: weights[p], reverse=True)
+        else: low_priority.sort(key=lambda p: (-weights[p], lottery[p]))
         
         # shuffle(high_priority_students)
         # shuffle(non_local_students)
@@ -98,14 +121,15 @@ class College:
 
 
 class Student:
-    def __init__(self, name:str, location:tuple):
+    def __init__(self, name:str, location:tuple, SES:int|None=None, rng:Random|None=None):
         self.name = name
         self.location = location
         self.accesible_routes = []
         self.attended_dzones = []
         self.local_colleges = []
         self.preferences = []
-        self.SES = randint(0,1)
+        if SES is None and rng is None: raise ValueError(f"Student {name} needs an SES or an rng to draw it from.")
+        self.SES = rng.randint(0,1) if SES is None else SES
         self.assigned_college = None
     
 
@@ -125,8 +149,8 @@ class Student:
         pass
     
     
-    def set_location(self, grid_size, colleges:dict[str,College]):
-        """Set the student's location depending on their SES."""
+    def set_location(self, grid_size, colleges:dict[str,College], rng:Random):
+        """Set the student's location depending on their SES, drawing from `rng`."""
         # college = choice([c for c in colleges.values() if c.quality >= 0.8])
         # college = choice(
         #     sorted(
@@ -135,17 +159,17 @@ class Student:
         #         reverse=True
         #     )[:int(0.3*len(colleges))]
         # )
-        college = choices(
+        college = rng.choices(
             population=[c for c in colleges.values()],
             weights=[c.quality**3 for c in colleges.values()]
         )[0]
 
         if self.SES and college:
-            dx = randint(
+            dx = rng.randint(
                 -college.catchment_area,
                 college.catchment_area
             )
-            dy = randint(
+            dy = rng.randint(
                 -college.catchment_area-abs(dx),
                 college.catchment_area-abs(dx)
             )
@@ -156,26 +180,40 @@ class Student:
 
         elif college:
             while manhattan_distance(self.location,college.location) <= college.catchment_area:
-                self.location = generate_location(0,grid_size,0,grid_size)
+                self.location = generate_location(rng,0,grid_size,0,grid_size)
         
 
-    def set_locality_and_dzones(self, colleges:dict[str,College], dzones:dict[str,Dzone]):
-        """Set the things"""
-        for college in colleges.values():
-            if manhattan_distance(self.location,college.location) <= college.catchment_area:
-                self.local_colleges.append(college.name)
-        for dzone in dzones.values():
-            if manhattan_distance(self.location,dzone.location) <= dzone.radius:
-                self.attended_dzones.append(dzone.name)
-                self.accesible_routes.extend(dzone.routes)
+    def set_locality_and_dzones(self, colleges:dict[str,College], dzones:dict[str,Dzone],
+                                catchment_index:BallIndex|None=None, dzone_index:BallIndex|None=None):
+        """Set the student's local colleges, attended dzones and the routes those dzones give access to.
+
+        Pass `catchment_index(colleges)` and `dzone_index(dzones)` to look up only the catchments and
+        dzones around the student instead of checking every college and dzone.
+        """
+        if catchment_index is not None:
+            self.local_colleges.extend(catchment_index.labels[i] for i in catchment_index.containing(*self.location))
+        else:
+            for college in colleges.values():
+                if manhattan_distance(self.location,college.location) <= college.catchment_area:
+                    self.local_colleges.append(college.name)
+        if dzone_index is not None:
+            for i in dzone_index.containing(*self.location):
+                self.attended_dzones.append(dzone_index.labels[i])
+                self.accesible_routes.extend(dzones[dzone_index.labels[i]].routes)
+        else:
+            for dzone in dzones.values():
+                if manhattan_distance(self.location,dzone.location) <= dzone.radius:
+                    self.attended_dzones.append(dzone.name)
+                    self.accesible_routes.extend(dzone.routes)
                 
     
-    def set_preferences(self, colleges:dict[str,College],
+    def set_preferences(self, colleges:dict[str,College], rng:Random,
                         enable_routes=True, enable_ties=False, enable_incomplete_lists=False):
         """Set the student's preferences over colleges and routes based on college quality, locality, and route access.
 
         Args:
             colleges (dict[str,College]): Dictionary of college objects.
+            rng (Random): Random stream for the preference noise and list lengths.
             enable_routes (bool, optional): _description_. Defaults to True.
             enable_ties (bool, optional): _description_. Defaults to False.
             enable_incomplete_lists (bool, optional): _description_. Defaults to False.
@@ -193,14 +231,14 @@ class Student:
             r = extract_route(p)
             if self.SES:
                 weight = (
-                    (0.9*colleges[c].quality + 0.1*random())
+                    (0.9*colleges[c].quality + 0.1*rng.random())
                     / max(manhattan_distance(self.location,colleges[c].location), 1)
                 )
                 if c in self.local_colleges: weight *= 2
                 weights[p] = weight
             else:
                 weight = (
-                    (0.9*colleges[c].quality + 0.1*random())
+                    (0.9*colleges[c].quality + 0.1*rng.random())
                     / max(manhattan_distance(self.location,colleges[c].location), 1)
                 )
                 if c in self.local_colleges: weight *= 2
@@ -208,15 +246,64 @@ class Student:
                 weights[p] = weight
         self.preferences.sort(key=lambda p: weights[p], reverse=True)
         if enable_incomplete_lists:
-            self.preferences = self.preferences[:randint(1,len(self.preferences))]
+            self.preferences = self.preferences[:rng.randint(1,len(self.preferences))]
         return weights
 
 
+def routed_applicant_index(students:dict[str,Student]) -> dict[str,list[tuple]]:
+    """Index from college to its routed applicants (route, student), in student and preference order."""
+    index = {}
+    for s in students.values():
+        for p in s.preferences:
+            if r:=extract_route(p):
+                index.setdefault(extract_college(p), []).append((r,s.name))
+    return index
+
+def student_location_index(students:dict[str,Student]) -> PointIndex:
+    """Spatial index of student locations, labelled by student name."""
+    return PointIndex(
+        [s.location[0] for s in students.values()],
+        [s.location[1] for s in students.values()],
+        labels=list(students)
+    )
+
+def catchment_index(colleges:dict[str,College], margin=0) -> BallIndex:
+    """Spatial index of college catchment areas (widened by `margin`), labelled by college name."""
+    return BallIndex(
+        [c.location[0] for c in colleges.values()],
+        [c.location[1] for c in colleges.values()],
+        [c.catchment_area + margin for c in colleges.values()],
+        labels=list(colleges)
+    )
+
+def dzone_index(dzones:dict[str,Dzone]) -> BallIndex:
+    """Spatial index of dzones, labelled by dzone name."""
+    return BallIndex(
+        [d.location[0] for d in dzones.values()],
+        [d.location[1] for d in dzones.values()],
+        [d.radius for d in dzones.values()],
+        labels=list(dzones)
+    )
+
 def manhattan_distance(start_coords,end_coords):
     return abs(start_coords[0]-end_coords[0]) + abs(start_coords[1]-end_coords[1])
 
-def generate_location(x_min=0,x_max=0,y_min=0,y_max=0):
-    return (randint(x_min,x_max), randint(y_min,y_max))
+def generate_location(rng:Random,x_min=0,x_max=0,y_min=0,y_max=0):
+    return (rng.randint(x_min,x_max), rng.randint(y_min,y_max))
+
+def generate_free_location(rng:Random, grid_size, taken:set, free_space:FreeSpaceSampler|None=None, max_attempts=1000):
+    """Generate a uniform location on the grid outside `taken` and the balls of `free_space`.
+
+    Tries `generate_location` up to `max_attempts` times, then draws directly from the remaining
+    free space, so it takes bounded time and raises a ValueError when no location is left.
+    """
+    free_space = free_space or FreeSpaceSampler(grid_size, [], [], [])
+    for _ in range(max_attempts):
+        location = generate_location(rng,0,grid_size,0,grid_size)
+        if location not in taken and not free_space.forbids(*location): return location
+    available = free_space.n_available(taken)
+    if not available: raise ValueError(f"No free location left on the {grid_size} grid.")
+    return free_space.point(rng.randint(0,available-1), taken)
 
 def dissimilarity_index(students:dict[str,Student], colleges:dict[str,College]):
     """Calculates the college's diversity index from student SES values."""
@@ -256,9 +343,9 @@ def match_to_priority(student, preference):
 
 def college_oversubscription(
         students:dict[str,Student], colleges:dict[str,College],
-        free:list[str], matching:dict, unassigned:list[str],
-        college_priorities:dict, c:str,
-        verbose=False
+        free:deque[str], matching:dict, unassigned:list[str],
+        college_priorities:dict, cursor:dict[str,int], c:str,
+        verbose=False, listener:Listener|None=None
 ):
     """Run if current college capacity reaches 0."""
     if verbose: print(f"{c} has reached capacity!")
@@ -271,35 +358,34 @@ def college_oversubscription(
     
     if verbose: print(f"lowest priority in the matching for {c} is {lowest_priority}")
     
-    # unmatch lowest priority student and update their preference list, the college's priority list and assigned students, and the free and unassigned lists
+    # unmatch lowest priority student, move their cursor past the rejected preference and update the college's assigned students and the free and unassigned lists
     lowest_priority_student = extract_student(lowest_priority)
     students[lowest_priority_student].unassign_college()
+    if listener is not None: listener.on_college_rejection(lowest_priority_student, c)
     if verbose: print(f"{lowest_priority_student} unmatched with {matching[lowest_priority_student]}")
 
-    students[lowest_priority_student].preferences.remove(matching[lowest_priority_student])
-    if verbose: print(f"reduced preference list for {lowest_priority_student}: {students[lowest_priority_student].preferences}")
-
-    colleges[c].priorities.remove(lowest_priority)
-    if verbose: print(f"reduced priority list for {c}: {colleges[c].priorities}")
+    cursor[lowest_priority_student] += 1
+    if verbose: print(f"remaining preference list for {lowest_priority_student}: {students[lowest_priority_student].preferences[cursor[lowest_priority_student]:]}")
 
     colleges[c].unassign_student(lowest_priority)
     if verbose: print(f"reduced assignments to {c}: {colleges[c].assigned_students}")
 
     matching.pop(lowest_priority_student)
 
-    if students[lowest_priority_student].preferences:
+    if cursor[lowest_priority_student] < len(students[lowest_priority_student].preferences):
         free.append(lowest_priority_student)
     else:
         unassigned.append(lowest_priority_student)
+        if listener is not None: listener.on_exhaustion(lowest_priority_student)
         if verbose: print(f"{lowest_priority_student} has emptied their preference list and is unassigned")
     
     if verbose: print("new list of free students:",free)
 
 def route_oversubscription(
         students:dict[str,Student], colleges:dict[str,College],
-        free:list, matching:dict, unassigned:list,
-        s:str, c:str, r:str,
-        verbose=False
+        free:deque, matching:dict, unassigned:list,
+        cursor:dict[str,int], s:str, c:str, r:str,
+        verbose=False, listener:Listener|None=None
 ):
     """Run if current route capacity reaches 0."""
     if verbose: print(f"{r} has reached capacity!", f"{r} serves {c}", f"current priority list for {c}: {colleges[c].priorities}", sep="\n")
@@ -309,32 +395,38 @@ def route_oversubscription(
                         key=lambda student: ranking[match_to_priority(student,matching[student])], default=None)
     
     students[lowest_priority].unassign_college()
+    if listener is not None: listener.on_route_rejection(lowest_priority, r)
     if verbose: print(f"lowest priority routed student assigned to {c} is {lowest_priority}")
     if verbose: print(f"{lowest_priority} unmatched with {matching[lowest_priority]}")
 
-    students[lowest_priority].preferences.remove(matching[lowest_priority])
-    if verbose: print(f"reduced preference list for {lowest_priority}: {students[lowest_priority].preferences}")
-
-    colleges[c].priorities.remove((r,lowest_priority))
-    if verbose: print(f"reduced priority list for {c}: {colleges[c].priorities}")
+    cursor[lowest_priority] += 1
+    if verbose: print(f"remaining preference list for {lowest_priority}: {students[lowest_priority].preferences[cursor[lowest_priority]:]}")
 
     colleges[c].unassign_student((r,lowest_priority))
     if verbose: print(f"reduced assignments to {c}: {colleges[c].assigned_students}")
 
     matching.pop(lowest_priority)
 
-    if students[lowest_priority].preferences:
+    if cursor[lowest_priority] < len(students[lowest_priority].preferences):
         free.append(lowest_priority)
     else:
         unassigned.append(lowest_priority)
+        if listener is not None: listener.on_exhaustion(lowest_priority)
         if verbose: print(f"{lowest_priority} has emptied their preference list and is unassigned")
     
     if verbose: print("new list of free students:",free)
 
-def greedy_matching(student_names:list, students:dict[str,Student], colleges:dict[str,College], routes:dict[str,Route], verbose=False):
-    """Greedy matching algorithm"""
+def greedy_matching(student_names:list, students:dict[str,Student], colleges:dict[str,College], routes:dict[str,Route], rng:Random,
+                    verbose=False, listener:Listener|None=None):
+    """Greedy matching algorithm in a random order drawn from `rng`, leaving student preferences untouched.
+
+    A `listener` receives every proposal, hold, rejection and exhaustion, and the time of the "matching" phase.
+    """
+    timer = PhaseTimer(listener)
     free = student_names.copy()
-    shuffle(free)
+    rng.shuffle(free)
+    free = deque(free)
+    cursor = {s:0 for s in student_names}
     matching = {}
     unassigned = []
 
@@ -342,16 +434,19 @@ def greedy_matching(student_names:list, students:dict[str,Student], colleges:dic
         print(free) if verbose else None
 
         # pop the first student in the list
-        s = free.pop(0)
+        s = free.popleft()
 
         # handle empty preference lists
-        if not students[s].preferences:
+        if cursor[s] == len(students[s].preferences):
             unassigned.append(s)
+            if listener is not None: listener.on_exhaustion(s)
             print(f"student {s} has emptied their preference list and is unassigned", "-"*50, sep="\n") if verbose else None
             continue
 
-        # pop the top college on s's preference list and handle empty preference lists
-        p = students[s].preferences.pop(0)
+        # take the next college on s's preference list
+        p = students[s].preferences[cursor[s]]
+        cursor[s] += 1
+        if listener is not None: listener.on_proposal(s, p)
 
         #handle oversubscription
         r = extract_route(p)
@@ -363,12 +458,15 @@ def greedy_matching(student_names:list, students:dict[str,Student], colleges:dic
                 students[s].assign_college(c)
                 colleges[c].assign_student(match_to_priority(s,p))
                 routes[r].capacity -= 1 ;colleges[c].capacity -= 1
+                if listener is not None: listener.on_hold(s, p)
             elif routes[r].capacity and not colleges[c].capacity:
                 print("COLLEGE CAPACITY") if verbose else None
+                if listener is not None: listener.on_college_rejection(s, c)
                 free.append(s)
                 continue
             else:
                 print("ROUTE CAPACITY") if verbose else None
+                if listener is not None: listener.on_route_rejection(s, r)
                 free.append(s)
                 continue
         
@@ -378,10 +476,13 @@ def greedy_matching(student_names:list, students:dict[str,Student], colleges:dic
                 students[s].assign_college(c)
                 colleges[c].assign_student(match_to_priority(s,p))
                 colleges[c].capacity -= 1
+                if listener is not None: listener.on_hold(s, p)
             else:
                 print("COLLEGE CAPACITY") if verbose else None
+                if listener is not None: listener.on_college_rejection(s, c)
                 free.append(s)
                 continue
+    timer.lap("matching")
     
     di = dissimilarity_index(students, colleges)
     print(di) if verbose else None
@@ -393,11 +494,16 @@ def greedy_matching(student_names:list, students:dict[str,Student], colleges:dic
 def routed_acceptance(
         student_names:list[str], college_priorities:dict[str,list],
         students:dict[str,Student], colleges:dict[str,College], routes:dict[str,Route],
-        verbose=False
+        verbose=False, listener:Listener|None=None
 ):
-    """Modified Deferred Accepance algorithm."""
+    """Modified Deferred Accepance algorithm, leaving student preferences and college priorities untouched.
 
-    free = student_names.copy()
+    A `listener` receives every proposal, hold, rejection and exhaustion, and the time of the "matching" phase.
+    """
+    timer = PhaseTimer(listener)
+
+    free = deque(student_names)
+    cursor = {s:0 for s in student_names}
     matching = {}
     unassigned = []
     n_proposals = 0
@@ -412,14 +518,16 @@ def routed_acceptance(
               sep="\n") if verbose else None
 
         # assign first student in the list of free students
-        s = free.pop(0) # argument selects the first student in the list
+        s = free.popleft()
+        remaining = students[s].preferences[cursor[s]:] if verbose else None
         print(f"assigning student {s}",
-              f"{s} has preferences:\n {students[s].preferences}" if students[s].preferences else f"{s} has emptied their preference list",
+              f"{s} has remaining preferences:\n {remaining}" if remaining else f"{s} has emptied their preference list",
               sep="\n") if verbose else None
 
         # handle empty preference lists
-        if not students[s].preferences:
+        if cursor[s] == len(students[s].preferences):
             unassigned.append(s)
+            if listener is not None: listener.on_exhaustion(s)
             print(f"student {s} has emptied their preference list and is unassigned",
                   "-"*50, sep="\n") if verbose else None
             continue
@@ -428,7 +536,8 @@ def routed_acceptance(
         n_proposals += 1
 
         # identify first student's top preference
-        p = students[s].preferences[0]
+        p = students[s].preferences[cursor[s]]
+        if listener is not None: listener.on_proposal(s, p)
         print(f"{s}'s top preference is {p}", "-"*50, sep="\n") if verbose else None
 
         # extract route and college from s's top preference
@@ -442,6 +551,7 @@ def routed_acceptance(
         # update assigned students and colleges
         colleges[c].assign_student(match_to_priority(s,p))
         students[s].assign_college(p)
+        if listener is not None: listener.on_hold(s, p)
         print("assigned students:", *[f" {x}, {y.assigned_students}" for x,y in colleges.items()], "-"*50, sep="\n") if verbose else None
 
         # handle oversubscription
@@ -450,19 +560,20 @@ def routed_acceptance(
                 routes[r].capacity -= 1; colleges[c].capacity -= 1
                 continue
             elif routes[r].capacity and not colleges[c].capacity:
-                college_oversubscription(students,colleges,free,matching,unassigned,college_priorities,c)
+                college_oversubscription(students,colleges,free,matching,unassigned,college_priorities,cursor,c,verbose,listener)
                 continue
             else:
-                route_oversubscription(students,colleges,free,matching,unassigned,s,c,r)
+                route_oversubscription(students,colleges,free,matching,unassigned,cursor,s,c,r,verbose,listener)
                 continue
         else:
             if colleges[c].capacity:
                 colleges[c].capacity -= 1
                 continue
             else:
-                college_oversubscription(students,colleges,free,matching,unassigned,college_priorities,c)
+                college_oversubscription(students,colleges,free,matching,unassigned,college_priorities,cursor,c,verbose,listener)
                 continue
 
+    timer.lap("matching")
     print(f"final number of proposals: {n_proposals}",
           f"maximum number of proposals: {len(students)*len(colleges)}",
           f"ratio: {100*n_proposals/(len(students)*len(colleges))}",
@@ -575,42 +686,67 @@ def compare_college_quality(students_1:dict[str,Student], students_2:dict[str,St
         pass
     return quality_comparison, sum(quality_comparison.values())/len(quality_comparison) if quality_comparison else 0
 
-def visualize(students:dict[str,Student], colleges:dict[str,College], dzones:dict[str,Dzone], grid_size, n_cols=1, plot_number=0):
-    """Visualize locations of students, colleges, and disadvantaged zones."""
-    fig, ax = plt.subplots(ncols=n_cols, figsize=(10*n_cols, 10))
-    
-    # Plot assignment lines first (so they appear behind points)
-    for s in students.values():
-        if hasattr(s, 'assigned_college') and s.assigned_college:
-            c = extract_college(s.assigned_college)
-            r = extract_route(s.assigned_college)
-            if r: color = "green"; alpha = 0.6
-            # elif c in s.local_colleges and s.SES: color = "purple"; alpha = 0.6
-            # elif c in s.local_colleges: color = "brown"; alpha = 0.6
-            elif s.SES: color = "blue"; alpha = 0.3
-            elif not s.SES: color = "red"; alpha = 0.3
-            if n_cols == 1: ax.plot(
-                [s.location[0], colleges[c].location[0]],
-                [s.location[1], colleges[c].location[1]],
-                color=color, alpha=alpha, linewidth=1
-            )
-            else: ax[plot_number].plot(
-                [s.location[0], colleges[c].location[0]],
-                [s.location[1], colleges[c].location[1]],
-                color=color, alpha=alpha, linewidth=1
-            )
-    
-    # Plot students
-    rich_student_locs = [s.location for s in students.values() if s.SES]
-    ax.scatter(*zip(*rich_student_locs), c='purple', s=30, alpha=0.6, label='High-type students', zorder=3)
-    poor_student_locs = [s.location for s in students.values() if not s.SES]
-    ax.scatter(*zip(*poor_student_locs), c='green', s=30, alpha=0.6, label='Low-type students', zorder=3)
-    
+def visualize(students:dict[str,Student], colleges:dict[str,College], dzones:dict[str,Dzone], grid_size, n_cols=1, plot_number=0,
+              ax=None, mode="points", bins=200, rasterize_above=5000):
+    """Visualize locations of students, colleges, and disadvantaged zones.
+
+    Assignment lines are drawn as one line collection per category and the student layers are
+    rasterized beyond `rasterize_above` students, so large instances render quickly and stay small.
+
+    Args:
+        n_cols (int, optional): Number of side-by-side panels in a new figure. Defaults to 1.
+        plot_number (int, optional): Panel of the new figure to draw on. Defaults to 0.
+        ax (Axes, optional): Existing panel to draw on instead, e.g. `fig.axes[1]` of an earlier call.
+        mode (str, optional): "points" draws every student and assignment, "density" draws a heatmap
+            of student counts over `bins` x `bins` cells instead, for very large instances. The
+            panel spans the grid, widened to any student placed outside it.
+    """
+    if ax is None:
+        fig, axes = plt.subplots(ncols=n_cols, figsize=(10*n_cols, 10))
+        ax = np.atleast_1d(axes)[plot_number]
+    fig = ax.figure
+    rasterized = len(students) > rasterize_above
+    locations = np.array([s.location for s in students.values()], dtype=float).reshape(-1, 2)
+    ses = np.array([bool(s.SES) for s in students.values()], dtype=bool)
+    # students can be placed off the grid (e.g. by the high SES offset)
+    low, high = locations.min(initial=0), locations.max(initial=grid_size)
+
+    if mode == "density":
+        counts, x_edges, y_edges = np.histogram2d(locations[:,0], locations[:,1], bins=bins,
+                                                  range=[[low, high], [low, high]])
+        image = ax.imshow(counts.T, origin="lower", extent=(low, high, low, high), cmap="Greys",
+                          interpolation="nearest", zorder=1)
+        fig.colorbar(image, ax=ax, fraction=0.046, pad=0.04, label="Students per cell")
+    elif mode == "points":
+        # Plot assignment lines first (so they appear behind points)
+        segments = {"green": [], "blue": [], "red": []}
+        for s in students.values():
+            if hasattr(s, 'assigned_college') and s.assigned_college:
+                c = extract_college(s.assigned_college)
+                r = extract_route(s.assigned_college)
+                if r: color = "green"
+                # elif c in s.local_colleges and s.SES: color = "purple"
+                # elif c in s.local_colleges: color = "brown"
+                elif s.SES: color = "blue"
+                else: color = "red"
+                segments[color].append((s.location, colleges[c].location))
+        for color,alpha in (("green", 0.6), ("blue", 0.3), ("red", 0.3)):
+            if segments[color]: ax.add_collection(LineCollection(
+                segments[color], colors=color, alpha=alpha, linewidths=1, zorder=2, rasterized=rasterized))
+
+        # Plot students
+        if ses.any(): ax.scatter(*locations[ses].T, c='purple', s=30, alpha=0.6, label='High-type students',
+                                 zorder=3, rasterized=rasterized)
+        if not ses.all(): ax.scatter(*locations[~ses].T, c='green', s=30, alpha=0.6, label='Low-type students',
+                                     zorder=3, rasterized=rasterized)
+    else:
+        raise ValueError(f"Unknown mode {mode}.")
+
     # Plot colleges with catchment areas (Manhattan distance = diamond shape)
-    for c in colleges.values():
+    for i,c in enumerate(colleges.values()):
         ax.scatter(*c.location, c='red', s=300, marker='s',
                   edgecolors='black', linewidths=2, zorder=4,
-                  label='School' if c == list(colleges.values())[0] else '')
+                  label='School' if i == 0 else '')
         # Manhattan distance creates a diamond/square rotated 45 degrees
         x, y = c.location
         r = c.catchment_area
@@ -620,18 +756,18 @@ def visualize(students:dict[str,Student], colleges:dict[str,College], dzones:dic
         ax.text(x, y, f"{c.name}\n{c.quality:.2g}", ha='center', va='center', fontsize=8, zorder=5)
     
     # Plot dzones (Manhattan distance = diamond shape)
-    for d in dzones.values():
+    for i,d in enumerate(dzones.values()):
         x, y = d.location
         r = d.radius
         diamond = plt.Polygon([(x+r, y), (x, y+r), (x-r, y), (x, y-r)], 
                              fill=True, facecolor='orange', alpha=0.6, 
                              edgecolor='orange', linewidth=2,
-                             label='Disadvantaged zone' if d == list(dzones.values())[0] else '')
+                             label='Disadvantaged zone' if i == 0 else '')
         ax.add_patch(diamond)
         ax.scatter(x, y, c='orange', s=100, marker='^', edgecolors='black', zorder=3)
     
-    ax.set_xlim(0, grid_size)
-    ax.set_ylim(0, grid_size)
+    ax.set_xlim(low, high)
+    ax.set_ylim(low, high)
     ax.set_aspect('equal')
     ax.legend()
     # ax.set_title('Student Assignment Simulation Map')
@@ -639,5 +775,5 @@ def visualize(students:dict[str,Student], colleges:dict[str,College], dzones:dic
     ax.set_ylabel('Y coordinate')
     ax.grid(True, alpha=0.3)
     
-    plt.tight_layout()
-    return fig
\ No newline at end of file
+    fig.tight_layout()
+    return fig
@@ -0,0 +1,43 @@
+import json
+import subprocess
+from pathlib import Path
+from new_mechanism import benchmarks
+
+STAGES = [
+    "generate_instance", "priority_ranks", "engine.deferred_acceptance", "engine.greedy_matching",
+    "engine.check_stability", "engine.dissimilarity_index",
+    "initialise", "utils.routed_acceptance", "utils.dissimilarity_index", "utils.check_stability", "utils.greedy_matching",
+]
+
+
+def test_commit_is_the_package_checkout(tmp_path, monkeypatch):
+    package = Path(benchmarks.__file__).resolve().parent
+    expected = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=package)
+    monkeypatch.chdir(tmp_path)
+    assert benchmarks._commit() == (expected.stdout.strip() if expected.returncode == 0 else None)
+
+
+def test_run_benchmarks_records_every_stage():
+    records = list(benchmarks.run_benchmarks(sizes=(60,), scenarios=("baseline", "tight"), memory=False))
+    for scenario in ("baseline", "tight"):
+        assert [r["stage"] for r in records if r["scenario"] == scenario] == STAGES
+    assert all(r["n_students"] == 60 and r["peak_bytes"] is None and r["seconds"] >= 0 for r in records)
+    counts = {r["stage"]:r for r in records if r["scenario"] == "baseline"}
+    assert counts["engine.check_stability"]["n_blocking_pairs"] == counts["utils.check_stability"]["n_blocking_pairs"] == 0
+
+    limited = list(benchmarks.run_benchmarks(sizes=(60,), scenarios=("baseline",), object_limit=50))
+    assert [r["stage"] for r in limited] == STAGES[:6] and all(r["peak_bytes"] > 0 for r in limited)
+
+
+def test_main_writes_and_compares(tmp_path, capsys):
+    args = ["--sizes", "60", "--scenarios", "few_routes", "--no-memory", "--check-limit", "0"]
+    benchmarks.main(args + ["--output", str(tmp_path/"before.jsonl")])
+    before = benchmarks.load_results(tmp_path/"before.jsonl")
+    assert len(before) == len(STAGES) - 1
+    capsys.readouterr()
+    benchmarks.main(args + ["--compare", str(tmp_path/"before.jsonl")])
+    out, err = capsys.readouterr()
+    after = [json.loads(line) for line in out.splitlines()]
+    ratios = benchmarks.compare(before, after)
+    assert [r["stage"] for r in ratios] == [r["stage"] for r in before]
+    assert err.count("few_routes") == len(ratios)
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from new_mechanism.__main__ import initialise
+from new_mechanism.compact import CompactInstance
+
+SEEDS = range(6)
+
+
+@pytest.mark.parametrize("enable_incomplete_lists", [False, True])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_objects_round_trip(seed, enable_incomplete_lists):
+    _, _, _, student_preferences, college_priorities, students, colleges, dzones, routes = initialise(
+        seed, enable_incomplete_lists=enable_incomplete_lists)
+    instance = CompactInstance.from_objects(students, colleges, dzones, routes)
+    assert (instance.n_students, instance.n_colleges, instance.n_routes, instance.n_dzones) == (
+        len(students), len(colleges), len(routes), len(dzones))
+
+    _, _, _, preferences, priorities, new_students, new_colleges, new_dzones, new_routes = instance.to_objects()
+    assert preferences == student_preferences
+    assert priorities == college_priorities
+    for s,student in students.items():
+        assert (new_students[s].location, new_students[s].SES) == (student.location, student.SES)
+        assert new_students[s].local_colleges == student.local_colleges
+        assert new_students[s].accesible_routes == student.accesible_routes
+    for c,college in colleges.items():
+        assert (new_colleges[c].location, new_colleges[c].catchment_area, new_colleges[c].capacity,
+                new_colleges[c].quality, new_colleges[c].routes) == (
+                college.location, college.catchment_area, college.capacity, college.quality, college.routes)
+    for r,route in routes.items():
+        assert (new_routes[r].capacity, new_routes[r].college, new_routes[r].dzone) == (route.capacity, route.college, route.dzone)
+
+    again = CompactInstance.from_objects(new_students, new_colleges, new_dzones, new_routes)
+    for name,value in vars(instance).items():
+        if isinstance(value, np.ndarray): assert np.array_equal(getattr(again, name), value), name
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_arrays_are_read_only(seed):
+    *_, students, colleges, dzones, routes = initialise(seed)
+    instance = CompactInstance.from_objects(students, colleges, dzones, routes)
+    arrays = [v for v in vars(instance).values() if isinstance(v, np.ndarray)] + [instance.option_college, instance.pref_ranks]
+    for value in arrays:
+        with pytest.raises(ValueError): value[:1] = 0
+    assert np.array_equal(instance.pref_ranks, instance.priority_ranks())
+
+    # writable inputs are copied, read-only ones shared
+    capacity = np.array(instance.college_capacity)
+    replaced = instance.replace(college_capacity=capacity)
+    capacity[0] = 999
+    assert replaced.college_capacity[0] == instance.college_capacity[0]
+    assert np.shares_memory(replaced.pref_options, instance.pref_options)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_encoding(seed):
+    *_, students, colleges, dzones, routes = initialise(seed)
+    instance = CompactInstance.from_objects(students, colleges, dzones, routes)
+    for o in range(instance.n_colleges + instance.n_routes):
+        assert instance.encode_option(instance.decode_option(o)) == o
+    for i,s in enumerate(students.values()):
+        assert [instance.decode_option(o) for o in instance.preferences(i)] == s.preferences
+    for i,c in enumerate(colleges.values()):
+        assert [instance.decode_entry(e) for e in instance.priorities(i)] == c.priorities
@@ -0,0 +1,77 @@
+from random import Random
+import numpy as np
+import pytest
+from new_mechanism.__main__ import initialise
+from new_mechanism.compact import CompactInstance
+from new_mechanism.comparison import rank_matrix, quality_matrix, pareto_dominance, compare_matchings
+from new_mechanism import engine, utils
+
+SEEDS = range(6)
+
+
+def random_matchings(instance, rng, K, unassigned=0.0):
+    """K assignments drawing every student's option from their own list, plus one that improves on the first."""
+    matchings = []
+    for _ in range(K):
+        matchings.append([
+            -1 if rng.random() < unassigned else int(rng.choice(instance.preferences(s).tolist()))
+            for s in range(instance.n_students)
+        ])
+    better = matchings[0][:]
+    better[0] = int(instance.preferences(0)[0])
+    return matchings + [better, matchings[0][:]]
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_matches_object_comparisons(seed):
+    student_names, _, _, student_preferences, _, students, colleges, dzones, routes = initialise(seed, enable_routes=False)
+    instance = CompactInstance.from_objects(students, colleges, dzones, routes)
+    matchings = random_matchings(instance, Random(seed), 3)
+    dicts = [instance.decode_matching(m) for m in matchings]
+    result = compare_matchings(instance, matchings, block_size=7)
+
+    for i,m_i in enumerate(dicts):
+        for j,m_j in enumerate(dicts):
+            assert result["pareto_dominance"][i,j] == utils.compare_Pareto_performance(student_names, student_preferences, m_j, m_i)
+            _, share = utils.compare_college_quality(students, students, colleges, colleges, m_i, m_j, student_names)
+            assert result["quality_improvement"][i,j] == pytest.approx(share)
+    assert result["pareto_dominance"][len(dicts) - 2, 0] or matchings[-2] == matchings[0]
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_ranks_and_shares_with_routes_and_unassigned(seed):
+    *_, students, colleges, dzones, routes = initialise(seed, enable_incomplete_lists=True)
+    instance = CompactInstance.from_objects(students, colleges, dzones, routes)
+    matchings = random_matchings(instance, Random(seed), 3, unassigned=0.2) + [engine.deferred_acceptance(instance)]
+    result = compare_matchings(instance, matchings, block_size=5)
+
+    options = [instance.preferences(s).tolist() for s in range(instance.n_students)]
+    assignment = [getattr(m, "assignment", m) for m in matchings]
+    ranks = np.array([[options[s].index(m[s]) if m[s] >= 0 else len(options[s]) for m in assignment]
+                      for s in range(instance.n_students)])
+    assert (result["ranks"] == ranks).all() and (rank_matrix(instance, matchings) == ranks).all()
+    quality = quality_matrix(instance, matchings)
+    for s in range(instance.n_students):
+        for k,m in enumerate(assignment):
+            expected = instance.college_quality[instance.option_college[m[s]]] if m[s] >= 0 else -np.inf
+            assert quality[s,k] == expected
+
+    K = len(matchings)
+    for i in range(K):
+        for j in range(K):
+            weakly, strictly = (ranks[:,i] <= ranks[:,j]).all(), (ranks[:,i] < ranks[:,j]).any()
+            assert result["pareto_dominance"][i,j] == (weakly and strictly)
+            assert result["preference_improvement"][i,j] == pytest.approx((ranks[:,i] < ranks[:,j]).mean())
+            assert result["quality_improvement"][i,j] == pytest.approx((quality[:,i] > quality[:,j]).mean())
+    assert (pareto_dominance(ranks) == result["pareto_dominance"]).all()
+
+
+def test_rejects_foreign_matchings():
+    *_, students, colleges, dzones, routes = initialise(0)
+    instance = CompactInstance.from_objects(students, colleges, dzones, routes)
+    with pytest.raises(ValueError):
+        rank_matrix(instance, [[-1]*(instance.n_students - 1)])
+    unlisted = [-1]*instance.n_students
+    unlisted[0] = next(o for o in range(instance.n_colleges + instance.n_routes) if o not in instance.preferences(0))
+    with pytest.raises(ValueError):
+        rank_matrix(instance, [unlisted])
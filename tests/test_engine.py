@@ -0,0 +1,200 @@
+from random import Random
+import numpy as np
+import pytest
+from new_mechanism.__main__ import initialise
+from new_mechanism.compact import CompactInstance
+from new_mechanism.generation import generate_instance
+from new_mechanism import engine, utils
+
+SEEDS = range(8)
+# small worlds whose routes and colleges bind, so the route bookkeeping matters
+CONFIGS = [
+    dict(min_students=50, max_students=300),
+    dict(min_students=50, max_students=300, enable_incomplete_lists=True),
+    dict(min_students=100, max_students=300, min_route_capacity=0.01, max_route_capacity=0.05,
+         min_college_capacity=0.3, max_college_capacity=0.6),
+    dict(randomised=False, n_students=80, n_colleges=5, n_dzones=2, c_cap=12, r_cap=3,
+         min_dzone_radius=0.3, max_dzone_radius=0.3, enable_incomplete_lists=True),
+]
+
+
+@pytest.mark.parametrize("config", CONFIGS)
+@pytest.mark.parametrize("seed", SEEDS)
+def test_deferred_acceptance_matches_routed_acceptance(seed, config):
+    student_names, _, _, _, college_prefs, students, colleges, dzones, routes = initialise(seed, **config)
+    instance = CompactInstance.from_objects(students, colleges, dzones, routes)
+    state = engine.deferred_acceptance(instance)
+    *_, matching, unassigned_names, utils_di = utils.routed_acceptance(student_names, college_prefs, students, colleges, routes)
+    assert state.matching() == matching
+    assert state.unassigned_names() == unassigned_names
+    assert state.di == pytest.approx(utils_di, abs=1e-12)
+    assert state.college_capacity == [colleges[c].capacity for c in instance.college_names]
+    assert state.route_capacity == [routes[r].capacity for r in instance.route_names]
+
+
+@pytest.mark.parametrize("config", CONFIGS)
+@pytest.mark.parametrize("seed", SEEDS)
+def test_greedy_matching_matches_utils(seed, config):
+    student_names, _, _, _, _, students, colleges, dzones, routes = initialise(seed, **config)
+    instance = CompactInstance.from_objects(students, colleges, dzones, routes)
+    state = engine.greedy_matching(instance, Random(seed))
+    *_, matching, unassigned_names, utils_di = utils.greedy_matching(student_names, students, colleges, routes, Random(seed))
+    assert state.matching() == matching
+    assert state.unassigned_names() == unassigned_names
+    assert state.di == pytest.approx(utils_di, abs=1e-12)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_runs_share_one_instance(seed):
+    *_, students, colleges, dzones, routes = initialise(seed, **CONFIGS[2])
+    instance = CompactInstance.from_objects(students, colleges, dzones, routes)
+    arrays = {k:v.copy() for k,v in vars(instance).items() if isinstance(v, np.ndarray)}
+    first = engine.deferred_acceptance(instance)
+    engine.greedy_matching(instance, Random(seed))
+    second = engine.deferred_acceptance(instance)
+    assert (first.assignment, first.unassigned, first.college_capacity) == (second.assignment, second.unassigned, second.college_capacity)
+    for k,v in arrays.items(): assert np.array_equal(getattr(instance, k), v), k
+
+    # the rebuilt post-run objects are stable for deferred acceptance
+    _, _, _, student_preferences, college_priorities, _, run_colleges, _, run_routes, matching, unassigned = first.to_objects()
+    assert matching == first.matching()
+    assert utils.check_stability(student_preferences, college_priorities, run_colleges, run_routes, matching, unassigned) == []
+
+
+@pytest.mark.parametrize("config", CONFIGS)
+@pytest.mark.parametrize("seed", SEEDS)
+def test_check_stability_matches_utils(seed, config):
+    *_, students, colleges, dzones, routes = initialise(seed, **config)
+    instance = CompactInstance.from_objects(students, colleges, dzones, routes)
+    for state in (engine.deferred_acceptance(instance), engine.greedy_matching(instance, Random(seed))):
+        _, _, _, student_preferences, college_priorities, _, run_colleges, _, run_routes, matching, unassigned = state.to_objects()
+        expected = utils.check_stability(student_preferences, college_priorities, run_colleges, run_routes, matching, unassigned)
+        blocking_pairs = engine.check_stability(instance, state)
+        assert sorted((instance.student_names[s], instance.decode_option(o)) for s,o in blocking_pairs) == sorted(expected)
+
+    other = CompactInstance.from_objects(students, colleges, dzones, routes)
+    with pytest.raises(ValueError):
+        engine.check_stability(other, state)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_running_dissimilarity_index(seed):
+    *_, students, colleges, dzones, routes = initialise(seed, **CONFIGS[2])
+    instance = CompactInstance.from_objects(students, colleges, dzones, routes)
+    for run in (engine.deferred_acceptance, lambda instance, **kw: engine.greedy_matching(instance, Random(seed), **kw)):
+        state, traced = run(instance), run(instance, trace=True)
+        assert state.trace is None and traced.assignment == state.assignment
+        assert len(traced.trace) == traced.n_proposals
+        assert traced.trace[-1] == state.di == pytest.approx(engine.dissimilarity_index(instance, state.assignment), abs=1e-12)
+        *_, run_students, run_colleges, _, _, _, _ = state.to_objects()
+        assert state.diversity() == pytest.approx([run_colleges[c].show_diversity(run_students) for c in instance.college_names])
+
+
+@pytest.mark.parametrize("config", CONFIGS)
+@pytest.mark.parametrize("seed", SEEDS)
+def test_batched_deferred_acceptance(seed, config):
+    *_, students, colleges, dzones, routes = initialise(seed, **config)
+    instance = CompactInstance.from_objects(students, colleges, dzones, routes)
+    batched = engine.batched_deferred_acceptance(instance)
+    assert engine.check_stability(instance, batched) == []
+    assert batched.di == pytest.approx(engine.dissimilarity_index(instance, batched.assignment), abs=1e-12)
+    if config is CONFIGS[-1]: return # its tight routes let the sequential engine's route bookkeeping drift
+    state = engine.deferred_acceptance(instance)
+    assert batched.assignment == state.assignment
+    assert sorted(batched.unassigned) == sorted(state.unassigned)
+    # the sequential remaining route capacities drift even when the matchings agree
+    assert (batched.college_capacity, batched.n_proposals) == (state.college_capacity, state.n_proposals)
+
+
+@pytest.mark.parametrize("prefix", [1, 3])
+@pytest.mark.parametrize("config", [
+    dict(min_students=100, max_students=300, min_college_capacity=0.3, max_college_capacity=0.6),
+    dict(min_students=100, max_students=300, enable_incomplete_lists=True),
+    # many routes, each available to few students
+    dict(min_students=100, max_students=300, min_colleges=20, max_colleges=30, min_dzones=8, max_dzones=8, min_dzone_radius=0.05),
+])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_lazy_preferences_give_the_same_matchings(seed, config, prefix):
+    full = generate_instance(seed, **config)
+    runs = {
+        "deferred_acceptance": engine.deferred_acceptance,
+        "greedy_matching": lambda instance: engine.greedy_matching(instance, Random(seed)),
+        "batched_deferred_acceptance": engine.batched_deferred_acceptance,
+    }
+    for name,run in runs.items():
+        lazy = generate_instance(seed, preference_prefix=prefix, **config)
+        assert np.array_equal(lazy.prio_entries, full.prio_entries)
+        state, expected = run(lazy), run(full)
+        assert (state.assignment, state.unassigned, state.n_proposals) == (expected.assignment, expected.unassigned, expected.n_proposals), name
+        # runs only sort the lists they reach
+        assert lazy._pref_options is None
+        assert np.array_equal(lazy.pref_options, full.pref_options) and np.array_equal(lazy.pref_ranks, full.pref_ranks)
+
+
+def changed_names(old, new):
+    before = dict(zip(old.instance.student_names, (old.instance.decode_option(o) if o >= 0 else None for o in old.assignment)))
+    return {name for name,o in zip(new.instance.student_names, new.assignment)
+            if name not in before or before[name] != (new.instance.decode_option(o) if o >= 0 else None)}
+
+
+def rematch_cases(instance, rng):
+    """(old instance, new instance) pairs for every kind of change rematch supports."""
+    college_capacity = np.maximum(instance.college_capacity + rng.integers(-10, 11, instance.n_colleges), 0)
+    route_capacity = np.maximum(instance.route_capacity + rng.integers(-5, 6, instance.n_routes), 0)
+    names = rng.choice(instance.student_names, max(1, instance.n_students//10), replace=False).tolist()
+    return {
+        "college_capacity": (instance, instance.with_capacities(college_capacity=college_capacity)),
+        "route_capacity": (instance, instance.with_capacities(route_capacity=route_capacity)),
+        "both_capacities": (instance, instance.with_capacities(college_capacity, route_capacity)),
+        "removed_students": (instance, instance.without_students(names)),
+        "added_students": (instance.without_students(names), instance),
+    }
+
+
+@pytest.mark.parametrize("config", CONFIGS)
+@pytest.mark.parametrize("seed", SEEDS)
+def test_rematch_equals_rerun(seed, config):
+    *_, students, colleges, dzones, routes = initialise(seed, **config)
+    instance = CompactInstance.from_objects(students, colleges, dzones, routes)
+    for kind,(old, new) in rematch_cases(instance, np.random.default_rng(seed)).items():
+        state = engine.batched_deferred_acceptance(old)
+        assignment = state.assignment[:]
+        warm, changed = engine.rematch(state, new)
+        rerun = engine.batched_deferred_acceptance(new)
+        assert warm.instance is new and state.assignment == assignment, kind
+        assert warm.assignment == rerun.assignment, kind
+        assert sorted(warm.unassigned) == sorted(rerun.unassigned), kind
+        assert warm.di == pytest.approx(rerun.di, abs=1e-12), kind
+        assert changed == changed_names(state, warm), kind
+        assert engine.check_stability(new, warm) == [], kind
+
+
+@pytest.mark.parametrize("exact_routes", [False, True])
+@pytest.mark.parametrize("config", CONFIGS)
+@pytest.mark.parametrize("seed", SEEDS)
+def test_capacity_sweep_equals_fresh_runs(seed, config, exact_routes):
+    *_, students, colleges, dzones, routes = initialise(seed, **config)
+    instance = CompactInstance.from_objects(students, colleges, dzones, routes)
+    fresh = engine.batched_deferred_acceptance if exact_routes else engine.deferred_acceptance
+    college_levels = [np.maximum((instance.college_capacity*f).astype(int), 0) for f in (1.0, 0.6, 1.2, 0.8, 0.3)]
+    route_levels = [np.full(instance.n_routes, k) for k in (30, 2, 10, 5, 1)]
+    sweeps = {
+        "colleges": dict(college_capacities=college_levels),
+        "routes": dict(route_capacities=route_levels),
+        "both": dict(college_capacities=college_levels, route_capacities=route_levels),
+    }
+    for kind,sweep in sweeps.items():
+        records = engine.capacity_sweep(instance, exact_routes=exact_routes, assignments=True, **sweep)
+        assert [r["level"] for r in records] == list(range(5)), kind
+        for k,record in enumerate(records):
+            state = fresh(instance.with_capacities(
+                sweep["college_capacities"][k] if "college_capacities" in sweep else None,
+                sweep["route_capacities"][k] if "route_capacities" in sweep else None))
+            assert list(record["assignment"]) == state.assignment, (kind, k)
+            assert record["n_unassigned"] == len(state.unassigned), (kind, k)
+            assert record["dissimilarity_index"] == pytest.approx(state.di, abs=1e-12), (kind, k)
+
+    with pytest.raises(ValueError):
+        engine.capacity_sweep(instance)
+    with pytest.raises(ValueError):
+        engine.capacity_sweep(instance, college_levels, route_levels[:2])
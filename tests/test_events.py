@@ -0,0 +1,71 @@
+from random import Random
+import pytest
+from new_mechanism.__main__ import initialise
+from new_mechanism.compact import CompactInstance
+from new_mechanism.events import Listener, Profiler, PhaseTimer
+from new_mechanism import engine, utils
+
+SEEDS = range(6)
+CONFIG = dict(min_students=100, max_students=300, min_route_capacity=0.01, max_route_capacity=0.05,
+              min_college_capacity=0.3, max_college_capacity=0.6, enable_incomplete_lists=True)
+
+
+class Recorder(Listener):
+    def __init__(self):
+        self.events, self.phases = [], []
+
+    def on_phase(self, phase, seconds): self.phases.append(phase)
+    def on_proposal(self, student, option): self.events.append(("proposal", student, option))
+    def on_hold(self, student, option): self.events.append(("hold", student, option))
+    def on_college_rejection(self, student, college): self.events.append(("college_rejection", student, college))
+    def on_route_rejection(self, student, route): self.events.append(("route_rejection", student, route))
+    def on_exhaustion(self, student): self.events.append(("exhaustion", student))
+
+
+def named(instance, events):
+    """Compact events with ids replaced by the names and preferences the object mechanisms report."""
+    decode = {
+        "proposal": instance.decode_option, "hold": instance.decode_option,
+        "college_rejection": lambda c: instance.college_names[c], "route_rejection": lambda r: instance.route_names[r],
+    }
+    return [(kind, instance.student_names[s], *(decode[kind](x) for x in rest)) for kind,s,*rest in events]
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_engines_and_object_mechanisms_emit_the_same_events(seed):
+    student_names, _, _, _, college_prefs, students, colleges, dzones, routes = initialise(seed, **CONFIG)
+    instance = CompactInstance.from_objects(students, colleges, dzones, routes)
+    compact_da, compact_greedy, objects_greedy = Recorder(), Recorder(), Recorder()
+    state = engine.deferred_acceptance(instance, listener=compact_da)
+    engine.greedy_matching(instance, Random(seed), listener=compact_greedy)
+    objects_da = Recorder()
+    utils.routed_acceptance(student_names, college_prefs, students, colleges, routes, listener=objects_da)
+    # the object mechanisms consume their instance
+    *_, students, colleges, _, routes = initialise(seed, **CONFIG)
+    utils.greedy_matching(student_names, students, colleges, routes, Random(seed), listener=objects_greedy)
+
+    assert named(instance, compact_da.events) == objects_da.events
+    assert named(instance, compact_greedy.events) == objects_greedy.events
+    assert compact_da.phases == ["setup", "matching"]
+    assert sum(kind == "proposal" for kind,*_ in compact_da.events) == state.n_proposals
+    assert sum(kind == "exhaustion" for kind,*_ in compact_da.events) == len(state.unassigned)
+
+
+def test_profiler_counts_events():
+    *_, students, colleges, dzones, routes = initialise(1, **CONFIG)
+    instance = CompactInstance.from_objects(students, colleges, dzones, routes)
+    recorder, profiler = Recorder(), Profiler()
+    engine.deferred_acceptance(instance, listener=recorder)
+    engine.deferred_acceptance(instance, listener=profiler)
+    for kind in ("proposal", "hold", "college_rejection", "route_rejection", "exhaustion"):
+        assert profiler.counts[kind] == sum(e[0] == kind for e in recorder.events)
+    assert set(profiler.phases) == {"setup", "matching"} and all(t >= 0 for t in profiler.phases.values())
+
+
+def test_phase_timer():
+    PhaseTimer(None).lap("setup")
+    recorder = Recorder()
+    timer = PhaseTimer(recorder)
+    timer.lap("setup")
+    timer.lap("matching")
+    assert recorder.phases == ["setup", "matching"]
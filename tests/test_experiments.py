@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from new_mechanism.experiments import parameter_grid, count_proposals, run_point, run_experiments
+from new_mechanism.storage import ResultStore
+
+GRID = parameter_grid(max_students=[40, 80], enable_routes=[True, False])
+
+
+def without_time(records):
+    return sorted(({k:v for k,v in r.items() if k != "seconds"} for r in records),
+                  key=lambda r: (r["max_students"], r["enable_routes"], r["seed"], r["mechanism"]))
+
+
+def test_parameter_grid():
+    assert GRID == [
+        {"max_students": 40, "enable_routes": True}, {"max_students": 40, "enable_routes": False},
+        {"max_students": 80, "enable_routes": True}, {"max_students": 80, "enable_routes": False},
+    ]
+    assert parameter_grid() == [{}]
+
+
+def test_count_proposals():
+    preferences = {"s_1": ["c_1", "c_2"], "s_2": ["c_2", "c_1", ("r_1", "c_1")]}
+    assert count_proposals(preferences, {"s_1": "c_2"}, ["s_2"]) == 2 + 3
+
+
+def test_run_point_is_reproducible():
+    records = run_point(GRID[0], 3)
+    assert [r["mechanism"] for r in records] == ["routed_acceptance", "greedy_matching"]
+    assert records[0]["n_blocking_pairs"] == 0
+    assert without_time(records) == without_time(run_point(GRID[0], 3))
+    assert run_point(GRID[0], 3, blocking_pairs=False)[0]["n_blocking_pairs"] is None
+    with pytest.raises(ValueError):
+        run_point(GRID[0], 3, mechanisms=("serial_dictatorship",))
+
+
+def test_run_experiments_matches_run_point():
+    seeds = range(3)
+    expected = [r for params in GRID for seed in seeds for r in run_point(params, seed)]
+    records = list(run_experiments(GRID, seeds, processes=2, chunksize=2))
+    assert without_time(records) == without_time(expected)
+
+
+def test_run_experiments_resumes_from_store(tmp_path):
+    seeds = range(3)
+    expected = list(run_experiments(GRID, seeds, processes=2, blocking_pairs=False))
+    with ResultStore(tmp_path, flush_every=4) as store:
+        runs = run_experiments(GRID, seeds, processes=2, chunksize=1, blocking_pairs=False, store=store)
+        first = [next(runs) for _ in range(5)]
+        runs.close()
+    assert len(ResultStore(tmp_path)) == 5
+
+    store = ResultStore(tmp_path)
+    rest = list(run_experiments(GRID, seeds, processes=2, blocking_pairs=False, store=store))
+    assert len(rest) == len(expected) - 5
+    assert without_time(first + rest) == without_time(expected) == without_time(store.records())
+    assert list(run_experiments(GRID, seeds, processes=2, store=store)) == []
+
+    # numpy-typed seeds and grid values find the runs stored with plain ones
+    typed_grid = parameter_grid(max_students=np.array([40, 80]), enable_routes=np.array([True, False]))
+    assert list(run_experiments(typed_grid, np.arange(3), processes=2, store=store)) == []
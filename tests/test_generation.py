@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+from new_mechanism.generation import generate_instance, build_preferences, manhattan_distances
+
+SEEDS = range(8)
+CONFIGS = [
+    dict(min_students=50, max_students=400),
+    dict(min_students=50, max_students=400, enable_incomplete_lists=True),
+    dict(min_students=50, max_students=400, min_colleges=10, max_colleges=12, min_dzones=4, max_dzones=4, enable_routes=False),
+]
+
+
+@pytest.mark.parametrize("config", CONFIGS)
+@pytest.mark.parametrize("seed", SEEDS)
+def test_priorities_follow_set_priorities(seed, config):
+    instance = generate_instance(seed, **config)
+    *_, students, colleges, _, _ = instance.to_objects()
+    for i,college in enumerate(colleges.values()):
+        expected = [instance.decode_entry(e) for e in instance.priorities(i)]
+        college.set_priorities(students, enable_routes=config.get("enable_routes", True))
+        assert college.priorities == expected
+
+
+@pytest.mark.parametrize("config", CONFIGS)
+@pytest.mark.parametrize("seed", SEEDS)
+def test_preferences_list_accessible_options(seed, config):
+    instance = generate_instance(seed, **config)
+    *_, students, colleges, _, _ = instance.to_objects()
+    for s in students.values():
+        accessible = set(colleges)
+        if config.get("enable_routes", True):
+            accessible |= {(r,c.name) for c in colleges.values() for r in c.routes
+                           if r in s.accesible_routes and c.name not in s.local_colleges}
+        assert len(set(s.preferences)) == len(s.preferences)
+        if config.get("enable_incomplete_lists"): assert set(s.preferences) <= accessible and s.preferences
+        else: assert set(s.preferences) == accessible
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_locations(seed):
+    instance = generate_instance(seed, min_students=50, max_students=400)
+    college_xy = np.stack([instance.college_x, instance.college_y], axis=1)
+    assert len(np.unique(college_xy, axis=0)) == instance.n_colleges
+    high_quality = instance.college_quality >= 0.5
+    distance = manhattan_distances(instance.dzone_x, instance.dzone_y, instance.college_x[high_quality], instance.college_y[high_quality])
+    assert (distance > instance.college_catchment[high_quality] + 100).all()
+
+
+@pytest.mark.parametrize("incomplete", [False, True])
+@pytest.mark.parametrize("config", [
+    dict(min_students=50, max_students=400),
+    # many routes, each available to few students
+    dict(min_students=50, max_students=400, min_colleges=20, max_colleges=30, min_dzones=8, max_dzones=8, min_dzone_radius=0.05),
+])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_build_preferences_follows_set_preferences(seed, config, incomplete):
+    instance = generate_instance(seed, **config)
+    n_colleges = instance.n_colleges
+    distance = manhattan_distances(instance.student_x, instance.student_y, instance.college_x, instance.college_y)
+    local = distance <= instance.college_catchment
+    attended = manhattan_distances(instance.student_x, instance.student_y, instance.dzone_x, instance.dzone_y) <= instance.dzone_radius
+    served = instance.route_college >= 0
+    args = (instance.student_ses, instance.college_quality, distance, local, attended,
+            instance.route_college[served], instance.route_dzone[served])
+    pref_indptr, pref_options, routed_student, routed_route = build_preferences(np.random.default_rng(seed), *args, enable_incomplete_lists=incomplete)
+    # rows split into blocks draw the same noise
+    blocked = build_preferences(np.random.default_rng(seed), *args, enable_incomplete_lists=incomplete, block_size=50)
+    for array, expected in zip(blocked, (pref_indptr, pref_options, routed_student, routed_route)): assert np.array_equal(array, expected)
+    # routed options as they appear on the lists
+    is_routed = pref_options >= n_colleges
+    assert np.array_equal(routed_student, np.repeat(np.arange(instance.n_students), np.diff(pref_indptr))[is_routed])
+    assert np.array_equal(routed_route, pref_options[is_routed] - n_colleges)
+
+    rng = np.random.default_rng(seed)
+    noise = rng.random((instance.n_students, n_colleges + int(served.sum())))
+    expected_lists = []
+    option_college = np.concatenate([np.arange(n_colleges), instance.route_college[served]])
+    for s in range(instance.n_students):
+        weights = {}
+        for o,c in enumerate(option_college.tolist()):
+            routed = o >= n_colleges
+            if routed and not (attended[s, instance.route_dzone[o - n_colleges]] and not local[s, c]): continue
+            weight = (0.9*instance.college_quality[c] + 0.1*noise[s, o]) / max(distance[s, c], 1)
+            if local[s, c]: weight *= 2
+            if routed and not instance.student_ses[s]: weight *= 5
+            weights[o] = weight
+        expected_lists.append(sorted(weights, key=lambda o: weights[o], reverse=True))
+    lengths = [len(expected) for expected in expected_lists]
+    if incomplete: lengths = rng.integers(1, lengths, endpoint=True)
+    for s,(expected,length) in enumerate(zip(expected_lists, lengths)):
+        assert pref_options[pref_indptr[s]:pref_indptr[s+1]].tolist() == expected[:length]
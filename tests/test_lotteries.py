@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+from new_mechanism.__main__ import initialise
+from new_mechanism.compact import CompactInstance
+from new_mechanism.generation import generate_instance
+from new_mechanism.lotteries import priority_classes, break_ties, run_lotteries, assignment_shares
+from new_mechanism.streams import python_rng, numpy_rng
+from new_mechanism.utils import manhattan_distance, extract_route, extract_student, routed_acceptance
+from new_mechanism import engine
+
+SEEDS = range(6)
+# a coarse grid, so many applicants tie on distance
+CONFIG = dict(grid_size=40, min_students=60, max_students=150, min_route_capacity=0.01, max_route_capacity=0.05)
+
+
+def compact(seed, **config):
+    *_, students, colleges, dzones, routes = initialise(seed, **{**CONFIG, **config})
+    return CompactInstance.from_objects(students, colleges, dzones, routes), students, colleges
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_priority_classes(seed):
+    instance, students, colleges = compact(seed)
+    classes = priority_classes(instance)
+    assert len(classes) == len(instance.prio_entries) and (np.diff(classes) >= 0).all()
+    for i,c in enumerate(colleges.values()):
+        n_high = sum(1 for p in c.priorities if extract_route(p)) + sum(
+            1 for s in students.values() if manhattan_distance(s.location, c.location) <= c.catchment_area)
+        keys = [(k < n_high, max(manhattan_distance(students[extract_student(p)].location, c.location), 1))
+                for k,p in enumerate(c.priorities)]
+        college_classes = classes[instance.prio_indptr[i]:instance.prio_indptr[i+1]].tolist()
+        for k in range(1, len(keys)):
+            assert (college_classes[k] == college_classes[k-1]) == (keys[k] == keys[k-1])
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_enable_ties(seed):
+    instance, _, _ = compact(seed)
+    tied, _, _ = compact(seed, enable_ties=True)
+    ties = python_rng(seed, "ties")
+    lottery = np.array([ties.random() for _ in range(instance.n_students)])
+    broken = break_ties(instance, lottery)
+    assert np.array_equal(tied.prio_entries, broken.prio_entries)
+    assert np.array_equal(tied.priority_ranks(), broken.pref_ranks)
+    assert np.array_equal(tied.pref_options, instance.pref_options)
+
+    generated = generate_instance(seed, **CONFIG)
+    generated_tied = generate_instance(seed, enable_ties=True, **CONFIG)
+    broken = break_ties(generated, numpy_rng(seed, "ties").random(generated.n_students))
+    assert np.array_equal(generated_tied.prio_entries, broken.prio_entries)
+    assert not np.array_equal(generated_tied.prio_entries, generated.prio_entries)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_break_ties_keeps_classes_and_maps_ranks(seed):
+    instance, _, _ = compact(seed)
+    classes = priority_classes(instance)
+    rng = np.random.default_rng(seed)
+    for lottery in (rng.random(instance.n_students), rng.random((instance.n_colleges, instance.n_students))):
+        broken = break_ties(instance, lottery, classes)
+        assert np.array_equal(broken.pref_ranks, broken.priority_ranks())
+        assert np.array_equal(priority_classes(broken), classes)
+        for i in range(instance.n_colleges):
+            entries = broken.priorities(i)
+            assert sorted(entries.tolist()) == sorted(instance.priorities(i).tolist())
+            draw = lottery if lottery.ndim == 1 else lottery[i]
+            college_classes = classes[instance.prio_indptr[i]:instance.prio_indptr[i+1]]
+            for k in range(1, len(entries)):
+                if college_classes[k] == college_classes[k-1]:
+                    assert draw[entries[k-1] % instance.n_students] <= draw[entries[k] % instance.n_students]
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_run_lotteries_matches_routed_acceptance(seed):
+    instance, _, _ = compact(seed)
+    results = run_lotteries(instance, 3, seed)
+    assert results["assignment"].shape == (instance.n_students, 3)
+    rng = numpy_rng(seed, "lotteries")
+    for k in range(3):
+        student_names, _, _, _, college_prefs, students, colleges, _, routes = break_ties(
+            instance, rng.random(instance.n_students)).to_objects()
+        *_, matching, unassigned, di = routed_acceptance(student_names, college_prefs, students, colleges, routes)
+        assert instance.decode_matching(results["assignment"][:,k]) == matching
+        assert results["n_unassigned"][k] == len(unassigned)
+        assert results["dissimilarity_index"][k] == pytest.approx(di, abs=1e-12)
+
+    multiple = run_lotteries(instance, 4, seed, mechanism=engine.batched_deferred_acceptance, tie_breaking="multiple")
+    shares = assignment_shares(instance, multiple["assignment"])
+    assert shares.shape == (instance.n_students, instance.n_colleges + 1)
+    assert np.allclose(shares.sum(axis=1), 1)
+    assert np.allclose(shares[:,-1], (multiple["assignment"] < 0).mean(axis=1))
+    with pytest.raises(ValueError):
+        run_lotteries(instance, 1, seed, tie_breaking="per_student")
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_batched_lanes_match_separate_runs(seed):
+    instance, _, _ = compact(seed)
+    classes = priority_classes(instance)
+    rng = np.random.default_rng(seed)
+    lanes = [break_ties(instance, rng.random(instance.n_students), classes) for _ in range(3)]
+    lanes.append(break_ties(instance, rng.random((instance.n_colleges, instance.n_students)), classes))
+    lanes.append(lanes[0].with_capacities(college_capacity=np.maximum(instance.college_capacity - 3, 0),
+                                          route_capacity=instance.route_capacity + 1))
+    assignment, unassigned, n_proposals = engine.batched_lanes(lanes)
+    assert assignment.shape == (len(lanes), instance.n_students)
+    for l,lane in enumerate(lanes):
+        state = engine.batched_deferred_acceptance(lane)
+        assert assignment[l].tolist() == state.assignment
+        assert unassigned[l] == state.unassigned and n_proposals[l] == state.n_proposals
+
+    other, _, _ = compact(seed + 100)
+    with pytest.raises(ValueError):
+        engine.batched_lanes([instance, other])
+
+    # lotteries give the same results whatever the number of lanes
+    one, several = (run_lotteries(instance, 5, seed, mechanism=engine.batched_deferred_acceptance, lanes=n_lanes)
+                    for n_lanes in (1, 3))
+    for name in one: assert np.allclose(one[name], several[name], rtol=0, atol=1e-12)
@@ -0,0 +1,108 @@
+from random import Random
+import numpy as np
+import pytest
+from new_mechanism.spatial import PointIndex, BallIndex, FreeSpaceSampler, expand_ranges
+from new_mechanism.utils import generate_free_location
+from new_mechanism.generation import place_points
+
+SEEDS = range(6)
+
+
+def random_points(rng, n, grid_size=200):
+    return rng.integers(0, grid_size + 1, n), rng.integers(0, grid_size + 1, n)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_expand_ranges(seed):
+    rng = np.random.default_rng(seed)
+    starts = rng.integers(0, 50, 20)
+    ends = starts + rng.integers(0, 5, 20)
+    expected = [i for start,end in zip(starts, ends) for i in range(start, end)]
+    assert expand_ranges(starts, ends).tolist() == expected
+    assert expand_ranges(starts, starts).tolist() == []
+
+
+@pytest.mark.parametrize("cell_size", [None, 1, 7, 500])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_point_index_query_matches_brute_force(seed, cell_size):
+    rng = np.random.default_rng(seed)
+    x, y = random_points(rng, 300)
+    index = PointIndex(x, y, cell_size=cell_size)
+    assert len(index) == 300
+    for qx, qy, r in zip(*random_points(rng, 40, grid_size=260), rng.integers(0, 80, 40)):
+        qx, qy = qx - 30, qy - 30
+        expected = np.flatnonzero(np.abs(x - qx) + np.abs(y - qy) <= r)
+        assert index.query(int(qx), int(qy), int(r)).tolist() == expected.tolist()
+
+
+def test_point_index_empty():
+    index = PointIndex([], [])
+    assert len(index) == 0
+    assert index.query(0, 0, 10).tolist() == []
+
+
+@pytest.mark.parametrize("cell_size", [None, 1, 13, 500])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_ball_index_matches_brute_force(seed, cell_size):
+    rng = np.random.default_rng(seed)
+    x, y = random_points(rng, 25)
+    radius = rng.integers(0, 40, 25)
+    index = BallIndex(x, y, radius, cell_size=cell_size)
+    qx, qy = random_points(rng, 200, grid_size=260)
+    qx, qy = qx - 30, qy - 30
+    inside = np.abs(x[None,:] - qx[:,None]) + np.abs(y[None,:] - qy[:,None]) <= radius[None,:]
+
+    indptr, ids = index.containing_many(qx, qy)
+    for i in range(len(qx)):
+        expected = np.flatnonzero(inside[i]).tolist()
+        assert index.containing(int(qx[i]), int(qy[i])).tolist() == expected
+        assert ids[indptr[i]:indptr[i+1]].tolist() == expected
+
+
+def free_points(grid_size, x, y, radius):
+    gx, gy = np.meshgrid(np.arange(grid_size + 1), np.arange(grid_size + 1), indexing="ij")
+    gx, gy = gx.ravel(), gy.ravel()
+    covered = (np.abs(gx[:,None] - x) + np.abs(gy[:,None] - y) <= radius).any(axis=1)
+    return list(zip(gx[~covered].tolist(), gy[~covered].tolist()))
+
+
+@pytest.mark.parametrize("block_size", [2**22, 7])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_free_space_sampler_matches_brute_force(seed, block_size):
+    rng = np.random.default_rng(seed)
+    grid_size = 40
+    x, y = random_points(rng, 6, grid_size)
+    radius = rng.integers(0, 15, 6)
+    sampler = FreeSpaceSampler(grid_size, x, y, radius, block_size=block_size)
+    free = free_points(grid_size, x, y, radius)
+
+    assert sampler.n_free == len(free)
+    for k,point in enumerate(free):
+        assert sampler.locate(k) == point
+        assert sampler.rank(*point) == k
+        assert not sampler.forbids(*point)
+
+    taken = {free[i] for i in rng.choice(len(free), 10, replace=False)} | {(x[0], y[0]), (-1, 3)}
+    remaining = [p for p in free if p not in taken]
+    assert sampler.n_available(taken) == len(remaining)
+    assert [sampler.point(k, taken) for k in range(len(remaining))] == remaining
+
+
+def test_generate_free_location_falls_back_to_sampler():
+    rng = Random(0)
+    sampler = FreeSpaceSampler(10, [5], [5], [9])
+    free = set(free_points(10, np.array([5]), np.array([5]), np.array([9])))
+    taken = set(list(free)[:len(free) - 1])
+    location = generate_free_location(rng, 10, taken, sampler, max_attempts=0)
+    assert location in free - taken
+    with pytest.raises(ValueError):
+        generate_free_location(rng, 10, free, sampler, max_attempts=0)
+
+
+def test_place_points_falls_back_to_sampler():
+    sampler = FreeSpaceSampler(10, [5], [5], [9])
+    free = set(free_points(10, np.array([5]), np.array([5]), np.array([9])))
+    points = place_points(np.random.default_rng(0), 10, len(free), sampler, max_rounds=0)
+    assert set(map(tuple, points.tolist())) == free
+    with pytest.raises(ValueError):
+        place_points(np.random.default_rng(0), 10, len(free) + 1, sampler)
@@ -0,0 +1,89 @@
+import json
+import shutil
+import numpy as np
+import pytest
+from new_mechanism.__main__ import initialise
+from new_mechanism.compact import CompactInstance
+from new_mechanism.storage import (INSTANCE_ARRAYS, INSTANCE_NAMES, save_instance, load_instance, save_matching, load_matching,
+                                   ResultStore, record_key)
+from new_mechanism import engine
+
+SEEDS = range(3)
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_instance_round_trip(tmp_path, seed, mmap):
+    *_, students, colleges, dzones, routes = initialise(seed, enable_incomplete_lists=True)
+    instance = CompactInstance.from_objects(students, colleges, dzones, routes)
+    loaded = load_instance(save_instance(instance, tmp_path/"instance"), mmap=mmap)
+    for name in INSTANCE_NAMES: assert getattr(loaded, name) == getattr(instance, name)
+    for name in INSTANCE_ARRAYS:
+        assert np.array_equal(getattr(loaded, name), getattr(instance, name))
+        assert getattr(loaded, name).dtype == getattr(instance, name).dtype
+        assert not getattr(loaded, name).flags.writeable
+    assert engine.deferred_acceptance(loaded).assignment == engine.deferred_acceptance(instance).assignment
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_matching_round_trip(tmp_path, seed):
+    *_, students, colleges, dzones, routes = initialise(seed)
+    instance = CompactInstance.from_objects(students, colleges, dzones, routes)
+    state = engine.deferred_acceptance(instance)
+    assignment, unassigned, metadata = load_matching(save_matching(state, tmp_path/"state", mechanism="da", seed=seed))
+    assert assignment.tolist() == state.assignment and unassigned.tolist() == state.unassigned
+    assert metadata == {"dissimilarity_index": state.di, "n_proposals": state.n_proposals, "mechanism": "da", "seed": seed}
+
+    # a plain assignment array gets its unassigned students from the -1 entries
+    assignment, unassigned, metadata = load_matching(save_matching([3, -1, 0, -1], tmp_path/"array"), mmap=False)
+    assert assignment.tolist() == [3, -1, 0, -1] and unassigned.tolist() == [1, 3] and metadata == {}
+
+
+def test_load_checks_kind_and_format(tmp_path):
+    save_matching([0], tmp_path/"matching")
+    with pytest.raises(ValueError):
+        load_instance(tmp_path/"matching")
+    meta = json.loads((tmp_path/"matching"/"meta.json").read_text())
+    (tmp_path/"matching"/"meta.json").write_text(json.dumps({**meta, "format": -1}))
+    with pytest.raises(ValueError):
+        load_matching(tmp_path/"matching")
+
+
+def test_result_store_resumes(tmp_path):
+    records = [{"seed": i, "mechanism": "da" if i % 2 else "greedy", "di": i/10, "n_blocking_pairs": None if i % 3 else i,
+                "params": {"max_students": 10*i, "sizes": [i, i]}} for i in range(7)]
+    with ResultStore(tmp_path, flush_every=3) as store:
+        for i,record in enumerate(records[:5]): store.append(record, f"run-{i}")
+        store.append(records[0], "run-0")
+        assert len(store.parts) == 1 and len(store) == 5
+    # a buffer that was never flushed is lost, and a half-written part is ignored
+    crashed = ResultStore(tmp_path, flush_every=3)
+    crashed.append(records[5], "run-5")
+    (tmp_path/".part-000002.tmp").mkdir()
+
+    store = ResultStore(tmp_path, flush_every=3)
+    assert len(store) == 5 and "run-4" in store and "run-5" not in store
+    store.append(records[5], "run-5")
+    store.append(records[6], "run-6")
+    store.flush()
+    assert list(ResultStore(tmp_path).records()) == records
+    assert store.column("di").tolist() == [r["di"] for r in records]
+    assert store.column("mechanism").tolist() == [r["mechanism"] for r in records]
+    assert store.column("missing").tolist() == [None]*7
+    assert store.column("params").tolist() == [r["params"] for r in records]
+
+    # meta.json only lists the columns, and a numeric scan reads nothing else
+    meta = json.loads((store.parts[0]/"meta.json").read_text())
+    assert set(meta) == {"format", "kind", "arrays", "n_records", "columns", "dtypes"}
+    assert meta["dtypes"] == {"seed": "<i8", "di": "<f8"}
+    for part in store.parts:
+        (part/"keys.json").unlink()
+        shutil.rmtree(part/"other")
+    assert store.column("di").tolist() == [r["di"] for r in records]
+
+
+def test_record_key_normalises_numpy_scalars():
+    plain = record_key({"max_students": 40, "min_route_capacity": 0.5, "enable_routes": True}, 3, "routed_acceptance")
+    typed = record_key({"max_students": np.int64(40), "min_route_capacity": np.float32(0.5), "enable_routes": np.bool_(True)},
+                       np.arange(5)[3], "routed_acceptance")
+    assert typed == plain
@@ -0,0 +1,65 @@
+import random
+import numpy as np
+import pytest
+from new_mechanism.__main__ import initialise
+from new_mechanism.generation import generate_instance
+from new_mechanism.streams import seed_sequence, python_rng, numpy_rng
+from new_mechanism.utils import Student, College
+
+SEEDS = range(4)
+
+
+def test_streams_are_reproducible_and_independent():
+    assert python_rng(3, "students").random() == python_rng(3, "students").random()
+    assert (numpy_rng(3, "students").random(5) == numpy_rng(3, "students").random(5)).all()
+    assert python_rng(3, "students").random() != python_rng(3, "colleges").random()
+    assert python_rng(3, "students").random() != python_rng(4, "students").random()
+
+    # an int seed and its SeedSequence give the same streams, spawned children differ
+    assert seed_sequence(3, "sizes").generate_state(4).tolist() == (
+        seed_sequence(np.random.SeedSequence(3), "sizes").generate_state(4).tolist())
+    children = np.random.SeedSequence(3).spawn(2)
+    draws = {numpy_rng(child, "sizes").random() for child in children} | {numpy_rng(3, "sizes").random()}
+    assert len(draws) == 3
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_initialise_is_deterministic_and_leaves_global_state(seed):
+    random.seed(0)
+    state = random.getstate()
+    first = initialise(seed, enable_incomplete_lists=True)
+    assert random.getstate() == state
+    random.seed(1)
+    second = initialise(seed, enable_incomplete_lists=True)
+    assert first[:5] == second[:5]
+    assert [s.location for s in first[5].values()] == [s.location for s in second[5].values()]
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_components_do_not_shift_each_other(seed):
+    # incomplete lists draw extra preference noise but leave every other component's draws alone
+    *_, students, colleges, dzones, _ = initialise(seed)
+    *_, cut_students, cut_colleges, cut_dzones, _ = initialise(seed, enable_incomplete_lists=True)
+    assert [(s.location, s.SES) for s in students.values()] == [(s.location, s.SES) for s in cut_students.values()]
+    assert [(c.location, c.quality) for c in colleges.values()] == [(c.location, c.quality) for c in cut_colleges.values()]
+    assert [(d.location, d.radius) for d in dzones.values()] == [(d.location, d.radius) for d in cut_dzones.values()]
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_generate_instance_is_deterministic(seed):
+    np.random.seed(0)
+    first = generate_instance(seed, enable_incomplete_lists=True)
+    np.random.seed(1)
+    second = generate_instance(seed, enable_incomplete_lists=True)
+    for name in ("student_x", "student_y", "student_ses", "college_quality", "pref_indptr", "pref_options", "prio_entries"):
+        assert (getattr(first, name) == getattr(second, name)).all()
+
+
+def test_agents_need_an_rng_to_draw_attributes():
+    with pytest.raises(ValueError):
+        Student("s_1", (0, 0))
+    with pytest.raises(ValueError):
+        College("c_1", (0, 0), 10, 10, [])
+    assert Student("s_1", (0, 0), SES=1).SES == 1
+    assert Student("s_1", (0, 0), rng=random.Random(0)).SES in (0, 1)
+    assert 0 <= College("c_1", (0, 0), 10, 10, [], rng=random.Random(0)).quality < 1
@@ -0,0 +1,64 @@
+from random import Random
+from collections import Counter
+import pytest
+from new_mechanism.__main__ import initialise
+from new_mechanism import utils
+
+SEEDS = range(6)
+CONFIG = dict(min_students=50, max_students=300, min_route_capacity=0.01, max_route_capacity=0.05,
+              min_college_capacity=0.3, max_college_capacity=0.6, enable_incomplete_lists=True)
+
+
+def check_capacities(objects, matching):
+    _, _, _, _, _, students, colleges, _, routes = objects
+    college_load = Counter(utils.extract_college(p) for p in matching.values())
+    route_load = Counter(r for p in matching.values() if (r:=utils.extract_route(p)))
+    for c,college in colleges.items():
+        assert college.capacity >= 0
+        assert sorted(college.assigned_students, key=str) == sorted(
+            (utils.match_to_priority(s,p) for s,p in matching.items() if utils.extract_college(p) == c), key=str)
+    return college_load, route_load
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_routed_acceptance_leaves_lists_intact(seed):
+    objects = initialise(seed, **CONFIG)
+    student_names, _, _, student_prefs, college_prios, students, colleges, _, routes = objects
+    *_, matching, unassigned, _ = utils.routed_acceptance(student_names, college_prios, students, colleges, routes)
+    assert {s:students[s].preferences for s in student_names} == student_prefs
+    assert {c:colleges[c].priorities for c in colleges} == college_prios
+    assert set(matching).isdisjoint(unassigned) and set(matching) | set(unassigned) == set(student_names)
+    for s,p in matching.items(): assert p in student_prefs[s]
+    check_capacities(objects, matching)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_greedy_matching_respects_capacities(seed):
+    objects = initialise(seed, **CONFIG)
+    student_names, _, _, student_prefs, _, students, colleges, _, routes = objects
+    capacity = {c:college.capacity for c,college in colleges.items()}
+    route_capacity = {r:route.capacity for r,route in routes.items()}
+    *_, matching, unassigned, _ = utils.greedy_matching(student_names, students, colleges, routes, Random(seed))
+    assert {s:students[s].preferences for s in student_names} == student_prefs
+    assert set(matching).isdisjoint(unassigned) and set(matching) | set(unassigned) == set(student_names)
+    college_load, route_load = check_capacities(objects, matching)
+    for c,load in college_load.items(): assert load + colleges[c].capacity == capacity[c]
+    for r,load in route_load.items(): assert load + routes[r].capacity == route_capacity[r]
+    # an unassigned student found no room on any option
+    for s in unassigned:
+        for p in student_prefs[s]:
+            r = utils.extract_route(p)
+            assert not colleges[utils.extract_college(p)].capacity or (r and not routes[r].capacity)
+
+
+@pytest.mark.parametrize("enable_routes", [True, False])
+@pytest.mark.parametrize("seed", SEEDS)
+def test_set_priorities(seed, enable_routes):
+    *_, students, colleges, _, _ = initialise(seed, min_students=50, max_students=300, enable_routes=enable_routes)
+    for college in colleges.values():
+        distance = lambda p: max(utils.manhattan_distance(students[utils.extract_student(p)].location, college.location), 1)
+        local = [s.name for s in students.values() if utils.manhattan_distance(s.location, college.location) <= college.catchment_area]
+        routed = [(r,s.name) for s in students.values() for p in s.preferences
+                  if (r:=utils.extract_route(p)) in college.routes and utils.extract_college(p) == college.name]
+        expected = sorted(local + routed, key=distance) + sorted(students, key=distance)
+        assert college.priorities == expected
@@ -0,0 +1,52 @@
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+import pytest
+from new_mechanism.__main__ import initialise
+from new_mechanism.utils import visualize, routed_acceptance, extract_route
+
+
+@pytest.fixture
+def matched():
+    student_names, _, _, _, college_prefs, students, colleges, dzones, routes = initialise(0)
+    *_, matching, _, _ = routed_acceptance(student_names, college_prefs, students, colleges, routes)
+    yield students, colleges, dzones, matching
+    plt.close("all")
+
+
+def test_points_draw_one_collection_per_category(matched):
+    students, colleges, dzones, matching = matched
+    fig = visualize(students, colleges, dzones, 1000, n_cols=2, plot_number=1, rasterize_above=0)
+    left, right = fig.axes
+    assert not left.collections
+    lines = {tuple(c.get_colors()[0][:3]): c for c in right.collections if isinstance(c, LineCollection)}
+    assert sum(len(c.get_segments()) for c in lines.values()) == len(matching)
+    routed = sum(1 for p in matching.values() if extract_route(p))
+    green = lines.get(matplotlib.colors.to_rgb("green"))
+    assert (len(green.get_segments()) if green else 0) == routed
+    student_layers = [c for c in right.collections if c.get_label().endswith("students")]
+    assert len(student_layers) == 2
+    assert all(c.get_rasterized() for c in student_layers + list(lines.values()))
+
+    # a later call can fill the other panel of the same figure
+    assert visualize(students, colleges, dzones, 1000, ax=left) is fig
+    assert any(isinstance(c, LineCollection) for c in left.collections)
+
+
+def test_density_mode(matched):
+    students, colleges, dzones, _ = matched
+    fig = visualize(students, colleges, dzones, 1000, mode="density", bins=20)
+    ax = fig.axes[0]
+    assert not any(isinstance(c, LineCollection) for c in ax.collections)
+    (image,) = ax.images
+    assert image.get_array().shape == (20, 20) and image.get_array().sum() == len(students)
+
+    # students off the grid widen the heatmap instead of being dropped
+    first, second = list(students.values())[:2]
+    first.location, second.location = (-30, 500), (200, 1040)
+    ax = visualize(students, colleges, dzones, 1000, mode="density", bins=20).axes[0]
+    assert ax.images[0].get_array().sum() == len(students)
+    assert ax.images[0].get_extent() == [-30, 1040, -30, 1040] and ax.get_xlim() == (-30, 1040)
+    with pytest.raises(ValueError):
+        visualize(students, colleges, dzones, 1000, mode="heatmap")